@@ -2,20 +2,36 @@ import os
 import time
 from os.path import exists
 from pathlib import Path
-from typing import List, Callable, Union
-import re
+from typing import List, Callable, Union, Dict, Optional
 
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room, rooms
 from flask import Flask, request
-from flask_cors import CORS, cross_origin
+from werkzeug.wsgi import wrap_file
+from urllib.parse import parse_qs, urlparse
+from flask_cors import CORS
 import flask
 import json
+import mimetypes
+import re
 import secrets
 import threading
-
-from src.Components.base import Row, Viewer, ElementTree, Col, SceneSettings, Group, CameraState
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.App.binary_protocol import JSON, BINARY, encode_message, decode_camera_sync, parse_encoding, \
+    encode_point_delta
+from src.App.message_bus import MessageBus, InProcessBus, CAMERA_SYNC, ANIMATION, SCENE_UPDATE
+from src.App.snapshot import load_snapshot, save_snapshot, configuration_key
+from src.App.thumbnails import ThumbnailCache
+from src.App.front_end import FrontEndCache, CachedFile, FRONT_END_DIRECTORY
+from src.App.file_cache import PathCache, ResolvedFile, NodeCache
+from src.App.prefetch import NodePrefetcher
+from src.App.scene import Scene
+from src.Components.base import CameraState
+from src.SceneElements.conversion import CONVERSIONS, ConversionQueue
+from src.SceneElements.lod import parse_region
 from src.SceneElements.elements import PotreePointCloud, DefaultPointCloud, LineSet, CameraTrajectory, \
-    BaseSceneElement
+    BaseSceneElement, PointCloudSequence, StreamingPointCloud, Incrementer
 
 
 # Allow all accesses by default. Only works for GET requests, see flask_cors for other requests.
@@ -32,251 +48,433 @@ def create_404_response(error: str):
     return set_cors_headers(response)
 
 
-class Tarasp:
-    app = Flask(__name__)
-    CORS(app)
-    socketio = SocketIO(app, cors_allowed_origins='*')
+def create_file_response(resolved: ResolvedFile, mimetype: str, as_attachment=False, content: bytes = None):
+    # Built from the cached stat, send_file would stat the file again. Range requests are still answered.
+    # 'content' is the file read ahead of time, see NodeCache.
+    if request.if_none_match.contains(resolved.etag):
+        response = flask.make_response('', 304)
+        response.set_etag(resolved.etag)
+        return set_cors_headers(response)
+    if content is None:
+        content = wrap_file(request.environ, open(resolved.path, 'rb'))
+    response = flask.Response(content, mimetype=mimetype, direct_passthrough=True)
+    response.content_length = resolved.size
+    response.last_modified = resolved.mtime
+    response.set_etag(resolved.etag)
+    response.cache_control.no_cache = True
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=resolved.path.name)
+    response.make_conditional(request, accept_ranges=True, complete_length=resolved.size)
+    return set_cors_headers(response)
 
-    COMPONENT_TREE = []
 
-    CURRENT_CAMERA_STATE = {}
+def create_cached_response(cached: CachedFile):
+    response = flask.make_response(cached.content)
+    response.mimetype = cached.mimetype
+    response.headers.set('Cache-Control', cached.cache_control)
+    response.set_etag(cached.etag)
+    response.make_conditional(request)
+    return set_cors_headers(response)
 
-    BASE_URL = 'http://127.0.0.1'
-    PORT = 5000
 
-    def __init__(self, port: int = 5000, output_path='./data/screenshots', print_component_tree=False):
-        self.PORT = port
-        BaseSceneElement.PORT = port
-        self.app.config['SECRET_KEY'] = secrets.token_hex(16)
+SCENE_ROOM_PREFIX = 'scene-'
 
-        Tarasp.app.config['UPLOAD_FOLDER'] = output_path
-        self.print_component_tree = print_component_tree
 
-        self._POINT_CLOUDS: [PotreePointCloud] = []
-        self._POTREE_POINT_CLOUDS: [DefaultPointCloud] = []
-        self._LINE_SETS: [LineSet] = []
-        self._CAMERA_TRAJECTORIES: [CameraTrajectory] = []
-        self._GROUPS: [Group] = []
+# Clients of a scene are split by their encoding, so every message is encoded once per encoding
+def scene_room(scene_id, encoding: str = JSON) -> str:
+    return f"{SCENE_ROOM_PREFIX}{scene_id}/{encoding}"
 
-    def run(self):
-        # 1. Convert SceneElements to source
-        self.convert_scene_elements()
 
-        # 2. Turn object tree into a json-component tree
-        self.create_component_tree()
+SCENE_PAGE = re.compile(r'/scene/(\d+)/?$')
 
-        # 3. Run the application. Open browser by default?
-        if self.print_component_tree:
-            print(json.dumps(self.COMPONENT_TREE[0], indent=2))
 
-        # Replace the Port number in the index.html to change it in the front-end
-        self.replace_front_end_settings()
+def page_scene_id(environ: dict) -> Optional[int]:
+    """The scene a connecting socket looks at, from '?sceneId=<id>' of the socket URL or a page at /scene/<id>.
 
-        print("[Server]: Starting server at " + self.BASE_URL + ":" + str(self.PORT))
-        self.socketio.run(self.app, port=self.PORT)
+    None if neither tells, the client then has to name its scene with 'join_scene' or in its messages.
+    """
+    scene_ids = parse_qs(environ.get('QUERY_STRING', '')).get('sceneId')
+    if scene_ids is not None and scene_ids[0].isdigit():
+        return int(scene_ids[0])
+    match = SCENE_PAGE.search(urlparse(environ.get('HTTP_REFERER', '')).path)
+    return None if match is None else int(match.group(1))
 
-    def add_element(self, element: BaseSceneElement):
-        if isinstance(element, PotreePointCloud):
-            self.add_potree_point_cloud(element)
-        elif isinstance(element, DefaultPointCloud):
-            self.add_point_cloud(element)
-        elif isinstance(element, LineSet):
-            self.add_line_set(element)
-        elif isinstance(element, CameraTrajectory):
-            self.add_camera_trajectory(element)
-        else:
-            raise Exception("Trying to add unknown element: " + str(type(element)))
 
-    def add_point_cloud(self, pc, name='Default PointCloud'):
-        if isinstance(pc, DefaultPointCloud):
-            self._POINT_CLOUDS.append(pc)
-        elif isinstance(pc, str):
-            point_cloud = DefaultPointCloud(data=pc, name=name)
-            self._POINT_CLOUDS.append(point_cloud)
+def stream_room(scene_id, element_id) -> str:
+    return f"stream-{scene_id}-{element_id}"
 
-        # TODO: what other ways could pc be? add them
 
-    def add_potree_point_cloud(self, pc, name='Potree PointCloud'):
-        if isinstance(pc, PotreePointCloud):
-            self._POTREE_POINT_CLOUDS.append(pc)
-        elif isinstance(pc, str):
-            point_cloud = PotreePointCloud('', name=name)
-            point_cloud.set_source(pc)
-            self._POINT_CLOUDS.append(point_cloud)
+class Tarasp:
+    # Shared by all instances of the process, like the files on disk they describe
+    # Resolved paths and stat results of the files below ./data and the front-end
+    DATA_FILES = PathCache('./data')
+    FRONT_END_FILES = PathCache(FRONT_END_DIRECTORY)
+
+    BASE_URL = 'http://127.0.0.1'
 
-    def add_line_set(self, line_set):
-        self._LINE_SETS.append(line_set)
+    THUMBNAILS = ThumbnailCache()
 
-    def add_camera_trajectory(self, ct):
-        self._CAMERA_TRAJECTORIES.append(ct)
+    CONVERSIONS: ConversionQueue = CONVERSIONS
+    # Seconds between two 'conversion_progress' updates
+    CONVERSION_PROGRESS_INTERVAL = 0.5
 
-    def convert_scene_elements(self):
-        for pc in self._POINT_CLOUDS:
-            pc.convert_to_source()
+    def __init__(self, port: int = 5000, output_path='./data/screenshots', print_component_tree=False,
+                 prepare_thumbnails=False, message_bus: MessageBus = None):
+        # Everything else belongs to the instance, so several viewers on different ports can run in one process
+        self.PORT = port
+        self.output_path = output_path
+        self.print_component_tree = print_component_tree
+        # Create the thumbnails of linked camera images in the background instead of on their first request
+        self.prepare_thumbnails = prepare_thumbnails
+
+        self.FRONT_END = FrontEndCache()
+        # Potree nodes read ahead of the viewers by the PREFETCHER, see enable_prefetching
+        self.NODE_CACHE = NodeCache()
+        self.PREFETCHER: NodePrefetcher = None
+        self.PREFETCH_HINTS = False
+
+        self.SCENES: Dict[int, Scene] = {}
+        # scene_id -> component tree of that scene
+        self.COMPONENT_TREE = {}
+        self.CURRENT_CAMERA_STATE = {}
+        self.ANIMATION = {}
+        self.animation_thread = None
+        self.animation_thread_lock = threading.Lock()
+        self.PREPARING = False
+        # Ids of the elements and groups added to this instance, see add_element
+        self.element_ids = Incrementer()
+        self.group_ids = Incrementer()
+        # Elements added to another instance before -> the copy this instance numbers and converts
+        self.element_copies: Dict[BaseSceneElement, BaseSceneElement] = {}
+
+        # sid -> encoding chosen with 'set_encoding', clients that never chose one use JSON
+        self.CLIENT_ENCODING: Dict[str, str] = {}
+        # sid -> scene of the page the client connected from, see page_scene_id. The bundled front-end always
+        # sends sceneId 0 with its camera updates, they are applied to this scene instead.
+        self.CLIENT_SCENE: Dict[str, int] = {}
+        # (scene_id, local element id) -> number of points of a StreamingPointCloud sent to its subscribers
+        self.STREAM_POSITIONS: Dict[tuple, int] = {}
+
+        # Shares camera updates, animations and scene updates with the servers in other processes
+        self.BUS: MessageBus = message_bus if message_bus is not None else InProcessBus()
+        self.NODE_ID = uuid.uuid4().hex
+
+        self.create_server()
+
+    def create_server(self):
+        self.app = Flask(__name__)
+        CORS(self.app)
+        self.socketio = SocketIO(self.app, cors_allowed_origins='*')
+        self.app.config['SECRET_KEY'] = secrets.token_hex(16)
+        self.app.config['UPLOAD_FOLDER'] = self.output_path
+        self.register_routes()
+        self.register_events()
+
+    def run(self, snapshot: str = None, prepare_in_background=False, workers: int = 1, worker_port: int = None):
+        """Prepares the scenes and serves them.
+
+        With 'prepare_in_background' the server starts right away, so the progress of the conversions can be
+        followed under /conversions. Component trees are only served once everything is prepared.
+        With 'workers' > 1 the scenes are served by that many processes of the asyncio backend, see run_workers.
+        A 'worker_port' gives every worker a port of its own behind a reverse proxy.
+        """
+        if workers > 1:
+            # eventlet cannot serve connections accepted by another process, the workers run on aiohttp
+            from src.App.async_app import AsyncTarasp
+            server = AsyncTarasp(self.PORT, self.output_path, self.print_component_tree, self.prepare_thumbnails,
+                                 self.BUS)
+            server.SCENES, server.ANIMATION = self.SCENES, self.ANIMATION
+            server.element_ids, server.group_ids = self.element_ids, self.group_ids
+            server.NODE_CACHE, server.PREFETCHER, server.PREFETCH_HINTS = \
+                self.NODE_CACHE, self.PREFETCHER, self.PREFETCH_HINTS
+            server.run(snapshot, prepare_in_background, workers, worker_port)
+            return
+        if prepare_in_background:
+            self.PREPARING = True
+            threading.Thread(target=self.prepare_in_background, args=(snapshot,), daemon=True).start()
+        else:
+            # 1. + 2. Prepare the scenes or load them from a snapshot of an earlier run
+            self.prepare(snapshot)
+            self.print_component_trees()
+
+        # 3. Run the application. Open browser by default?
+        # Load the front-end into memory, with the port number replaced in the index.html
+        self.FRONT_END.load(self.PORT)
 
-        for ppc in self._POTREE_POINT_CLOUDS:
-            ppc.convert_to_source()
+        self.connect_message_bus()
+        self.socketio.start_background_task(self.start_point_streams)
+        self.socketio.start_background_task(self.report_conversions)
+
+        print("[Server]: Starting server at " + self.BASE_URL + ":" + str(self.PORT))
+        self.socketio.run(self.app, port=self.PORT)
 
-        for ls in self._LINE_SETS:
-            ls.convert_to_source()
+    def prepare_in_background(self, snapshot: str = None):
+        try:
+            self.prepare(snapshot)
+        except Exception as e:
+            print(f"[Server]: Error, preparing the scenes failed: {e}")
+            return
+        finally:
+            self.PREPARING = False
+        self.print_component_trees()
+        print("[Server]: Scenes are ready")
 
-        for ct in self._CAMERA_TRAJECTORIES:
-            ct.convert_to_source()
+    def print_component_trees(self):
+        if self.print_component_tree:
+            for scene_id, tree in self.COMPONENT_TREE.items():
+                print(f"[Server]: Component tree of scene {scene_id}")
+                print(json.dumps(tree, indent=2))
 
-    def create_component_tree(self, tree=None):
+    def prepare(self, snapshot: str = None):
+        """Converts the elements and builds the component trees.
 
-        if tree is None:  # Create a default tree, left side is a sidebar, right side is the scene
-            scene_id = 0
+        With a snapshot path, the prepared scenes are loaded from it if none of their elements and assets changed,
+        otherwise they are prepared as usual and saved to it.
+        """
+        if snapshot is not None and load_snapshot(self, snapshot):
+            return
+        configuration = configuration_key(self)
 
-            viewer = Viewer(scene_id)
-            for pc in self._POINT_CLOUDS:
-                viewer.add_element(pc)
-            self.update_groups(self._POINT_CLOUDS)
+        # 1. Convert SceneElements to source
+        self.convert_scene_elements()
 
-            for ppc in self._POTREE_POINT_CLOUDS:
-                viewer.add_element(ppc)
-            self.update_groups(self._POTREE_POINT_CLOUDS)
+        if self.prepare_thumbnails:
+            self.create_thumbnails()
 
-            for ls in self._LINE_SETS:
-                viewer.add_element(ls)
-            self.update_groups(self._LINE_SETS)
+        # 2. Turn object tree into a json-component tree
+        self.create_component_tree()
 
-            for ct in self._CAMERA_TRAJECTORIES:
-                viewer.add_element(ct)
-            self.update_groups(self._CAMERA_TRAJECTORIES)
+        if snapshot is not None:
+            save_snapshot(self, snapshot, configuration)
+
+    def add_scene(self, camera_state: CameraState = None) -> int:
+        scene_id = len(self.SCENES)
+        self.SCENES[scene_id] = Scene(scene_id, camera_state, self.group_ids)
+        return scene_id
+
+    def get_scene(self, scene_id: int = 0) -> Scene:
+        if scene_id not in self.SCENES:
+            if scene_id != len(self.SCENES):
+                raise Exception(f"Trying to use scene {scene_id} before scene {len(self.SCENES)} was added")
+            self.add_scene()
+        return self.SCENES[scene_id]
+
+    def add_element(self, element: BaseSceneElement, scene_id: int = 0) -> BaseSceneElement:
+        """Adds the element to a scene and returns it, or the copy added in its place if another instance has it."""
+        if not isinstance(element, (PotreePointCloud, DefaultPointCloud, LineSet, CameraTrajectory,
+                                    StreamingPointCloud)):
+            raise Exception("Trying to add unknown element: " + str(type(element)))
+        if element in self.element_copies:
+            element = self.element_copies[element]
+        elif element not in self.get_elements():
+            if element.element_id is not None:
+                # The other instance keeps the id and URLs it gave the element
+                copied = element.copy()
+                self.element_copies[element] = copied
+                element = copied
+            # Numbered by this instance and served on its port
+            element.element_id = self.element_ids()
+            element.base_url = f"{self.BASE_URL}:{self.PORT}"
+        self.get_scene(scene_id).add_element(element)
+        return element
+
+    def add_point_cloud(self, pc, name='Default PointCloud', scene_id: int = 0):
+        if isinstance(pc, str):
+            pc = DefaultPointCloud(data=pc, name=name)
+        self.add_element(pc, scene_id)
 
-            # The front-end uses (so far) an array to store the elements which are accessed via element_id
-            # To not mix up objects and references, we sort them here
-            viewer.elements.sort(key=lambda x: x.element_id, reverse=False)
+        # TODO: what other ways could pc be? add them
 
-            element_tree = ElementTree()
-            for group in self._GROUPS:
-                element_tree.add_group(group)
+    def add_potree_point_cloud(self, pc, name='Potree PointCloud', scene_id: int = 0):
+        if isinstance(pc, str):
+            pc = PotreePointCloud(data=pc, name=name)
+        self.add_element(pc, scene_id)
 
-            settings = SceneSettings()
-            settings.set_scene_id(scene_id)
+    def add_point_cloud_sequence(self, frames, name='PointCloud Sequence', frame_rate: float = 10, scene_id: int = 0):
+        if not isinstance(frames, PointCloudSequence):
+            frames = PointCloudSequence(frames, frame_rate=frame_rate, name=name)
+        return self.add_element(frames, scene_id)
 
-            side_bar = Col()
-            side_bar.set_width(3)
-            side_bar.add_child(settings)
-            side_bar.add_child(element_tree)
+    def add_streaming_point_cloud(self, name='Streaming PointCloud', voxel_size: float = None,
+                                  scene_id: int = 0) -> StreamingPointCloud:
+        """Adds an empty StreamingPointCloud, call its 'append' to send points to the clients."""
+        return self.add_element(StreamingPointCloud(voxel_size=voxel_size, name=name), scene_id)
 
-            scene = Col()
-            scene.set_width(9)
-            scene.add_child(viewer)
+    def add_line_set(self, line_set, scene_id: int = 0):
+        self.add_element(line_set, scene_id)
 
-            row = Row()
-            row.add_child(side_bar)
-            row.add_child(scene)
+    def add_camera_trajectory(self, ct, scene_id: int = 0):
+        self.add_element(ct, scene_id)
 
-            self.COMPONENT_TREE.append([row.to_json(0)])
+    def get_elements(self) -> List[BaseSceneElement]:
+        # Elements shared between scenes are only listed once
+        elements = {}
+        for scene in self.SCENES.values():
+            for element in scene.elements:
+                elements[element.element_id] = element
+        return [elements[element_id] for element_id in sorted(elements.keys())]
 
+    def convert_scene_elements(self):
+        # Every element converts in its own thread, so all conversions are queued at once and small clouds
+        # are not converted after large ones, see ConversionQueue
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(lambda element: element.convert_to_source(), self.get_elements()))
+
+    def create_thumbnails(self):
+        for element in self.get_elements():
+            if isinstance(element, CameraTrajectory) and element.link_images and element.thumbnail_size is not None:
+                self.THUMBNAILS.warm(element.image_paths, sizes=[element.thumbnail_size])
+
+    def create_component_tree(self, tree=None, scene_id: int = None):
+        if tree is None:
+            if len(self.SCENES) == 0:
+                self.add_scene()
+            for scene in self.SCENES.values():
+                self.COMPONENT_TREE[scene.scene_id] = [scene.create_component_tree()]
         else:
-            self.COMPONENT_TREE.append([tree])
-
-    used_names = {}
-
-    def update_groups(self, elements: List[BaseSceneElement]):
-
-        # Real ugly way to check if different scene elements have the same name.
-        # ----
-        type_key = "unknown"
-        if len(elements) > 0:
-            type_key = str(type(elements[0]))
-        for element in elements:
-            name_as_key = json.dumps(element.name)
-            if name_as_key in self.used_names.keys():
-                if self.used_names[name_as_key] != type_key:
-                    raise Exception(f"Trying to group different types together: {type_key}"
-                                    f" and {self.used_names[name_as_key]}")
-            else:
-                self.used_names[name_as_key] = type_key
-
-            # ------
-            # Grouping continues here.
-            element_id = element.element_id
-            selected_group = Group("Unknown")
-            current_groups = self._GROUPS
-            for name in element.name:  # element.name is a list of strings. e.g. ["dir1", "dir2", "name"]
-                found = False
-                for group in current_groups:
-                    if group.name == name:  # found, group already exists
-                        current_groups = group.groups
-                        selected_group = group
-                        found = True
-                        break
-                if not found:
-                    # group not found, create new object
-                    selected_group = Group(name)
-                    current_groups.append(selected_group)
-                    current_groups = selected_group.groups
-            selected_group.add_id(element_id)
-
-    # Why use regex instead of a template variable?
-    # 1) Template variables can only be inserted in non-script tags but there would be a work around.
-    # 2) When using a template variable, the index.html changes. That means that every time the front-end gets built,
-    #    this has to be inserted again or automated somehow as Angular cannot deal with these template variables.
-    # 3) The index.html is quite small. This shouldn't have a big performance impact.
-    def replace_front_end_settings(self):
-        # open index.html
-        file = open('./front-end/index.html').read()
-
-        # get the strings you want to swap
-        # we get a list of all occurrences and then a tuple. So we extract the first element twice.
-        settings_content = re.findall(r'(window\[\'port\'\] = (\d\d\d\d))', file)[0][0]
-        new_content = f'window[\'port\'] = {self.PORT}'
-
-        # replace
-        replaced = file.replace(settings_content, new_content)
-
-        # output string to new file
-        file = open('./front-end/index.html', 'w')
-        file.write(replaced)
-        file.close()
+            if scene_id is None:
+                scene_id = len(self.COMPONENT_TREE)
+            self.COMPONENT_TREE[scene_id] = [tree]
 
     # ----------------------
     # REST-API
     # ----------------------
 
-    @staticmethod
-    @app.route('/')
-    def func():
-        response = flask.send_from_directory(directory='../../front-end/', path='index.html')
-        return set_cors_headers(response)
-
-    @staticmethod
-    @app.route('/<path:file_name>')
-    def serve_front_end(file_name):
-        response = flask.send_from_directory(directory='../../front-end/', path=file_name)
-        return set_cors_headers(response)
+    def register_routes(self):
+        self.app.add_url_rule('/', view_func=self.func)
+        self.app.add_url_rule('/<path:file_name>', view_func=self.serve_front_end)
+        self.app.add_url_rule('/data/<path:file_name>', view_func=self.serve_data)
+        self.app.add_url_rule('/thumbnails/<int:size>/<path:file_name>', view_func=self.serve_thumbnail)
+        self.app.add_url_rule('/component_tree/<path:scene_id>', view_func=self.get_component_tree)
+        self.app.add_url_rule('/lod/<int:scene_id>/<int:element_id>', view_func=self.get_level_of_detail)
+        self.app.add_url_rule('/compact/<int:scene_id>/<int:element_id>', view_func=self.get_compact_point_cloud)
+        self.app.add_url_rule('/visible_elements/<int:scene_id>', view_func=self.get_visible_elements,
+                              methods=['POST'])
+        self.app.add_url_rule('/conversions', view_func=self.get_conversions)
+        self.app.add_url_rule('/conversions/<int:job_id>', view_func=self.get_conversion)
+        # CORS(self.app) answers the cross origin requests of these two as well
+        self.app.add_url_rule('/conversions/<int:job_id>/cancel', view_func=self.cancel_conversion_request,
+                              methods=['POST', 'OPTIONS'])
+        self.app.add_url_rule('/upload/<path:location>', view_func=self.upload_file, methods=['POST', 'OPTIONS'])
+
+    def func(self):
+        return create_cached_response(self.FRONT_END.index)
+
+    def serve_front_end(self, file_name):
+        cached = self.FRONT_END.get(file_name)
+        if cached is not None:
+            return create_cached_response(cached)
+        resolved = self.FRONT_END_FILES.resolve(file_name)
+        if resolved is None:
+            return create_404_response("File not found: " + file_name)
+        return create_file_response(resolved, mimetypes.guess_type(file_name)[0] or 'application/octet-stream')
 
     # Handle all data calls by returning it as octet-stream.
-    @staticmethod
-    @app.route('/data/<path:file_name>')
-    def serve_data(file_name):
-        # TODO: check if its possible to serve any image on the disk: worked for " directory='/home/silas/Downloads/' "
-        if not exists('data/' + file_name):
+    def serve_data(self, file_name):
+        resolved = self.DATA_FILES.resolve(file_name)
+        if resolved is None:
             return create_404_response("File not found: " + file_name)
-        response = flask.send_from_directory(directory='../../data/', path=file_name, as_attachment=True)
-        response.headers.set('Content-Type', 'application/octet-stream')
+        return create_file_response(resolved, 'application/octet-stream', as_attachment=True,
+                                    content=self.NODE_CACHE.get(file_name, resolved.etag))
+
+    # Downscaled camera images, e.g. /thumbnails/512/data/colmap/image.jpg for ./data/colmap/image.jpg
+    def serve_thumbnail(self, size, file_name):
+        thumbnail = self.THUMBNAILS.get(file_name, size)
+        if thumbnail is None:
+            return create_404_response("Image not found: " + file_name)
+        response = flask.send_file(thumbnail.resolve(), mimetype='image/jpeg', max_age=3600)
         return set_cors_headers(response)
 
     # Get the defined component-tree
-    @staticmethod
-    @app.route('/component_tree/<path:scene_id>')
-    def get_component_tree(scene_id):
+    def get_component_tree(self, scene_id):
         scene_id = int(scene_id)
-        if len(Tarasp.COMPONENT_TREE) < scene_id:
+        if self.PREPARING:
+            response = flask.make_response("[Server]: The scenes are still being prepared, see /conversions")
+            response.status_code = 503
+            return set_cors_headers(response)
+        if scene_id not in self.COMPONENT_TREE:
             return create_404_response("Error: No component tree found with the provided ID")
         else:
-            response = flask.make_response(flask.jsonify(Tarasp.COMPONENT_TREE[scene_id]))
+            response = flask.make_response(flask.jsonify(self.COMPONENT_TREE[scene_id]))
+            response.status_code = 200
+            return set_cors_headers(response)
+
+    # Get a precomputed level of detail of an element, e.g. /lod/0/3?budget=10000&min=0,0,0&max=10,10,10
+    # Without a level, the finest level with at most 'budget' primitives is returned.
+    def get_level_of_detail(self, scene_id, element_id):
+        if scene_id not in self.SCENES or element_id >= len(self.SCENES[scene_id].elements):
+            return create_404_response("Error: No element found with the provided ID")
+        element = self.SCENES[scene_id].get_element(element_id)
+        if element.lod is None:
+            return create_404_response("Error: The element has no levels of detail")
+
+        level = request.args.get('level', type=int)
+        if level is None:
+            level = element.lod.select_level(request.args.get('budget', type=int))
+        if not 0 <= level < len(element.lod):
+            return create_404_response(f"Error: Level {level} does not exist")
+        region = parse_region(request.args.get('min'), request.args.get('max'))
+
+        response = flask.make_response(flask.jsonify({
+            element.key_lod_level: level,
+            element.key_lod_levels: element.lod.counts,
+            element.key_source: element.get_lod_source(level, region)
+        }))
+        response.status_code = 200
+        return set_cors_headers(response)
+
+    # Get the quantized export of a DefaultPointCloud created with compact=True, see quantization.decode_compact
+    def get_compact_point_cloud(self, scene_id, element_id):
+        if scene_id not in self.SCENES or element_id >= len(self.SCENES[scene_id].elements):
+            return create_404_response("Error: No element found with the provided ID")
+        element = self.SCENES[scene_id].get_element(element_id)
+        if getattr(element, 'compact_path', None) is None or not exists(element.compact_path):
+            return create_404_response("Error: The element has no compact export")
+        response = flask.send_file(Path(element.compact_path).resolve(), mimetype='application/octet-stream',
+                                   conditional=True, etag=True)
+        return set_cors_headers(response)
+
+    # Get the elements inside the view frustum of a camera. The body is a camera state as in CameraState.to_json,
+    # optionally with the 'aspect' ratio of the viewport. The largest elements on screen come first.
+    def get_visible_elements(self, scene_id):
+        if scene_id not in self.SCENES or self.SCENES[scene_id].spatial_index is None:
+            return create_404_response("Error: No scene found with the provided ID")
+        camera = request.get_json(force=True)
+        aspect = float(camera.get('aspect', 16 / 9))
+
+        visible = self.SCENES[scene_id].visible_elements(camera, aspect)
+        response = flask.make_response(flask.jsonify([
+            {'elementId': element_id, 'screenSize': size} for element_id, size in visible
+        ]))
+        response.status_code = 200
+        return set_cors_headers(response)
+
+    # State, progress (0 to 1) and ETA in seconds of the conversions of this server
+    def get_conversions(self):
+        response = flask.make_response(flask.jsonify([job.to_json() for job in self.CONVERSIONS.jobs.values()]))
+        response.status_code = 200
+        return set_cors_headers(response)
+
+    def get_conversion(self, job_id):
+        job = self.CONVERSIONS.get(job_id)
+        if job is None:
+            return create_404_response("Error: No conversion found with the provided ID")
+        response = flask.make_response(flask.jsonify(job.to_json()))
+        response.status_code = 200
+        return set_cors_headers(response)
+
+    def cancel_conversion_request(self, job_id):
+        if request.method == 'OPTIONS':
+            response = flask.make_response("Options supported.")
             response.status_code = 200
             return set_cors_headers(response)
+        if not self.CONVERSIONS.cancel(job_id):
+            return create_404_response("Error: No queued or running conversion found with the provided ID")
+        response = flask.make_response(flask.jsonify(self.CONVERSIONS.get(job_id).to_json()))
+        response.status_code = 200
+        return set_cors_headers(response)
 
-    @staticmethod
-    @app.route('/upload/<path:location>', methods=['POST', 'OPTIONS'])
-    @cross_origin()
-    def upload_file(location):
+    def upload_file(self, location):
         # Some browsers send an OPTIONS request. Here we ack it
         if request.method == 'OPTIONS':
             response = flask.make_response("Options supported.")
@@ -290,7 +488,7 @@ class Tarasp:
         file = request.files['file']
 
         if file:
-            save_path = os.path.join(Tarasp.app.config['UPLOAD_FOLDER'], location)
+            save_path = os.path.join(self.app.config['UPLOAD_FOLDER'], location)
             if not exists(save_path):
                 Path(save_path).mkdir(parents=True)
             # TODO: new naming concept, here we simply the current time in ms.
@@ -305,7 +503,33 @@ class Tarasp:
 
     # SocketIO
 
-    ANIMATION = {}
+    def register_events(self):
+        self.socketio.on_event('start_animation', self.start_animation)
+        self.socketio.on_event('subscribe_stream', self.subscribe_stream)
+        self.socketio.on_event('unsubscribe_stream', self.unsubscribe_stream)
+        self.socketio.on_event('cancel_conversion', self.cancel_conversion)
+        self.socketio.on_event('join_scene', self.join_scene)
+        self.socketio.on_event('set_encoding', self.set_encoding)
+        self.socketio.on_event('camera_sync', self.sync_camera_state)
+        self.socketio.on_event('connect', self.connect)
+        self.socketio.on_event('disconnect', self.test_disconnect)
+
+    def enable_prefetching(self, cache_size: int = 256 << 20, point_budget: int = 1000000, hints=False):
+        """Predicts from the camera_sync messages which octree nodes of the PotreePointClouds come into view next and
+        reads them into memory before they are requested, see NodePrefetcher.
+
+        With 'hints', the client moving the camera receives the URLs of these nodes as 'prefetch' message,
+        {"sceneId": 0, "urls": [...]}, the most important first.
+        """
+        self.NODE_CACHE = NodeCache(cache_size)
+        self.PREFETCHER = NodePrefetcher(self.DATA_FILES, self.NODE_CACHE, point_budget)
+        self.PREFETCH_HINTS = hints
+
+    def prefetch_nodes(self, scene_id, state: dict) -> List[str]:
+        """URLs of the nodes that are read ahead for the new camera state of a scene."""
+        if self.PREFETCHER is None or scene_id not in self.SCENES:
+            return []
+        return self.PREFETCHER.observe(self.SCENES[scene_id], state)
 
     def add_animation(self, func: Callable[[int], Union[CameraState, None]],
                       animation_name: str = "animation_1",
@@ -320,74 +544,257 @@ class Tarasp:
             "sleep": sleep_duration
         }
 
-    animation_thread = None
-    animation_thread_lock = threading.Lock()
+    def add_sequence_animation(self, sequence: PointCloudSequence,
+                               animation_name: str = "sequence_1",
+                               func: Callable[[int], Union[CameraState, None]] = None,
+                               loop: bool = False,
+                               screenshot: bool = False,
+                               screenshot_directory: str = ''):
+        """Plays the frames of a sequence at its frame rate, optionally with a camera path 'func'.
+
+        Every message has a 'sequence' entry with the frame to show and the sources of the next frames, so clients
+        can load them ahead of time. Without 'loop' the animation ends after the last frame.
+        """
+        sequence = self.element_copies.get(sequence, sequence)
+        self.ANIMATION[animation_name] = {
+            "function": func,
+            "screenshot": screenshot,
+            "screenshotDirectory": screenshot_directory,
+            "sleep": 1 / sequence.frame_rate,
+            "sequence": sequence,
+            "loop": loop
+        }
+
+    def connect_message_bus(self):
+        self.BUS.subscribe(CAMERA_SYNC, self.receive_camera_sync)
+        self.BUS.subscribe(ANIMATION, self.receive_scene_message)
+        self.BUS.subscribe(SCENE_UPDATE, self.receive_scene_message)
+        self.BUS.start(self.socketio.start_background_task, self.socketio.sleep)
+
+    def emit_to_scene(self, event: str, data, scene_id, skip_sid=None):
+        for encoding in [JSON, BINARY]:
+            self.socketio.emit(event, encode_message(event, data, scene_id, encoding),
+                               to=scene_room(scene_id, encoding), skip_sid=skip_sid)
+
+    # Messages of other servers are only emitted to the clients connected to this one, the sender already did
+    # the same for its own clients.
+    def receive_camera_sync(self, message: dict, origin: str):
+        if origin == self.NODE_ID:
+            return
+        if self.update_camera_state(message['sceneId'], message['state']):
+            self.emit_to_scene(CAMERA_SYNC, message['state'], message['sceneId'])
+            # The clients of this server follow the camera, their nodes are read ahead as well
+            self.prefetch_nodes(message['sceneId'], message['state'])
+
+    def receive_scene_message(self, message: dict, origin: str):
+        if origin == self.NODE_ID:
+            return
+        self.emit_to_scene(message['event'], message['data'], message['sceneId'])
+
+    def publish_to_scene(self, channel: str, event: str, data, scene_id):
+        """Emits an event to all clients of a scene, on this and every other server connected to the bus."""
+        self.emit_to_scene(event, data, scene_id)
+        self.BUS.publish(channel, {'event': event, 'data': data, 'sceneId': scene_id}, self.NODE_ID)
+
+    def publish_scene_update(self, scene_id: int, update: dict):
+        self.publish_to_scene(SCENE_UPDATE, 'scene_update', update, scene_id)
 
-    @staticmethod
-    @socketio.on('start_animation')
-    def start_animation(data):
+    def play_animation(self, animation_name: str, scene_id: int = 0):
+        """Plays an animation for every client of a scene, unlike 'start_animation' which only serves its sender."""
+
+        def send_animation_update():
+            for animation_data, sleep_duration in self.animation_frames(animation_name, scene_id):
+                self.publish_to_scene(ANIMATION, 'animation', animation_data, scene_id)
+                self.socketio.sleep(sleep_duration)
+
+        return self.socketio.start_background_task(target=send_animation_update)
+
+    def report_conversions(self):
+        """Sends every change of a conversion job to all clients as 'conversion_progress'."""
+        version = 0
+        while True:
+            changed, version = self.CONVERSIONS.changed_since(version)
+            for job in changed:
+                self.socketio.emit('conversion_progress', job.to_json())
+            self.socketio.sleep(self.CONVERSION_PROGRESS_INTERVAL)
+
+    def streams(self):
+        """Scene id, local id and element of every StreamingPointCloud."""
+        for scene in self.SCENES.values():
+            for local_id, element in enumerate(scene.elements):
+                if isinstance(element, StreamingPointCloud):
+                    yield scene.scene_id, local_id, element
+
+    def start_point_streams(self):
+        # Scenes prepared in the background only know their elements once they are done
+        while self.PREPARING:
+            self.socketio.sleep(0.1)
+        for scene_id, local_id, element in self.streams():
+            self.socketio.start_background_task(self.stream_points, scene_id, local_id, element)
+
+    def stream_points(self, scene_id: int, local_id: int, element: StreamingPointCloud):
+        """Sends new points to the subscribers, points appended between two messages are sent together."""
+        key = (scene_id, local_id)
+        self.STREAM_POSITIONS[key] = 0
+        while True:
+            self.socketio.sleep(1 / element.max_rate)
+            start = self.STREAM_POSITIONS[key]
+            points, colors = element.read(start, element.max_points_per_message)
+            if len(points) == 0:
+                continue
+            self.STREAM_POSITIONS[key] = start + len(points)
+            self.socketio.emit('point_delta', encode_point_delta(scene_id, local_id, start, points, colors),
+                               to=stream_room(scene_id, local_id))
+
+    def stream_history(self, scene_id: int, local_id: int):
+        """Packets with the points sent before a client subscribed. Points are numbered, so a client that also
+        receives some of them from the stream can drop the duplicates."""
+        element = self.SCENES[scene_id].get_element(local_id)
+        stop = self.STREAM_POSITIONS.get((scene_id, local_id), 0)
+        for start in range(0, stop, element.max_points_per_message):
+            points, colors = element.read(start, min(element.max_points_per_message, stop - start))
+            yield encode_point_delta(scene_id, local_id, start, points, colors)
+
+    def find_stream(self, data: dict):
+        scene_id, local_id = int(data['sceneId']), int(data['elementId'])
+        if scene_id not in self.SCENES or not 0 <= local_id < len(self.SCENES[scene_id].elements) or \
+                not isinstance(self.SCENES[scene_id].get_element(local_id), StreamingPointCloud):
+            print(f"[Server]: Error, no streaming point cloud {local_id} in scene {scene_id}")
+            return None
+        return scene_id, local_id
+
+    def animation_frames(self, animation_name: str, scene_id: int = 0):
+        """Yields the message of every frame of an animation and how long to wait before the next one."""
+        animation = self.ANIMATION[animation_name]
+        sleep_duration = animation['sleep']
+        sequence = animation.get('sequence')
+        animation_data = {
+            'screenshot': animation['screenshot'],
+            'screenshotDirectory': animation['screenshotDirectory']
+        }
+        if sequence is not None:
+            local_id = self.SCENES[scene_id].elements.index(sequence)
+
+        i = 0
+        while True:
+            if animation['function'] is not None:
+                cam = animation['function'](i)
+                if cam is None:
+                    break
+                animation_data['cameraState'] = cam.to_json()
+            if sequence is not None:
+                if sequence.frame_index(i, animation['loop']) is None:
+                    break
+                animation_data[PointCloudSequence.key_sequence] = sequence.playback_frame(i, local_id,
+                                                                                        animation['loop'])
+            yield animation_data, sleep_duration
+            i += 1
+
+    def update_camera_state(self, scene_id, state: dict) -> bool:
+        """Stores the camera state of a scene, returns True if it is new enough to be sent to the other clients."""
+        if scene_id not in self.CURRENT_CAMERA_STATE:
+            self.CURRENT_CAMERA_STATE[scene_id] = state
+            return False
+
+        last_update = self.CURRENT_CAMERA_STATE[scene_id]['lastUpdate']
+        if last_update + 30 < state['lastUpdate']:
+            self.CURRENT_CAMERA_STATE[scene_id] = state
+            return True
+        return False
+
+    def start_animation(self, data):
         data = json.loads(data)
         animation_name = data['animationName']
         scene_id = int(data['sceneId'])
         running = bool(data['running'])
 
-        if animation_name not in Tarasp.ANIMATION.keys():
+        if animation_name not in self.ANIMATION.keys():
             print("[Server]: Error, no animation found with name " + animation_name)
             return
 
         print("[Server]: Starting animation for sceneId " + str(scene_id))
+        sid = request.sid
+        encoding = self.CLIENT_ENCODING.get(sid, JSON)
 
         def send_animation_update():
-            animation = Tarasp.ANIMATION[animation_name]
-            sleep_duration = animation['sleep']
-            animation_data = {
-                'screenshot': animation['screenshot'],
-                'screenshotDirectory': animation['screenshotDirectory']
-            }
-
-            i = 0
-            while True:
+            for animation_data, sleep_duration in self.animation_frames(animation_name, scene_id):
                 if not running:  # TODO make it update the variable somehow?
                     break
-                cam = animation['function'](i)
-                if cam is None:
-                    break
-                else:
-                    cam = cam.to_json()
-
-                animation_data['cameraState'] = cam
-
-                Tarasp.socketio.emit('animation', animation_data, broadcast=False)  # only send to originating user
-                Tarasp.socketio.sleep(sleep_duration)
-                i += 1
-            with Tarasp.animation_thread_lock:
-                Tarasp.animation_thread = None
+                # only send to originating user
+                self.socketio.emit('animation', encode_message('animation', animation_data, scene_id, encoding),
+                                   to=sid)
+                self.socketio.sleep(sleep_duration)
+            with self.animation_thread_lock:
+                self.animation_thread = None
+
+        with self.animation_thread_lock:
+            if self.animation_thread is None:
+                self.animation_thread = self.socketio.start_background_task(target=send_animation_update)
+
+    # Every scene has its own room, camera updates are only shared between clients looking at the same scene.
+    def join_scene_room(self, scene_id):
+        room = scene_room(scene_id, self.CLIENT_ENCODING.get(request.sid, JSON))
+        if room in rooms():
+            return
+        for other in rooms():
+            if other.startswith(SCENE_ROOM_PREFIX):
+                leave_room(other)
+        join_room(room)
+
+    # Subscribes to the points of a StreamingPointCloud, {"sceneId": 0, "elementId": 2}. The points streamed so far
+    # are sent right away, new ones follow as 'point_delta' messages.
+    def subscribe_stream(self, message):
+        stream = self.find_stream(json.loads(message))
+        if stream is None:
+            return
+        join_room(stream_room(*stream))
+        for packet in self.stream_history(*stream):
+            self.socketio.emit('point_delta', packet, to=request.sid)
 
-        with Tarasp.animation_thread_lock:
-            if Tarasp.animation_thread is None:
-                Tarasp.animation_thread = Tarasp.socketio.start_background_task(target=send_animation_update)
+    def unsubscribe_stream(self, message):
+        stream = self.find_stream(json.loads(message))
+        if stream is not None:
+            leave_room(stream_room(*stream))
 
-    @staticmethod
-    @socketio.on('camera_sync')
-    def sync_camera_state(message):
+    def cancel_conversion(self, message):
         data = json.loads(message)
-        scene_id = data['sceneId']
-        state = data['state']
-        if len(Tarasp.CURRENT_CAMERA_STATE) == 0:
-            Tarasp.CURRENT_CAMERA_STATE[scene_id] = state
-        else:
-            last_update = Tarasp.CURRENT_CAMERA_STATE[scene_id]['lastUpdate']
-
-            if last_update + 30 < state['lastUpdate']:
-                Tarasp.CURRENT_CAMERA_STATE[scene_id] = state
-                Tarasp.socketio.emit('camera_sync', state, broadcast=True, include_self=False)
+        return self.CONVERSIONS.cancel(int(data['jobId']))
 
-    @staticmethod
-    @socketio.on('connect')
-    def connect():
+    def join_scene(self, message):
+        data = json.loads(message)
+        # A client that names its scene also does so in its messages
+        self.CLIENT_SCENE.pop(request.sid, None)
+        self.join_scene_room(data['sceneId'])
+
+    # Either {"encoding": "binary"} or {"encoding": "json"}. Binary clients send and receive camera updates and
+    # animation frames as pose packets, see binary_protocol. The chosen encoding is returned as acknowledgement.
+    def set_encoding(self, message):
+        encoding = parse_encoding(message)
+        self.CLIENT_ENCODING[request.sid] = encoding
+        for room in rooms():
+            if room.startswith(SCENE_ROOM_PREFIX):
+                self.join_scene_room(room[len(SCENE_ROOM_PREFIX):].split('/')[0])
+        return encoding
+
+    def sync_camera_state(self, message):
+        scene_id, state = decode_camera_sync(message)
+        scene_id = self.CLIENT_SCENE.get(request.sid, scene_id)
+        self.join_scene_room(scene_id)
+        if self.update_camera_state(scene_id, state):
+            self.emit_to_scene('camera_sync', state, scene_id, skip_sid=request.sid)
+            self.BUS.publish(CAMERA_SYNC, {'sceneId': scene_id, 'state': state}, self.NODE_ID)
+            urls = self.prefetch_nodes(scene_id, state)
+            if self.PREFETCH_HINTS and len(urls) > 0:
+                self.socketio.emit('prefetch', {'sceneId': scene_id, 'urls': urls}, to=request.sid)
+
+    def connect(self):
+        scene_id = page_scene_id(request.environ)
+        if scene_id is not None:
+            self.CLIENT_SCENE[request.sid] = scene_id
+            self.join_scene_room(scene_id)
         print('Client connected')
 
-    @staticmethod
-    @socketio.on('disconnect')
-    def test_disconnect():
+    def test_disconnect(self):
+        self.CLIENT_ENCODING.pop(request.sid, None)
+        self.CLIENT_SCENE.pop(request.sid, None)
         print('Client disconnected')
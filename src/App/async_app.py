@@ -0,0 +1,510 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import socketio
+from aiohttp import web
+
+from src.App.app import Tarasp, scene_room, stream_room, page_scene_id, SCENE_ROOM_PREFIX
+from src.App.binary_protocol import JSON, BINARY, encode_message, decode_camera_sync, parse_encoding, \
+    encode_point_delta
+from src.App.front_end import CachedFile
+from src.App.file_cache import ResolvedFile, PathCache
+from src.App.snapshot import load_snapshot, save_snapshot, configuration_key
+from src.App.message_bus import MessageBus, CAMERA_SYNC, ANIMATION, SCENE_UPDATE
+from src.App.workers import run_workers
+from src.SceneElements.lod import parse_region
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Allow-Methods": "*",
+}
+
+UPLOAD_CHUNK_SIZE = 1 << 16
+
+
+def create_404_response(error: str) -> web.Response:
+    return web.Response(text="[Server]: " + error, status=404, headers=CORS_HEADERS)
+
+
+def create_json_response(data) -> web.Response:
+    return web.json_response(data, headers=CORS_HEADERS)
+
+
+def create_cached_response(request: web.Request, cached: CachedFile) -> web.Response:
+    headers = {**CORS_HEADERS, 'Cache-Control': cached.cache_control, 'ETag': f'"{cached.etag}"'}
+    if request.headers.get('If-None-Match', '').strip('"') == cached.etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=cached.content, content_type=cached.mimetype, headers=headers)
+
+
+def create_file_response(request: web.Request, resolved: ResolvedFile, headers: dict,
+                         content: bytes = None) -> web.StreamResponse:
+    # Answered from the cached stat, FileResponse would stat and open the file first. Its ETag has the same format.
+    # 'content' is the file read ahead of time, see NodeCache, ranges of it are still sent by FileResponse.
+    headers = {**CORS_HEADERS, **headers}
+    if request.headers.get('If-None-Match', '').strip('"') == resolved.etag:
+        return web.Response(status=304, headers={**headers, 'ETag': f'"{resolved.etag}"'})
+    if content is not None and 'Range' not in request.headers:
+        return web.Response(body=content, headers={**headers, 'ETag': f'"{resolved.etag}"'})
+    return web.FileResponse(resolved.path, headers=headers)
+
+
+class AsyncTarasp(Tarasp):
+    """Serves the routes and Socket.IO events of Tarasp on asyncio with aiohttp and python-socketio.
+
+    Files are sent with the non-blocking sendfile of aiohttp, uploads are written and conversions, thumbnails
+    and other blocking work run in a thread pool, so no request holds up the event loop.
+    """
+
+    def __init__(self, port: int = 5000, output_path='./data/screenshots', print_component_tree=False,
+                 prepare_thumbnails=False, message_bus: MessageBus = None, executor_workers: int = None):
+        super().__init__(port, output_path, print_component_tree, prepare_thumbnails, message_bus)
+        self.loop = None
+        self.executor_workers = executor_workers
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers)
+        self.animation_tasks = {}
+        self.background_tasks = []
+
+    def create_server(self):
+        self.sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*')
+        self.web_app = web.Application()
+        self.sio.attach(self.web_app)
+        self.register_routes()
+        self.register_events()
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def run(self, snapshot: str = None, prepare_in_background=False, workers: int = 1, worker_port: int = None):
+        """Prepares the scenes and serves them, with 'workers' > 1 from that many processes, see run_workers."""
+        if workers <= 1:
+            asyncio.run(self.serve(snapshot, prepare_in_background))
+            return
+        if prepare_in_background:
+            raise Exception("Several workers need the scenes prepared before they start, "
+                            "prepare_in_background only works with one worker")
+        asyncio.run(self.prepare_async(snapshot))
+        run_workers(self, workers, worker_port=worker_port)
+
+    async def prepare_async(self, snapshot: str = None):
+        # 1. + 2. Prepare the scenes or load them from a snapshot of an earlier run
+        if snapshot is None or not await self.run_blocking(load_snapshot, self, snapshot):
+            configuration = configuration_key(self)
+
+            # Convert SceneElements to source, every element in its own worker
+            await asyncio.gather(*[self.run_blocking(element.convert_to_source) for element in self.get_elements()])
+
+            if self.prepare_thumbnails:
+                self.create_thumbnails()
+
+            await self.run_blocking(self.create_component_tree)
+
+            if snapshot is not None:
+                await self.run_blocking(save_snapshot, self, snapshot, configuration)
+        self.print_component_trees()
+
+    async def prepare_in_background_async(self, snapshot: str = None):
+        try:
+            await self.prepare_async(snapshot)
+        except Exception as e:
+            print(f"[Server]: Error, preparing the scenes failed: {e}")
+            return
+        finally:
+            self.PREPARING = False
+        print("[Server]: Scenes are ready")
+
+    async def serve(self, snapshot: str = None, prepare_in_background=False):
+        self.loop = asyncio.get_running_loop()
+
+        if prepare_in_background:
+            self.PREPARING = True
+            self.background_tasks.append(asyncio.create_task(self.prepare_in_background_async(snapshot)))
+        else:
+            await self.prepare_async(snapshot)
+
+        runner = await self.start()
+        site = web.TCPSite(runner, '127.0.0.1', self.PORT)
+        await site.start()
+        print("[Server]: Starting asyncio server at " + self.BASE_URL + ":" + str(self.PORT))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            self.executor.shutdown(wait=False)
+
+    async def start(self) -> web.AppRunner:
+        self.FRONT_END.load(self.PORT)
+        self.connect_message_bus()
+        self.background_tasks.append(asyncio.create_task(self.start_point_streams()))
+        self.background_tasks.append(asyncio.create_task(self.report_conversions()))
+
+        runner = web.AppRunner(self.web_app)
+        await runner.setup()
+        return runner
+
+    async def serve_worker(self, channel: socket.socket, host: str = '127.0.0.1', port: int = None):
+        """Serves the connections accepted by run_workers, which sends them over 'channel'.
+
+        With a 'port' the worker accepts its connections there, 'channel' only tells when run_workers stops.
+        """
+        self.loop = asyncio.get_running_loop()
+        # The threads of the executor were not forked along, it would wait for them forever
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers)
+        runner = await self.start()
+        if port is not None:
+            await web.TCPSite(runner, host, port).start()
+        stopped = asyncio.Event()
+
+        def receive():
+            try:
+                _, fds, _, _ = socket.recv_fds(channel, 1, 1)
+            except BlockingIOError:
+                return
+            if len(fds) == 0:  # the accepting process is gone
+                self.loop.remove_reader(channel)
+                stopped.set()
+                return
+            for fd in fds:
+                connection = socket.socket(fileno=fd)
+                connection.setblocking(False)
+                self.loop.create_task(self.loop.connect_accepted_socket(runner.server, connection))
+
+        channel.setblocking(False)
+        self.loop.add_reader(channel, receive)
+        try:
+            await stopped.wait()
+        finally:
+            await runner.cleanup()
+            self.executor.shutdown(wait=False)
+
+    # ----------------------
+    # REST-API
+    # ----------------------
+
+    def register_routes(self):
+        self.web_app.router.add_get('/', self.func)
+        self.web_app.router.add_get('/data/{file_name:.+}', self.serve_data)
+        self.web_app.router.add_get('/thumbnails/{size:\\d+}/{file_name:.+}', self.serve_thumbnail)
+        self.web_app.router.add_get('/component_tree/{scene_id}', self.get_component_tree)
+        self.web_app.router.add_get('/lod/{scene_id:\\d+}/{element_id:\\d+}', self.get_level_of_detail)
+        self.web_app.router.add_get('/compact/{scene_id:\\d+}/{element_id:\\d+}', self.get_compact_point_cloud)
+        self.web_app.router.add_post('/visible_elements/{scene_id:\\d+}', self.get_visible_elements)
+        self.web_app.router.add_get('/conversions', self.get_conversions)
+        self.web_app.router.add_get('/conversions/{job_id:\\d+}', self.get_conversion)
+        self.web_app.router.add_route('*', '/conversions/{job_id:\\d+}/cancel', self.cancel_conversion_request)
+        self.web_app.router.add_route('*', '/upload/{location:.+}', self.upload_file)
+        # Has to be last, everything else is a front-end file
+        self.web_app.router.add_get('/{file_name:.+}', self.serve_front_end)
+
+    async def func(self, request: web.Request):
+        return create_cached_response(request, self.FRONT_END.index)
+
+    async def serve_front_end(self, request: web.Request):
+        file_name = request.match_info['file_name']
+        cached = self.FRONT_END.get(file_name)
+        if cached is not None:
+            return create_cached_response(request, cached)
+        resolved = await self.resolve_file(self.FRONT_END_FILES, file_name)
+        if resolved is None:
+            return create_404_response("File not found: " + file_name)
+        return create_file_response(request, resolved, {})
+
+    # Handle all data calls by returning it as octet-stream.
+    async def serve_data(self, request: web.Request):
+        file_name = request.match_info['file_name']
+        resolved = await self.resolve_file(self.DATA_FILES, file_name)
+        if resolved is None:
+            return create_404_response("File not found: " + file_name)
+        return create_file_response(request, resolved, {
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename="{resolved.path.name}"'
+        }, self.NODE_CACHE.get(file_name, resolved.etag))
+
+    async def resolve_file(self, files: PathCache, file_name: str) -> ResolvedFile:
+        fresh, resolved = files.cached(file_name)
+        if fresh:
+            return resolved
+        return await self.run_blocking(files.resolve, file_name)
+
+    async def serve_thumbnail(self, request: web.Request):
+        file_name = request.match_info['file_name']
+        thumbnail = await self.run_blocking(self.THUMBNAILS.get, file_name, int(request.match_info['size']))
+        if thumbnail is None:
+            return create_404_response("Image not found: " + file_name)
+        return web.FileResponse(thumbnail, headers={
+            **CORS_HEADERS,
+            'Content-Type': 'image/jpeg',
+            'Cache-Control': 'public, max-age=3600'
+        })
+
+    async def get_component_tree(self, request: web.Request):
+        scene_id = int(request.match_info['scene_id'])
+        if self.PREPARING:
+            return web.Response(text="[Server]: The scenes are still being prepared, see /conversions", status=503,
+                                headers=CORS_HEADERS)
+        if scene_id not in self.COMPONENT_TREE:
+            return create_404_response("Error: No component tree found with the provided ID")
+        return create_json_response(self.COMPONENT_TREE[scene_id])
+
+    async def get_level_of_detail(self, request: web.Request):
+        scene_id = int(request.match_info['scene_id'])
+        element_id = int(request.match_info['element_id'])
+        if scene_id not in self.SCENES or element_id >= len(self.SCENES[scene_id].elements):
+            return create_404_response("Error: No element found with the provided ID")
+        element = self.SCENES[scene_id].get_element(element_id)
+        if element.lod is None:
+            return create_404_response("Error: The element has no levels of detail")
+
+        if 'level' in request.query:
+            level = int(request.query['level'])
+        else:
+            budget = request.query.get('budget')
+            level = element.lod.select_level(None if budget is None else int(budget))
+        if not 0 <= level < len(element.lod):
+            return create_404_response(f"Error: Level {level} does not exist")
+        region = parse_region(request.query.get('min'), request.query.get('max'))
+
+        source = await self.run_blocking(element.get_lod_source, level, region)
+        return create_json_response({
+            element.key_lod_level: level,
+            element.key_lod_levels: element.lod.counts,
+            element.key_source: source
+        })
+
+    async def get_compact_point_cloud(self, request: web.Request):
+        scene_id = int(request.match_info['scene_id'])
+        element_id = int(request.match_info['element_id'])
+        if scene_id not in self.SCENES or element_id >= len(self.SCENES[scene_id].elements):
+            return create_404_response("Error: No element found with the provided ID")
+        element = self.SCENES[scene_id].get_element(element_id)
+        if getattr(element, 'compact_path', None) is None or not os.path.exists(element.compact_path):
+            return create_404_response("Error: The element has no compact export")
+        return web.FileResponse(element.compact_path, headers={
+            **CORS_HEADERS,
+            'Content-Type': 'application/octet-stream'
+        })
+
+    async def get_visible_elements(self, request: web.Request):
+        scene_id = int(request.match_info['scene_id'])
+        if scene_id not in self.SCENES or self.SCENES[scene_id].spatial_index is None:
+            return create_404_response("Error: No scene found with the provided ID")
+        camera = await request.json()
+        aspect = float(camera.get('aspect', 16 / 9))
+
+        visible = self.SCENES[scene_id].visible_elements(camera, aspect)
+        return create_json_response([{'elementId': element_id, 'screenSize': size} for element_id, size in visible])
+
+    async def get_conversions(self, request: web.Request):
+        return create_json_response([job.to_json() for job in self.CONVERSIONS.jobs.values()])
+
+    async def get_conversion(self, request: web.Request):
+        job = self.CONVERSIONS.get(int(request.match_info['job_id']))
+        if job is None:
+            return create_404_response("Error: No conversion found with the provided ID")
+        return create_json_response(job.to_json())
+
+    async def cancel_conversion_request(self, request: web.Request):
+        if request.method == 'OPTIONS':
+            return web.Response(text="Options supported.", headers=CORS_HEADERS)
+        if request.method != 'POST':
+            raise web.HTTPMethodNotAllowed(request.method, ['POST', 'OPTIONS'])
+        job_id = int(request.match_info['job_id'])
+        if not await self.run_blocking(self.CONVERSIONS.cancel, job_id):
+            return create_404_response("Error: No queued or running conversion found with the provided ID")
+        return create_json_response(self.CONVERSIONS.get(job_id).to_json())
+
+    async def upload_file(self, request: web.Request):
+        # Some browsers send an OPTIONS request. Here we ack it
+        if request.method == 'OPTIONS':
+            return web.Response(text="Options supported.", headers=CORS_HEADERS)
+        if request.method != 'POST':
+            raise web.HTTPMethodNotAllowed(request.method, ['POST', 'OPTIONS'])
+
+        reader = await request.multipart()
+        field = await reader.next()
+        while field is not None and field.name != 'file':
+            field = await reader.next()
+        if field is None:
+            return web.Response(text="[Server]: No file provided", status=404, headers=CORS_HEADERS)
+
+        save_path = os.path.join(self.output_path, request.match_info['location'])
+        await self.run_blocking(lambda: Path(save_path).mkdir(parents=True, exist_ok=True))
+        # TODO: new naming concept, here we simply the current time in ms.
+        file = await self.run_blocking(open, os.path.join(save_path, str(time.time()) + '.png'), 'wb')
+        try:
+            chunk = await field.read_chunk(UPLOAD_CHUNK_SIZE)
+            while chunk:
+                await self.run_blocking(file.write, chunk)
+                chunk = await field.read_chunk(UPLOAD_CHUNK_SIZE)
+        finally:
+            await self.run_blocking(file.close)
+        return web.Response(text="Upload successful.", headers=CORS_HEADERS)
+
+    # ----------------------
+    # SocketIO
+    # ----------------------
+
+    def connect_message_bus(self):
+        self.BUS.subscribe(CAMERA_SYNC, self.receive_camera_sync)
+        self.BUS.subscribe(ANIMATION, self.receive_scene_message)
+        self.BUS.subscribe(SCENE_UPDATE, self.receive_scene_message)
+        # The bus receives in its own thread, emit_to_scene hands the messages over to the event loop
+        self.BUS.start()
+
+    def emit_to_scene(self, event: str, data, scene_id, skip_sid=None):
+        asyncio.run_coroutine_threadsafe(self.emit_to_scene_async(event, data, scene_id, skip_sid), self.loop)
+
+    async def emit_to_scene_async(self, event: str, data, scene_id, skip_sid=None):
+        for encoding in [JSON, BINARY]:
+            await self.sio.emit(event, encode_message(event, data, scene_id, encoding),
+                                room=scene_room(scene_id, encoding), skip_sid=skip_sid)
+
+    def play_animation(self, animation_name: str, scene_id: int = 0):
+        async def send_animation_update():
+            for animation_data, sleep_duration in self.animation_frames(animation_name, scene_id):
+                self.publish_to_scene(ANIMATION, 'animation', animation_data, scene_id)
+                await self.sio.sleep(sleep_duration)
+
+        return asyncio.run_coroutine_threadsafe(send_animation_update(), self.loop)
+
+    async def start_point_streams(self):
+        while self.PREPARING:
+            await self.sio.sleep(0.1)
+        for scene_id, local_id, element in self.streams():
+            self.background_tasks.append(asyncio.create_task(self.stream_points(scene_id, local_id, element)))
+
+    async def report_conversions(self):
+        version = 0
+        while True:
+            changed, version = self.CONVERSIONS.changed_since(version)
+            for job in changed:
+                await self.sio.emit('conversion_progress', job.to_json())
+            await self.sio.sleep(self.CONVERSION_PROGRESS_INTERVAL)
+
+    async def stream_points(self, scene_id: int, local_id: int, element):
+        key = (scene_id, local_id)
+        self.STREAM_POSITIONS[key] = 0
+        while True:
+            await self.sio.sleep(1 / element.max_rate)
+            start = self.STREAM_POSITIONS[key]
+            points, colors = element.read(start, element.max_points_per_message)
+            if len(points) == 0:
+                continue
+            self.STREAM_POSITIONS[key] = start + len(points)
+            await self.sio.emit('point_delta', encode_point_delta(scene_id, local_id, start, points, colors),
+                                room=stream_room(scene_id, local_id))
+
+    def register_events(self):
+        self.sio.on('connect', self.connect)
+        self.sio.on('disconnect', self.disconnect)
+        self.sio.on('join_scene', self.join_scene)
+        self.sio.on('set_encoding', self.set_encoding)
+        self.sio.on('cancel_conversion', self.cancel_conversion)
+        self.sio.on('subscribe_stream', self.subscribe_stream)
+        self.sio.on('unsubscribe_stream', self.unsubscribe_stream)
+        self.sio.on('camera_sync', self.sync_camera_state)
+        self.sio.on('start_animation', self.start_animation)
+
+    async def connect(self, sid, environ):
+        scene_id = page_scene_id(environ)
+        if scene_id is not None:
+            self.CLIENT_SCENE[sid] = scene_id
+            await self.join_scene_room(sid, scene_id)
+        print('Client connected')
+
+    async def disconnect(self, sid, *args):
+        task = self.animation_tasks.pop(sid, None)
+        if task is not None:
+            task.cancel()
+        self.CLIENT_ENCODING.pop(sid, None)
+        self.CLIENT_SCENE.pop(sid, None)
+        print('Client disconnected')
+
+    async def join_scene_room(self, sid, scene_id):
+        room = scene_room(scene_id, self.CLIENT_ENCODING.get(sid, JSON))
+        current = self.sio.rooms(sid)
+        if room in current:
+            return
+        for other in current:
+            if other.startswith(SCENE_ROOM_PREFIX):
+                await self.sio.leave_room(sid, other)
+        await self.sio.enter_room(sid, room)
+
+    async def join_scene(self, sid, message):
+        data = json.loads(message)
+        # A client that names its scene also does so in its messages
+        self.CLIENT_SCENE.pop(sid, None)
+        await self.join_scene_room(sid, data['sceneId'])
+
+    async def cancel_conversion(self, sid, message):
+        data = json.loads(message)
+        return await self.run_blocking(self.CONVERSIONS.cancel, int(data['jobId']))
+
+    async def subscribe_stream(self, sid, message):
+        stream = self.find_stream(json.loads(message))
+        if stream is None:
+            return
+        await self.sio.enter_room(sid, stream_room(*stream))
+        for packet in self.stream_history(*stream):
+            await self.sio.emit('point_delta', packet, to=sid)
+
+    async def unsubscribe_stream(self, sid, message):
+        stream = self.find_stream(json.loads(message))
+        if stream is not None:
+            await self.sio.leave_room(sid, stream_room(*stream))
+
+    async def set_encoding(self, sid, message):
+        encoding = parse_encoding(message)
+        self.CLIENT_ENCODING[sid] = encoding
+        for room in self.sio.rooms(sid):
+            if room.startswith(SCENE_ROOM_PREFIX):
+                await self.join_scene_room(sid, room[len(SCENE_ROOM_PREFIX):].split('/')[0])
+        return encoding
+
+    async def sync_camera_state(self, sid, message):
+        scene_id, state = decode_camera_sync(message)
+        scene_id = self.CLIENT_SCENE.get(sid, scene_id)
+        await self.join_scene_room(sid, scene_id)
+        if self.update_camera_state(scene_id, state):
+            await self.emit_to_scene_async('camera_sync', state, scene_id, skip_sid=sid)
+            self.BUS.publish(CAMERA_SYNC, {'sceneId': scene_id, 'state': state}, self.NODE_ID)
+            if self.PREFETCHER is None:
+                return
+            # Predicting the views and selecting their nodes takes a while, keep it off the event loop
+            urls = await self.run_blocking(self.prefetch_nodes, scene_id, state)
+            if self.PREFETCH_HINTS and len(urls) > 0:
+                await self.sio.emit('prefetch', {'sceneId': scene_id, 'urls': urls}, to=sid)
+
+    async def start_animation(self, sid, message):
+        data = json.loads(message)
+        animation_name = data['animationName']
+        scene_id = int(data['sceneId'])
+        running = bool(data['running'])
+
+        if animation_name not in self.ANIMATION.keys():
+            print("[Server]: Error, no animation found with name " + animation_name)
+            return
+        if not running or sid in self.animation_tasks:
+            return
+
+        print("[Server]: Starting animation for sceneId " + str(scene_id))
+        encoding = self.CLIENT_ENCODING.get(sid, JSON)
+
+        async def send_animation_update():
+            try:
+                for animation_data, sleep_duration in self.animation_frames(animation_name, scene_id):
+                    # only send to originating user
+                    await self.sio.emit('animation', encode_message('animation', animation_data, scene_id, encoding),
+                                        to=sid)
+                    await self.sio.sleep(sleep_duration)
+            finally:
+                self.animation_tasks.pop(sid, None)
+
+        # Every client runs its own animation, they do not wait for each other
+        self.animation_tasks[sid] = asyncio.create_task(send_animation_update())
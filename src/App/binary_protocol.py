@@ -0,0 +1,177 @@
+import json
+import math
+import struct
+from typing import Tuple, Union
+
+import numpy
+
+from src.Components.base import CameraState
+
+# Clients choose an encoding with the 'set_encoding' event. JSON is the default, binary clients send and receive
+# camera updates and animation frames as fixed-layout pose packets.
+JSON = 'json'
+BINARY = 'binary'
+ENCODINGS = [JSON, BINARY]
+
+KIND_CAMERA_SYNC = 1
+KIND_ANIMATION = 2
+KIND_POINT_DELTA = 3
+
+FLAG_SCREENSHOT = 1
+FLAG_COLORS = 1
+
+key_last_update = 'lastUpdate'
+
+# kind, flags, scene id, last update, position (3), quaternion (4), up (3), fov, near, far, zoom
+# An animation frame is followed by the screenshot directory as UTF-8.
+POSE_PACKET = struct.Struct('<BBHd14f')
+
+
+def _vector(value, keys) -> list:
+    """Vectors are either lists or objects like three.js sends them, e.g. {'x': 1, 'y': 2, 'z': 3}."""
+    if isinstance(value, dict):
+        return [value.get(k, value.get('_' + k, 0)) for k in keys]
+    return list(value)
+
+
+def euler_to_quaternion(x: float, y: float, z: float) -> list:
+    """Quaternion (x, y, z, w) of three.js Euler angles in the default 'XYZ' order."""
+    c1, c2, c3 = math.cos(x / 2), math.cos(y / 2), math.cos(z / 2)
+    s1, s2, s3 = math.sin(x / 2), math.sin(y / 2), math.sin(z / 2)
+    return [s1 * c2 * c3 + c1 * s2 * s3,
+            c1 * s2 * c3 - s1 * c2 * s3,
+            c1 * c2 * s3 + s1 * s2 * c3,
+            c1 * c2 * c3 - s1 * s2 * s3]
+
+
+def quaternion_to_euler(x: float, y: float, z: float, w: float) -> list:
+    """Euler angles in the 'XYZ' order of a quaternion (x, y, z, w), as three.js computes them."""
+    m11, m12, m13 = 1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)
+    m22, m23 = 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)
+    m32, m33 = 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)
+    ey = math.asin(max(-1.0, min(1.0, m13)))
+    if abs(m13) < 0.9999999:
+        return [math.atan2(-m23, m33), ey, math.atan2(-m12, m11)]
+    return [math.atan2(m32, m22), ey, 0.0]
+
+
+def _pose(state: dict) -> list:
+    position = _vector(state.get(CameraState.key_position, [0, 0, 0]), 'xyz')
+    if CameraState.key_quaternion in state:
+        quaternion = _vector(state[CameraState.key_quaternion], 'xyzw')
+    elif 'rotation' in state:
+        quaternion = euler_to_quaternion(*_vector(state['rotation'], 'xyz'))
+    else:
+        quaternion = [0, 0, 0, 1]
+    up = _vector(state.get(CameraState.key_up, [0, 1, 0]), 'xyz')
+    return position + quaternion + up + [state.get(CameraState.key_fov, 60),
+                                         state.get(CameraState.key_near, 0.1),
+                                         state.get(CameraState.key_far, 100000),
+                                         state.get(CameraState.key_zoom, 1)]
+
+
+def _state(values) -> dict:
+    # JSON clients that only read the Euler 'rotation' still get the pose of binary clients
+    rotation = quaternion_to_euler(*values[3:7])
+    return {
+        CameraState.key_position: list(values[0:3]),
+        CameraState.key_quaternion: list(values[3:7]),
+        'rotation': {'_x': rotation[0], '_y': rotation[1], '_z': rotation[2], '_order': 'XYZ'},
+        CameraState.key_up: list(values[7:10]),
+        CameraState.key_fov: values[10],
+        CameraState.key_near: values[11],
+        CameraState.key_far: values[12],
+        CameraState.key_zoom: values[13],
+    }
+
+
+def encode_camera_state(state: dict, scene_id: int) -> bytes:
+    return POSE_PACKET.pack(KIND_CAMERA_SYNC, 0, scene_id, state.get(key_last_update, 0), *_pose(state))
+
+
+def decode_camera_state(packet: bytes) -> Tuple[int, dict]:
+    """Returns the scene id and the state, shaped like CameraState.to_json with the 'lastUpdate'."""
+    kind, _, scene_id, last_update, *values = POSE_PACKET.unpack_from(packet)
+    if kind != KIND_CAMERA_SYNC:
+        raise Exception(f"Expected a camera sync packet, got kind {kind}")
+    state = _state(values)
+    state[key_last_update] = last_update
+    return scene_id, state
+
+
+def encode_animation_frame(animation_data: dict, scene_id: int) -> Union[bytes, None]:
+    # Frames of a point cloud sequence have no binary form
+    if 'cameraState' not in animation_data or 'sequence' in animation_data:
+        return None
+    flags = FLAG_SCREENSHOT if animation_data.get('screenshot') else 0
+    directory = animation_data.get('screenshotDirectory', '').encode()
+    return POSE_PACKET.pack(KIND_ANIMATION, flags, scene_id, 0, *_pose(animation_data['cameraState'])) + directory
+
+
+def decode_animation_frame(packet: bytes) -> Tuple[int, dict]:
+    kind, flags, scene_id, _, *values = POSE_PACKET.unpack_from(packet)
+    if kind != KIND_ANIMATION:
+        raise Exception(f"Expected an animation packet, got kind {kind}")
+    return scene_id, {
+        'screenshot': bool(flags & FLAG_SCREENSHOT),
+        'screenshotDirectory': packet[POSE_PACKET.size:].decode(),
+        'cameraState': _state(values)
+    }
+
+
+# kind, flags, scene id, element id, index of the first point, number of points. Followed by the positions as
+# float32 (x, y, z) and, if FLAG_COLORS is set, the colors as uint8 (r, g, b).
+POINT_DELTA_HEADER = struct.Struct('<BBHIII')
+
+
+def encode_point_delta(scene_id: int, element_id: int, start: int, points: numpy.ndarray,
+                       colors: numpy.ndarray = None) -> bytes:
+    flags = 0 if colors is None else FLAG_COLORS
+    header = POINT_DELTA_HEADER.pack(KIND_POINT_DELTA, flags, scene_id, element_id, start, len(points))
+    body = numpy.ascontiguousarray(points, dtype='<f4').tobytes()
+    if colors is not None:
+        body += numpy.ascontiguousarray(colors, dtype=numpy.uint8).tobytes()
+    return header + body
+
+
+def decode_point_delta(packet: bytes) -> dict:
+    kind, flags, scene_id, element_id, start, count = POINT_DELTA_HEADER.unpack_from(packet)
+    if kind != KIND_POINT_DELTA:
+        raise Exception(f"Expected a point delta packet, got kind {kind}")
+    offset = POINT_DELTA_HEADER.size
+    points = numpy.frombuffer(packet, dtype='<f4', count=count * 3, offset=offset).reshape(-1, 3)
+    colors = None
+    if flags & FLAG_COLORS:
+        colors = numpy.frombuffer(packet, dtype=numpy.uint8, count=count * 3, offset=offset + points.nbytes)
+        colors = colors.reshape(-1, 3)
+    return {'sceneId': scene_id, 'elementId': element_id, 'start': start, 'points': points, 'colors': colors}
+
+
+ENCODERS = {
+    'camera_sync': encode_camera_state,
+    'animation': encode_animation_frame,
+}
+
+
+def encode_message(event: str, data, scene_id: int, encoding: str = BINARY) -> Union[bytes, dict]:
+    """The message of an event for clients using 'encoding', events without a binary form are sent as they are."""
+    encoder = ENCODERS.get(event)
+    if encoding == JSON or encoder is None:
+        return data
+    encoded = encoder(data, scene_id)
+    return data if encoded is None else encoded
+
+
+def decode_camera_sync(message: Union[str, bytes]) -> Tuple[int, dict]:
+    """Scene id and state of a camera_sync message in either encoding."""
+    if isinstance(message, (bytes, bytearray)):
+        return decode_camera_state(message)
+    data = json.loads(message)
+    return data['sceneId'], data['state']
+
+
+def parse_encoding(message: str) -> str:
+    encoding = json.loads(message)['encoding']
+    if encoding not in ENCODINGS:
+        raise Exception(f"Unknown encoding {encoding}, expected one of {ENCODINGS}")
+    return encoding
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+def resolve_inside(directory: str, file_name: str) -> Path:
+    """The file below 'directory', None if it does not exist or the path leaves the directory."""
+    base = Path(directory).resolve()
+    path = (base / file_name).resolve()
+    if base not in path.parents or not path.is_file():
+        return None
+    return path
+
+
+class ResolvedFile:
+
+    def __init__(self, path: Path, size: int, mtime: float, mtime_ns: int) -> None:
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        # Like nginx, the ETag is derived from the modification time and size instead of the content
+        self.etag = f"{mtime_ns:x}-{size:x}"
+
+
+class PathCache:
+    """Remembers for a while which request paths point to which files below a directory, and their stat results.
+
+    Requests for Potree nodes come by the hundreds, this spares each of them resolving the path, the traversal
+    check and the stat. Missing files are remembered as well. An entry is trusted for 'ttl' seconds, a file
+    changed on disk is therefore served with its old size and ETag for at most that long.
+    """
+
+    def __init__(self, directory: str, ttl: float = 2., max_entries: int = 100000) -> None:
+        super().__init__()
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # file_name -> (expiry, resolved file or None if it does not exist)
+        self._entries: Dict[str, Tuple[float, Optional[ResolvedFile]]] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, file_name: str) -> Tuple[bool, Optional[ResolvedFile]]:
+        """Whether a fresh entry exists and the entry, never touches the disk."""
+        entry = self._entries.get(file_name)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    def resolve(self, file_name: str) -> Optional[ResolvedFile]:
+        """The file below the directory, None if it does not exist or the path leaves the directory."""
+        fresh, resolved = self.cached(file_name)
+        if fresh:
+            return resolved
+
+        path = resolve_inside(self.directory, file_name)
+        resolved = None
+        if path is not None:
+            try:
+                stat = os.stat(path)
+                resolved = ResolvedFile(path, stat.st_size, stat.st_mtime, stat.st_mtime_ns)
+            except OSError:
+                pass
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[file_name] = (time.monotonic() + self.ttl, resolved)
+        return resolved
+
+    def invalidate(self, file_name: str = None):
+        with self._lock:
+            if file_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(file_name, None)
+
+
+class NodeCache:
+    """Contents of files kept in memory, the least recently used ones are dropped beyond 'max_bytes'.
+
+    Filled by the NodePrefetcher with the Potree nodes a camera is about to see, before the viewer asks for them.
+    An entry is only served while the ETag of its file is unchanged.
+    """
+
+    def __init__(self, max_bytes: int = 256 << 20, max_file_size: int = 16 << 20) -> None:
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # file_name -> (etag, content)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, file_name: str) -> bool:
+        with self._lock:
+            return file_name in self._entries
+
+    def get(self, file_name: str, etag: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(file_name)
+            self.hits += 1
+            return entry[1]
+
+    def load(self, file_name: str, resolved: ResolvedFile):
+        """Reads the file into the cache, unless it is larger than 'max_file_size'."""
+        if resolved.size > self.max_file_size or resolved.size > self.max_bytes:
+            return
+        with open(resolved.path, 'rb') as f:
+            content = f.read()
+        with self._lock:
+            previous = self._entries.pop(file_name, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self._entries[file_name] = (resolved.etag, content)
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.size -= len(dropped)
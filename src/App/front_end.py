@@ -0,0 +1,61 @@
+import hashlib
+import mimetypes
+import re
+from os import listdir
+from os.path import join, isfile, dirname, abspath
+
+FRONT_END_DIRECTORY = abspath(join(dirname(__file__), '../../front-end'))
+
+
+class CachedFile:
+
+    def __init__(self, content: bytes, mimetype: str, cache_control: str) -> None:
+        super().__init__()
+        self.content = content
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.etag = hashlib.md5(content).hexdigest()
+
+
+class FrontEndCache:
+    # Angular appends a content hash to the bundle names (e.g. main.11f638e12215ea80.js), so the file behind a
+    # name never changes and browsers may keep it forever. The index.html is not hashed and must be revalidated.
+    HASHED_FILE = re.compile(r'^[\w-]+\.[0-9a-f]{16,}\.(js|css)$')
+    PORT_SETTING = re.compile(r'window\[\'port\'\] = \d+')
+
+    INDEX_CACHE_CONTROL = 'no-cache'
+    IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def __init__(self, directory: str = FRONT_END_DIRECTORY) -> None:
+        super().__init__()
+        self.directory = directory
+        self.index = None
+        self.files = {}
+
+    # Why use regex instead of a template variable?
+    # 1) Template variables can only be inserted in non-script tags but there would be a work around.
+    # 2) When using a template variable, the index.html changes. That means that every time the front-end gets built,
+    #    this has to be inserted again or automated somehow as Angular cannot deal with these template variables.
+    # The result is only kept in memory, so several instances on different ports never touch the file on disk.
+    def load(self, port: int):
+        with open(join(self.directory, 'index.html')) as f:
+            index = f.read()
+
+        if self.PORT_SETTING.search(index) is None:
+            raise Exception("Could not find the port setting in the front-end index.html")
+        index = self.PORT_SETTING.sub(f'window[\'port\'] = {port}', index, count=1)
+        self.index = CachedFile(index.encode(), 'text/html', self.INDEX_CACHE_CONTROL)
+
+        self.files = {}
+        for file_name in listdir(self.directory):
+            if not self.HASHED_FILE.match(file_name) or not isfile(join(self.directory, file_name)):
+                continue
+            with open(join(self.directory, file_name), 'rb') as f:
+                content = f.read()
+            mimetype = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+            self.files[file_name] = CachedFile(content, mimetype, self.IMMUTABLE_CACHE_CONTROL)
+
+    def get(self, file_name: str) -> CachedFile:
+        if file_name == 'index.html':
+            return self.index
+        return self.files.get(file_name)
@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy
+import socketio
+
+from src.App.binary_protocol import JSON, BINARY, ENCODINGS, key_last_update, encode_camera_state, \
+    decode_camera_state
+from src.Components.base import CameraState
+
+LOAD_TEST_ANIMATION = 'load_test'
+PERCENTILES = [50, 90, 99]
+
+
+def process_cpu_time(pid: int) -> Optional[float]:
+    """User and system CPU seconds of a process, read from /proc, so only available on Linux."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def orbit_state(client: int, index: int) -> dict:
+    angle = client + index * 0.05
+    return {
+        CameraState.key_position: [100 * math.cos(angle), 100 * math.sin(angle), 20],
+        CameraState.key_quaternion: [0, 0, math.sin(angle / 2), math.cos(angle / 2)],
+        CameraState.key_up: [0, 0, 1],
+        CameraState.key_fov: 60,
+        CameraState.key_near: 0.1,
+        CameraState.key_far: 100000,
+        CameraState.key_zoom: 1,
+        # Milliseconds like the front-end sends them, the receivers measure the latency against it
+        key_last_update: time.time() * 1000
+    }
+
+
+class LoadClient:
+    """One simulated viewer. Moving clients send camera_sync messages, all of them record what they receive."""
+
+    def __init__(self, index: int, scene_id: int, encoding: str = JSON) -> None:
+        super().__init__()
+        self.index = index
+        self.scene_id = scene_id
+        self.encoding = encoding
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on('camera_sync', self.on_camera_sync)
+        self.sio.on('animation', self.on_animation)
+        # lastUpdate of every received camera state -> latency in milliseconds
+        self.received: Dict[float, float] = {}
+        self.frame_times: List[float] = []
+        self.sent = 0
+
+    async def connect(self, url: str):
+        await self.sio.connect(url, transports=['websocket'])
+        if self.encoding != JSON:
+            await self.sio.call('set_encoding', json.dumps({'encoding': self.encoding}))
+        await self.sio.emit('join_scene', json.dumps({'sceneId': self.scene_id}))
+
+    async def disconnect(self):
+        await self.sio.disconnect()
+
+    def on_camera_sync(self, message):
+        now = time.time() * 1000
+        if isinstance(message, (bytes, bytearray)):
+            _, state = decode_camera_state(message)
+        else:
+            state = json.loads(message) if isinstance(message, str) else message
+        self.received[state[key_last_update]] = now - state[key_last_update]
+
+    def on_animation(self, _):
+        self.frame_times.append(time.monotonic())
+
+    async def send_camera(self) -> float:
+        state = orbit_state(self.index, self.sent)
+        self.sent += 1
+        if self.encoding == BINARY:
+            message = encode_camera_state(state, self.scene_id)
+        else:
+            message = json.dumps({'sceneId': self.scene_id, 'state': state})
+        await self.sio.emit('camera_sync', message)
+        return state[key_last_update]
+
+    async def start_animation(self):
+        await self.sio.emit('start_animation', json.dumps({
+            'animationName': LOAD_TEST_ANIMATION,
+            'sceneId': self.scene_id,
+            'running': True
+        }))
+
+
+async def move_camera(client: LoadClient, rate: float, until: float, sent: Dict[float, LoadClient]):
+    """Sends camera states at about 'rate' per second with some jitter, like a user dragging the view."""
+    loop = asyncio.get_running_loop()
+    interval = 1 / rate
+    next_send = loop.time() + random.uniform(0, interval)
+    while next_send < until:
+        await asyncio.sleep(max(next_send - loop.time(), 0))
+        sent[await client.send_camera()] = client
+        next_send += interval * random.uniform(0.8, 1.2)
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    if len(latencies) == 0:
+        return {}
+    summary = {f'p{p}': float(v) for p, v in zip(PERCENTILES, numpy.percentile(latencies, PERCENTILES))}
+    summary['max'] = float(max(latencies))
+    return summary
+
+
+def evaluate(clients: List[LoadClient], sent: Dict[float, LoadClient], late_ms: float,
+             frame_interval: float) -> dict:
+    """Compares what was sent with what arrived.
+
+    The server forwards a camera state only if it is 30 ms newer than the last one of the scene, states that
+    reached no client at all count as throttled. Every forwarded state should reach all other clients of its scene.
+    """
+    by_scene: Dict[int, List[LoadClient]] = {}
+    for client in clients:
+        by_scene.setdefault(client.scene_id, []).append(client)
+
+    latencies, expected, delivered, forwarded = [], 0, 0, 0
+    for last_update, sender in sent.items():
+        receivers = [c for c in by_scene[sender.scene_id] if c is not sender]
+        arrived = [c.received[last_update] for c in receivers if last_update in c.received]
+        if len(arrived) == 0:
+            continue
+        forwarded += 1
+        expected += len(receivers)
+        delivered += len(arrived)
+        latencies.extend(arrived)
+
+    frames, late_frames = 0, 0
+    for client in clients:
+        frames += len(client.frame_times)
+        late_frames += int(numpy.sum(numpy.diff(client.frame_times) > frame_interval + late_ms / 1000))
+
+    return {
+        'sent': len(sent),
+        'forwarded': forwarded,
+        'throttled': len(sent) - forwarded,
+        'expectedDeliveries': expected,
+        'delivered': delivered,
+        'dropped': expected - delivered,
+        'late': sum(1 for latency in latencies if latency > late_ms),
+        'latencyMs': latency_summary(latencies),
+        'animationFrames': frames,
+        'lateAnimationFrames': late_frames
+    }
+
+
+async def run_load(url: str, clients: int, movers: int, rate: float, duration: float, scenes: int = 1,
+                   encoding: str = JSON, animations: int = 0, late_ms: float = 100, frame_interval: float = 0.08,
+                   server_pid: int = None) -> dict:
+    load_clients = [LoadClient(i, i % scenes, encoding) for i in range(clients)]
+    await asyncio.gather(*[client.connect(url) for client in load_clients])
+    print(f"[Info]: Connected {clients} clients to {url}")
+
+    server_cpu = None if server_pid is None else process_cpu_time(server_pid)
+    own_cpu = time.process_time()
+    start = time.monotonic()
+
+    sent: Dict[float, LoadClient] = {}
+    for client in load_clients[:animations]:
+        await client.start_animation()
+    until = asyncio.get_running_loop().time() + duration
+    await asyncio.gather(*[move_camera(client, rate, until, sent) for client in load_clients[:movers]])
+    # Give the last messages time to arrive
+    await asyncio.sleep(max(1., late_ms / 1000))
+
+    elapsed = time.monotonic() - start
+    results = evaluate(load_clients, sent, late_ms, frame_interval)
+    results.update({'clients': clients, 'movers': movers, 'rate': rate, 'encoding': encoding,
+                    'duration': elapsed, 'loadGeneratorCpu': (time.process_time() - own_cpu) / elapsed})
+    if server_cpu is not None:
+        results['serverCpu'] = (process_cpu_time(server_pid) - server_cpu) / elapsed
+
+    await asyncio.gather(*[client.disconnect() for client in load_clients], return_exceptions=True)
+    return results
+
+
+def print_results(results: dict):
+    print(f"Clients: {results['clients']}, {results['movers']} moving at {results['rate']}/s, "
+          f"{results['encoding']} encoding, {results['duration']:.1f}s")
+    print(f"camera_sync: {results['sent']} sent, {results['forwarded']} forwarded, "
+          f"{results['throttled']} throttled by the server")
+    print(f"Deliveries: {results['delivered']} of {results['expectedDeliveries']}, {results['dropped']} dropped, "
+          f"{results['late']} late")
+    print("Latency [ms]: " + ", ".join(f"{k} {v:.1f}" for k, v in results['latencyMs'].items()))
+    print(f"Animation frames: {results['animationFrames']}, {results['lateAnimationFrames']} late")
+    if 'serverCpu' in results:
+        print(f"Server CPU: {results['serverCpu'] * 100:.1f}%")
+    print(f"Load generator CPU: {results['loadGeneratorCpu'] * 100:.1f}%")
+
+
+def serve(backend: str, port: int, scenes: int, frames: int, frame_interval: float):
+    """A server with empty scenes and an animation of 'frames' frames, started by the load test itself."""
+    if backend == 'async':
+        from src.App.async_app import AsyncTarasp as Server
+    else:
+        from src.App.app import Tarasp as Server
+
+    app = Server(port=port)
+    for _ in range(scenes):
+        app.add_scene()
+
+    def animation(index: int):
+        if index >= frames:
+            return None
+        return CameraState([100 * math.cos(index * 0.05), 100 * math.sin(index * 0.05), 20], [0, 0, 0, 1])
+
+    app.add_animation(animation, LOAD_TEST_ANIMATION, sleep_duration=frame_interval)
+    app.run()
+
+
+def start_server(args) -> subprocess.Popen:
+    # A process of its own, so the clients do not compete with the server for the interpreter and its CPU is
+    # measured on its own
+    process = subprocess.Popen([sys.executable, '-m', 'src.App.load_test', '--serve', args.backend,
+                                '--port', str(args.port), '--scenes', str(args.scenes),
+                                '--frames', str(args.frames), '--frame-interval', str(args.frame_interval)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"The {args.backend} server exited with code {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise Exception(f"The {args.backend} server did not start within 30s")
+
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates Socket.IO clients of a Tarasp server and measures how "
+                                                 "long camera updates take to reach the other clients.")
+    parser.add_argument('--url', help="A running server, by default a local one is started")
+    parser.add_argument('--server-pid', type=int, help="Process id of the running server, to measure its CPU")
+    parser.add_argument('--backend', choices=['flask', 'async'], default='flask',
+                        help="Backend of the local server")
+    parser.add_argument('--port', type=int, default=5099, help="Port of the local server")
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--movers', type=int, default=1, help="Clients that send camera_sync messages")
+    parser.add_argument('--rate', type=float, default=30, help="camera_sync messages per second of every mover")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds")
+    parser.add_argument('--scenes', type=int, default=1, help="The clients are spread over that many scenes")
+    parser.add_argument('--encoding', choices=ENCODINGS, default=JSON)
+    parser.add_argument('--animations', type=int, default=0, help="Clients that start the animation")
+    parser.add_argument('--frames', type=int, default=100, help="Frames of the animation of the local server")
+    parser.add_argument('--frame-interval', type=float, default=0.08, help="Seconds between animation frames")
+    parser.add_argument('--late', type=float, default=100, help="Milliseconds after which a message counts as late")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    parser.add_argument('--serve', choices=['flask', 'async'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        try:
+            serve(args.serve, args.port, args.scenes, args.frames, args.frame_interval)
+        except KeyboardInterrupt:  # stopped by stop_server
+            pass
+        return
+
+    server = None
+    url, server_pid = args.url, args.server_pid
+    if url is None:
+        server = start_server(args)
+        url, server_pid = f"http://127.0.0.1:{args.port}", server.pid
+    try:
+        results = asyncio.run(run_load(url, args.clients, args.movers, args.rate, args.duration, args.scenes,
+                                       args.encoding, args.animations, args.late, args.frame_interval,
+                                       server_pid))
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
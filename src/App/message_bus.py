@@ -0,0 +1,266 @@
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional
+
+CAMERA_SYNC = 'camera_sync'
+ANIMATION = 'animation'
+SCENE_UPDATE = 'scene_update'
+
+DEFAULT_SOCKET_PATH = '/tmp/tarasp-bus.sock'
+
+# Every frame on the Unix socket is the length of the payload followed by the JSON payload
+FRAME_HEADER = struct.Struct('!I')
+
+Callback = Callable[[dict, str], None]
+
+
+def frame_key(channel: str, message: dict) -> Optional[Hashable]:
+    """Frames with the same key replace each other while they wait to be sent, None for frames that never do.
+
+    Only the newest camera state of a scene matters, older ones are dropped for a receiver that falls behind.
+    """
+    if channel == CAMERA_SYNC:
+        return channel, message.get('sceneId')
+    return None
+
+
+class PendingFrames:
+    """Frames waiting to be written to a receiver, in the order they were added.
+
+    A frame replaces a pending one with the same key, see frame_key. Beyond 'max_frames' the oldest frames are
+    dropped, so a receiver that stops reading cannot make the sender buffer without limit.
+    """
+
+    def __init__(self, max_frames: int = 1024) -> None:
+        super().__init__()
+        self.max_frames = max_frames
+        self.dropped = 0
+        self._frames: OrderedDict = OrderedDict()
+        self._count = itertools.count()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def add(self, frame: bytes, key: Hashable = None):
+        if key is None:
+            key = next(self._count)
+        elif key in self._frames:
+            del self._frames[key]
+            self.dropped += 1
+        self._frames[key] = frame
+        if len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+            self.dropped += 1
+
+    def take(self) -> bytes:
+        """All pending frames, which are no longer pending afterwards."""
+        frames = b''.join(self._frames.values())
+        self._frames.clear()
+        return frames
+
+
+def start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+class MessageBus(ABC):
+    """Delivers messages published on a channel to every subscriber of that channel, possibly in other processes.
+
+    Subscribers are called with the message and the origin passed to publish, so a server can ignore its own
+    messages.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._subscribers: Dict[str, List[Callback]] = {}
+
+    def subscribe(self, channel: str, callback: Callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def _deliver(self, channel: str, message: dict, origin: str):
+        for callback in self._subscribers.get(channel, []):
+            callback(message, origin)
+
+    def start(self, background_task: Callable = start_thread, sleep: Callable[[float], None] = time.sleep):
+        """Starts receiving messages. The server passes its own ways of starting tasks and sleeping."""
+        pass
+
+    @abstractmethod
+    def publish(self, channel: str, message: dict, origin: str):
+        pass
+
+    def close(self):
+        pass
+
+
+class InProcessBus(MessageBus):
+    """All subscribers live in this process, messages are delivered right away."""
+
+    def publish(self, channel: str, message: dict, origin: str):
+        self._deliver(channel, message, origin)
+
+
+class UnixSocketBus(MessageBus):
+    """Connects the processes of one machine through a broker listening on a Unix socket, see run_broker."""
+
+    POLL_INTERVAL = 0.005
+    CONNECT_ATTEMPTS = 50
+
+    def __init__(self, path: str = DEFAULT_SOCKET_PATH) -> None:
+        super().__init__()
+        self.path = path
+        self._socket = None
+        self._send_lock = threading.Lock()
+        # Frames not written yet because the socket buffer is full, the rest of a partly written frame first
+        self._pending = PendingFrames()
+        self._unsent = b''
+        self._running = False
+
+    def start(self, background_task: Callable = start_thread, sleep: Callable[[float], None] = time.sleep):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        for attempt in range(self.CONNECT_ATTEMPTS):
+            try:
+                self._socket.connect(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == self.CONNECT_ATTEMPTS - 1:
+                    raise Exception(f"No message broker is listening on {self.path}")
+                sleep(0.1)
+        # Publishing is called from the handlers of the servers, it must never wait for the broker
+        self._socket.setblocking(False)
+        self._running = True
+        background_task(self._receive, sleep)
+
+    def _receive(self, sleep: Callable[[float], None]):
+        # Polls instead of blocking in recv, so it also works as a green thread when the socket module
+        # is not monkey patched.
+        buffer = b''
+        while self._running:
+            # Also writes what publish left behind when the socket buffer was full
+            self.flush()
+            readable, _, _ = select.select([self._socket], [], [], 0)
+            if len(readable) == 0:
+                sleep(self.POLL_INTERVAL)
+                continue
+            try:
+                data = self._socket.recv(1 << 16)
+            except BlockingIOError:
+                continue
+            if not data:
+                print("[Server]: Lost the connection to the message broker")
+                return
+            buffer += data
+            while len(buffer) >= FRAME_HEADER.size:
+                length = FRAME_HEADER.unpack_from(buffer)[0]
+                if len(buffer) < FRAME_HEADER.size + length:
+                    break
+                frame = json.loads(buffer[FRAME_HEADER.size:FRAME_HEADER.size + length])
+                buffer = buffer[FRAME_HEADER.size + length:]
+                self._deliver(frame['channel'], frame['message'], frame['origin'])
+
+    def publish(self, channel: str, message: dict, origin: str):
+        # The broker does not send frames back to their sender, deliver them locally first
+        self._deliver(channel, message, origin)
+        payload = json.dumps({'channel': channel, 'message': message, 'origin': origin}).encode()
+        with self._send_lock:
+            self._pending.add(FRAME_HEADER.pack(len(payload)) + payload, frame_key(channel, message))
+        self.flush()
+
+    def flush(self):
+        """Writes as many pending frames as the socket takes without blocking."""
+        with self._send_lock:
+            while self._socket is not None:
+                if len(self._unsent) == 0:
+                    self._unsent = self._pending.take()
+                    if len(self._unsent) == 0:
+                        return
+                try:
+                    sent = self._socket.send(self._unsent)
+                except BlockingIOError:
+                    return
+                self._unsent = self._unsent[sent:]
+
+    def close(self):
+        self._running = False
+        if self._socket is not None:
+            self._socket.close()
+
+
+class BrokerPeer:
+    """A process connected to the broker, with its own queue of frames and a task writing them.
+
+    Relaying only adds to the queue. The writer waits until the process has read what was written before, frames
+    arriving meanwhile are pending and camera states replace each other, see PendingFrames.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        super().__init__()
+        self.writer = writer
+        self.pending = PendingFrames()
+        self._ready = asyncio.Event()
+
+    def send(self, frame: bytes, key: Hashable = None):
+        self.pending.add(frame, key)
+        self._ready.set()
+
+    async def write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                self.writer.write(self.pending.take())
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+
+
+def run_broker(path: str = DEFAULT_SOCKET_PATH):
+    """Relays every frame received on the Unix socket to all other connected processes."""
+    peers = set()
+
+    async def relay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = BrokerPeer(writer)
+        peers.add(peer)
+        write_task = asyncio.create_task(peer.write())
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                payload = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                frame = json.loads(payload)
+                key = frame_key(frame['channel'], frame['message'])
+                for other in peers:
+                    if other is not peer:
+                        other.send(header + payload, key)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            peers.discard(peer)
+            write_task.cancel()
+            writer.close()
+
+    async def serve():
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(relay, path=path)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def start_broker(path: str = DEFAULT_SOCKET_PATH) -> multiprocessing.Process:
+    broker = multiprocessing.Process(target=run_broker, args=(path,), daemon=True)
+    broker.start()
+    return broker
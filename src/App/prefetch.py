@@ -0,0 +1,245 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, join, relpath
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy
+
+from src.App.binary_protocol import key_last_update
+from src.App.file_cache import NodeCache, PathCache
+from src.App.spatial_index import Frustum
+from src.Components.base import CameraState
+from src.SceneElements.elements import PotreePointCloud
+from src.SceneElements.potree_octree import PotreeOctree
+
+# Potree 1.6 only loads a node whose bounding sphere covers at least 150 pixels (minimumNodePixelSize), here
+# relative to half the height of a 1080p screen like Frustum.screen_size
+MIN_NODE_SCREEN_SIZE = 150 / 540
+# Seconds after the last camera state for which the view is predicted
+PREDICTION_HORIZONS = (0.25, 0.5, 1.)
+# The velocity of the camera is measured over the states of the last milliseconds
+MOTION_WINDOW = 300
+MOTION_STATES = 8
+# Seconds between two predictions for the same scene, the states in between only update the motion
+PREDICTION_INTERVAL = 0.05
+
+
+def quaternion_multiply(a, b) -> numpy.ndarray:
+    """Product of two quaternions given as (x, y, z, w) like three.js stores them."""
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return numpy.array([
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz
+    ])
+
+
+def extrapolate_rotation(previous, last, factor: float) -> numpy.ndarray:
+    """Continues turning from 'previous' over 'last' by 'factor' times the rotation between them."""
+    x, y, z, w = previous
+    delta = quaternion_multiply(last, [-x, -y, -z, w])
+    if delta[3] < 0:  # the shorter way around
+        delta = -delta
+    angle = 2 * math.acos(min(delta[3], 1.))
+    if angle < 1e-9:
+        return numpy.asarray(last, dtype=numpy.float64)
+    axis = delta[:3] / numpy.linalg.norm(delta[:3])
+    half = angle * factor / 2
+    return quaternion_multiply([*(axis * math.sin(half)), math.cos(half)], last)
+
+
+def predict_cameras(states: List[dict], horizons=PREDICTION_HORIZONS) -> List[dict]:
+    """Camera states 'horizons' seconds after the last one, moving and turning on as over the recent states.
+
+    Empty if the camera stands still.
+    """
+    last = states[-1]
+    first = next(s for s in states if last[key_last_update] - s[key_last_update] <= MOTION_WINDOW)
+    elapsed = (last[key_last_update] - first[key_last_update]) / 1000
+    if elapsed <= 0:
+        return []
+    position = numpy.asarray(last[CameraState.key_position], dtype=numpy.float64)
+    velocity = (position - numpy.asarray(first[CameraState.key_position], dtype=numpy.float64)) / elapsed
+    if numpy.allclose(velocity, 0) and numpy.allclose(first[CameraState.key_quaternion],
+                                                      last[CameraState.key_quaternion]):
+        return []
+
+    return [{
+        **last,
+        CameraState.key_position: (position + velocity * horizon).tolist(),
+        CameraState.key_quaternion: extrapolate_rotation(first[CameraState.key_quaternion],
+                                                         last[CameraState.key_quaternion],
+                                                         horizon / elapsed).tolist(),
+        key_last_update: last[key_last_update] + horizon * 1000
+    } for horizon in horizons]
+
+
+class OctreeNodes:
+    """World space bounds of the nodes of a converted PotreePointCloud and the files a viewer loads for them."""
+
+    def __init__(self, element: PotreePointCloud, data_directory: str = './data') -> None:
+        super().__init__()
+        octree = PotreeOctree(element.converted_directory)
+        # Breadth-first, every parent comes before its children
+        self.names = sorted(octree.nodes, key=lambda name: (len(name), name))
+        index = {name: i for i, name in enumerate(self.names)}
+        self.counts = numpy.array([octree.nodes[name] for name in self.names], dtype=numpy.int64)
+        self.parents = numpy.array([index.get(name[:-1], -1) for name in self.names], dtype=numpy.int64)
+        lengths = numpy.array([len(name) for name in self.names])
+        self.levels = [numpy.flatnonzero(lengths == length) for length in range(2, lengths.max() + 1)]
+
+        bounds = [octree.node_bounds(name) for name in self.names]
+        low = numpy.array([low for low, _ in bounds])
+        high = low + numpy.array([size for _, size in bounds])
+        if element.transformation is not None:
+            transformation = numpy.asarray(element.transformation, dtype=numpy.float64).reshape(4, 4)
+            center = (low + high) / 2 @ transformation[:3, :3].T + transformation[:3, 3]
+            extent = (high - low) / 2 @ numpy.abs(transformation[:3, :3]).T
+            low, high = center - extent, center + extent
+        self.low, self.high = low, high
+
+        # Paths below the data directory as requested under /data, the hierarchy is loaded with the first node
+        # of every step
+        self.files: List[List[str]] = []
+        self.urls: List[List[str]] = []
+        for name in self.names:
+            paths = [join(octree.hierarchy_path(name), name + '.bin')]
+            hierarchy = join(octree.hierarchy_path(name), name + '.hrc')
+            if (len(name) - 1) % octree.step == 0 and exists(hierarchy):
+                paths.append(hierarchy)
+            self.files.append([relpath(path, data_directory) for path in paths])
+            self.urls.append([element.source + relpath(path, element.converted_directory) for path in paths])
+
+    def select(self, frustum: Frustum) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Nodes Potree would load for the frustum and their screen sizes. A node needs its parent to be loaded."""
+        sizes = frustum.screen_size(self.low, self.high)
+        visible = frustum.intersects(self.low, self.high) & (sizes >= MIN_NODE_SCREEN_SIZE)
+        for level in self.levels:
+            visible[level] &= visible[self.parents[level]]
+        nodes = numpy.flatnonzero(visible)
+        return nodes, sizes[nodes]
+
+
+class NodePrefetcher:
+    """Reads the octree nodes into the NodeCache that come into view next, while the camera is moving.
+
+    The motion of the camera over its last states is continued for PREDICTION_HORIZONS seconds. Nodes that
+    Potree would load from these predicted views but not from the current one are read in a background thread,
+    the most important ones first and no more than 'point_budget' points per camera state.
+    """
+
+    def __init__(self, files: PathCache, cache: NodeCache, point_budget: int = 1000000, aspect: float = 16 / 9,
+                 workers: int = 2, interval: float = PREDICTION_INTERVAL) -> None:
+        super().__init__()
+        self.files = files
+        self.cache = cache
+        self.point_budget = point_budget
+        self.aspect = aspect
+        self.workers = workers
+        self.interval = interval
+        # scene_id -> recent camera states
+        self.states: Dict[int, Deque[dict]] = {}
+        # scene_id -> time.monotonic() of the last prediction
+        self._predicted: Dict[int, float] = {}
+        # element_id -> nodes of the element, None if it has no octree of the BINARY format
+        self.octrees: Dict[int, Optional[OctreeNodes]] = {}
+        self._reading_octrees = set()
+        # File names of the nodes being read
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, func, *args):
+        # Created on first use, so forked workers start their own threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._executor.submit(func, *args)
+
+    def get_octree(self, element: PotreePointCloud) -> Optional[OctreeNodes]:
+        """The nodes of the element, None while they are read in the background."""
+        if element.element_id in self.octrees:
+            return self.octrees[element.element_id]
+        with self._lock:
+            if element.element_id in self._reading_octrees:
+                return None
+            self._reading_octrees.add(element.element_id)
+        self.submit(self._read_octree, element)
+        return None
+
+    def _read_octree(self, element: PotreePointCloud):
+        try:
+            self.octrees[element.element_id] = OctreeNodes(element)
+        except Exception as e:
+            print(f"[Server]: Not prefetching the nodes of {element.data}: {e}")
+            self.octrees[element.element_id] = None
+
+    def observe(self, scene, state: dict) -> List[str]:
+        """Adds the camera state of a scene and starts reading the nodes of its predicted views.
+
+        Returns the URLs of these nodes, the most important first. At most one state every 'interval' seconds per
+        scene is predicted, for the others the list is empty. Safe to call from several threads.
+        """
+        now = time.monotonic()
+        with self._lock:
+            states = self.states.setdefault(scene.scene_id, deque(maxlen=MOTION_STATES))
+            states.append(state)
+            if now - self._predicted.get(scene.scene_id, -math.inf) < self.interval:
+                return []
+            self._predicted[scene.scene_id] = now
+            states = list(states)
+        cameras = predict_cameras(states)
+        if len(cameras) == 0:
+            return []
+
+        current = Frustum(state, self.aspect)
+        frustums = [Frustum(camera, self.aspect) for camera in cameras]
+        candidates = []
+        for element in scene.elements:
+            if not isinstance(element, PotreePointCloud) or element.converted_directory is None:
+                continue
+            octree = self.get_octree(element)
+            if octree is None:
+                continue
+            # The viewer is loading the nodes of the current view already
+            loaded = set(octree.select(current)[0].tolist())
+            largest = {}
+            for frustum in frustums:
+                for node, size in zip(*octree.select(frustum)):
+                    if node not in loaded:
+                        largest[node] = max(size, largest.get(node, 0))
+            candidates.extend((size, node, octree) for node, size in largest.items())
+
+        candidates.sort(key=lambda candidate: -candidate[0])
+        file_names, urls, points = [], [], 0
+        for _, node, octree in candidates:
+            points += octree.counts[node]
+            if points > self.point_budget:
+                break
+            file_names.extend(octree.files[node])
+            urls.extend(octree.urls[node])
+        self.warm(file_names)
+        return urls
+
+    def warm(self, file_names: List[str]):
+        with self._lock:
+            file_names = [name for name in file_names if name not in self.cache and name not in self._pending]
+            self._pending.update(file_names)
+        if len(file_names) > 0:
+            self.submit(self._read_nodes, file_names)
+
+    def _read_nodes(self, file_names: List[str]):
+        try:
+            for file_name in file_names:
+                resolved = self.files.resolve(file_name)
+                if resolved is not None:
+                    self.cache.load(file_name, resolved)
+        except OSError as e:
+            print(f"[Server]: Error, prefetching octree nodes failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.difference_update(file_names)
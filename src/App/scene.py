@@ -0,0 +1,180 @@
+import json
+import math
+from typing import List, Tuple, Optional
+
+import numpy
+
+from src.App.spatial_index import BoundingVolumeHierarchy, Frustum
+from src.Components.base import Row, Viewer, ElementTree, Col, SceneSettings, Group, CameraState
+from src.SceneElements.bounds import BoundingBox, merge_statistics
+from src.SceneElements.elements import BaseSceneElement, Incrementer
+
+# Without a camera state, a scene is looked at from this direction, like from the former default position
+# (100, 100, 100), with the z-axis up as in most scans
+FRAMING_DIRECTION = (1., 1., 1.)
+FRAMING_UP = (0., 0., 1.)
+
+
+def look_at_quaternion(eye: numpy.ndarray, target: numpy.ndarray, up) -> List[float]:
+    """Orientation (x, y, z, w) of a camera at 'eye' looking at 'target', as three.js Object3D.lookAt sets it."""
+    z = (eye - target) / numpy.linalg.norm(eye - target)
+    x = numpy.cross(up, z)
+    if numpy.linalg.norm(x) < 1e-9:  # looking along the up vector
+        x = numpy.cross([1., 0., 0.] if abs(z[0]) < 0.9 else [0., 1., 0.], z)
+    x /= numpy.linalg.norm(x)
+    y = numpy.cross(z, x)
+    m = numpy.stack([x, y, z], axis=1)
+
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    if trace > 0:
+        s = 0.5 / math.sqrt(trace + 1)
+        quaternion = [(m[2, 1] - m[1, 2]) * s, (m[0, 2] - m[2, 0]) * s, (m[1, 0] - m[0, 1]) * s, 0.25 / s]
+    elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[0, 0] - m[1, 1] - m[2, 2])
+        quaternion = [0.25 * s, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s, (m[2, 1] - m[1, 2]) / s]
+    elif m[1, 1] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[1, 1] - m[0, 0] - m[2, 2])
+        quaternion = [(m[0, 1] + m[1, 0]) / s, 0.25 * s, (m[1, 2] + m[2, 1]) / s, (m[0, 2] - m[2, 0]) / s]
+    else:
+        s = 2 * math.sqrt(1 + m[2, 2] - m[0, 0] - m[1, 1])
+        quaternion = [(m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, 0.25 * s, (m[1, 0] - m[0, 1]) / s]
+    return [float(q) for q in quaternion]
+
+
+def framing_camera(bounds: BoundingBox, centroid: numpy.ndarray = None, fov: float = 60,
+                   direction=FRAMING_DIRECTION, up=FRAMING_UP) -> CameraState:
+    """Camera looking at the centroid from just far enough away to see all of 'bounds'.
+
+    Near and far plane enclose the bounds with some room to zoom, instead of the 0.1 to 100000 of the defaults.
+    """
+    low, high = numpy.asarray(bounds[0], dtype=numpy.float64), numpy.asarray(bounds[1], dtype=numpy.float64)
+    target = (low + high) / 2 if centroid is None else numpy.asarray(centroid, dtype=numpy.float64)
+    corners = numpy.array([[x, y, z] for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])])
+    radius = float(numpy.linalg.norm(corners - target, axis=1).max()) or 1.
+    distance = radius / math.sin(math.radians(fov) / 2)
+    direction = numpy.asarray(direction, dtype=numpy.float64)
+    eye = target + direction / numpy.linalg.norm(direction) * distance
+    return CameraState(eye.tolist(), look_at_quaternion(eye, target, up), up=list(up), fov=fov,
+                       near=radius / 1000, far=2 * (distance + radius))
+
+
+class Scene:
+
+    def __init__(self, scene_id: int, camera_state: CameraState = None, group_ids: Incrementer = None) -> None:
+        super().__init__()
+        self.scene_id = scene_id
+        self.camera_state = camera_state
+        # Ids of the groups, shared by the scenes of a Tarasp instance
+        self.group_ids = Incrementer() if group_ids is None else group_ids
+        self.elements: List[BaseSceneElement] = []
+        self.groups: List[Group] = []
+        self.used_names = {}
+        self.spatial_index: BoundingVolumeHierarchy = None
+        # Per local id, the world space bounds of the element or None
+        self.bounds: List[Optional[BoundingBox]] = []
+        # JSON of the group tree as sent in the element tree
+        self.group_index = []
+
+    def add_element(self, element: BaseSceneElement):
+        if element not in self.elements:
+            self.elements.append(element)
+
+    def get_element(self, local_id: int) -> BaseSceneElement:
+        return self.elements[local_id]
+
+    def create_component_tree(self) -> dict:
+        # Create a default tree, left side is a sidebar, right side is the scene
+        viewer = Viewer(self.scene_id)
+        camera_state = self.camera_state if self.camera_state is not None else self.framing_camera()
+        if camera_state is not None:
+            viewer.set_camera(camera_state)
+
+        # The front-end uses (so far) an array to store the elements which are accessed via element_id.
+        # Elements can be shared between scenes, so each scene addresses its elements by their position in
+        # this sorted list instead of the global id.
+        self.elements.sort(key=lambda x: x.element_id, reverse=False)
+        self.groups = []
+        self.used_names = {}
+        for local_id, element in enumerate(self.elements):
+            viewer.add_element(element)
+            self.update_groups(element, local_id)
+        self.build_spatial_index([element.bounding_box for element in self.elements])
+
+        element_tree = ElementTree()
+        element_tree.set_scene_id(self.scene_id)
+        for group in self.groups:
+            element_tree.add_group(group)
+
+        settings = SceneSettings()
+        settings.set_scene_id(self.scene_id)
+
+        side_bar = Col()
+        side_bar.set_width(3)
+        side_bar.add_child(settings)
+        side_bar.add_child(element_tree)
+
+        scene = Col()
+        scene.set_width(9)
+        scene.add_child(viewer)
+
+        row = Row()
+        row.add_child(side_bar)
+        row.add_child(scene)
+
+        tree = row.to_json(0)
+        self.group_index = element_tree.data[ElementTree.key_groups]
+        return tree
+
+    def framing_camera(self) -> Optional[CameraState]:
+        """Camera that shows all elements with known bounds, None if there are none. Call after the conversion."""
+        bounds, centroid, _ = merge_statistics([(element.bounding_box, element.centroid, element.point_count)
+                                                for element in self.elements])
+        if bounds is None:
+            return None
+        return framing_camera(bounds, centroid)
+
+    def build_spatial_index(self, bounds: List[Optional[BoundingBox]]):
+        self.bounds = bounds
+        located = [i for i, box in enumerate(bounds) if box is not None]
+        self.spatial_index = BoundingVolumeHierarchy(located, [bounds[i] for i in located])
+
+    def visible_elements(self, camera: dict, aspect: float = 16 / 9) -> List[Tuple[int, Optional[float]]]:
+        """Local ids of the elements inside the view frustum of 'camera' (see CameraState.to_json), largest first.
+
+        Elements without known bounds are always listed at the end, with a screen size of None.
+        """
+        visible = self.spatial_index.visible(Frustum(camera, aspect))
+        unknown = [(i, None) for i, box in enumerate(self.bounds) if box is None]
+        return visible + unknown
+
+    def update_groups(self, element: BaseSceneElement, local_id: int):
+
+        # Real ugly way to check if different scene elements have the same name.
+        # ----
+        type_key = str(type(element))
+        name_as_key = json.dumps(element.name)
+        if name_as_key in self.used_names.keys():
+            if self.used_names[name_as_key] != type_key:
+                raise Exception(f"Trying to group different types together: {type_key}"
+                                f" and {self.used_names[name_as_key]}")
+        else:
+            self.used_names[name_as_key] = type_key
+
+        # ------
+        # Grouping continues here.
+        selected_group = Group("Unknown", -1)
+        current_groups = self.groups
+        for name in element.name:  # element.name is a list of strings. e.g. ["dir1", "dir2", "name"]
+            found = False
+            for group in current_groups:
+                if group.name == name:  # found, group already exists
+                    current_groups = group.groups
+                    selected_group = group
+                    found = True
+                    break
+            if not found:
+                # group not found, create new object
+                selected_group = Group(name, self.group_ids())
+                current_groups.append(selected_group)
+                current_groups = selected_group.groups
+        selected_group.add_id(local_id)
@@ -0,0 +1,199 @@
+import gzip
+import hashlib
+import json
+import os
+from os.path import exists
+from typing import Dict, List
+
+import numpy
+
+from src.SceneElements.lod import CameraLevelOfDetail, LineLevelOfDetail, Polylines
+
+SNAPSHOT_VERSION = 3
+
+key_version = 'version'
+key_configuration = 'configuration'
+key_component_tree = 'componentTree'
+key_scenes = 'scenes'
+key_element_ids = 'elementIds'
+key_bounds = 'bounds'
+key_groups = 'groups'
+key_assets = 'assets'
+key_elements = 'elements'
+key_arrays = 'arrays'
+
+# Tags of the values in the converted state of an element that JSON has no type for
+key_array = 'array'
+key_tuple = 'tuple'
+key_dict = 'dict'
+key_object = 'object'
+key_state = 'state'
+
+# The only classes a snapshot creates, from their attributes and without running any code of the snapshot
+SNAPSHOT_CLASSES = {cls.__name__: cls for cls in (CameraLevelOfDetail, LineLevelOfDetail, Polylines)}
+
+
+def fingerprint(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _digest(array) -> str:
+    return hashlib.md5(numpy.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def _to_json(value):
+    if isinstance(value, numpy.ndarray):
+        return {'shape': value.shape, 'dtype': value.dtype.str, 'md5': _digest(value)}
+    if hasattr(value, 'tolist'):  # numpy scalars
+        return value.tolist()
+    if hasattr(value, 'value'):  # enums
+        return value.value
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    if hasattr(value, 'points'):
+        # In-memory Open3D geometry, its description only holds the number of points
+        return {key: _digest(numpy.asarray(getattr(value, key)))
+                for key in ('points', 'colors', 'normals', 'lines') if hasattr(value, key)}
+    raise Exception(f"Cannot describe {type(value)} in a scene snapshot")
+
+
+def arrays_path(path: str) -> str:
+    """The arrays of a snapshot are stored next to it, 'scene.json.gz' keeps them in 'scene.json.npz'."""
+    return f"{os.path.splitext(path)[0]}.npz"
+
+
+def encode_state(value, arrays: Dict[str, numpy.ndarray]):
+    """Turns the converted state of an element into JSON, numpy arrays are moved into 'arrays'."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, numpy.ndarray):
+        name = str(len(arrays))
+        arrays[name] = value
+        return {key_array: name}
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, list):
+        return [encode_state(v, arrays) for v in value]
+    if isinstance(value, tuple):
+        return {key_tuple: [encode_state(v, arrays) for v in value]}
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise Exception("Cannot store a dictionary with keys other than strings in a scene snapshot")
+        return {key_dict: {key: encode_state(v, arrays) for key, v in value.items()}}
+    if type(value) in SNAPSHOT_CLASSES.values():
+        return {key_object: type(value).__name__, key_state: encode_state(vars(value), arrays)}
+    raise Exception(f"Cannot store {type(value)} in a scene snapshot")
+
+
+def decode_state(value, arrays):
+    if isinstance(value, list):
+        return [decode_state(v, arrays) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if key_array in value:
+        return arrays[value[key_array]]
+    if key_tuple in value:
+        return tuple(decode_state(v, arrays) for v in value[key_tuple])
+    if key_dict in value:
+        return {key: decode_state(v, arrays) for key, v in value[key_dict].items()}
+    cls = SNAPSHOT_CLASSES[value[key_object]]
+    instance = cls.__new__(cls)
+    vars(instance).update(decode_state(value[key_state], arrays))
+    return instance
+
+
+def configuration_key(tarasp) -> str:
+    """Hash of everything the scenes are built from, has to be taken before the elements are converted."""
+    scenes = {}
+    for scene_id, scene in tarasp.SCENES.items():
+        # Private attributes hold runtime state like locks and streamed points, which are not part of the scene
+        scenes[scene_id] = [{'type': type(element).__name__,
+                             **{key: value for key, value in vars(element).items() if not key.startswith('_')}}
+                            for element in scene.elements]
+    description = json.dumps({'port': tarasp.PORT, 'scenes': scenes}, sort_keys=True, default=_to_json)
+    return hashlib.md5(description.encode()).hexdigest()
+
+
+def save_snapshot(tarasp, path: str, configuration: str):
+    """Writes the prepared scenes of 'tarasp': component trees, group index, bounds, the converted assets and the
+    state convert_to_source left on every element, e.g. its levels of detail and converted paths.
+    """
+    assets: Dict[str, List[int]] = {}
+    # Scalars, lists and dictionaries are kept as JSON, the arrays of e.g. the levels of detail in a .npz file
+    arrays: Dict[str, numpy.ndarray] = {}
+    elements = {str(element.element_id): encode_state(element.get_converted_state(), arrays)
+                for element in tarasp.get_elements()}
+    arrays_file = arrays_path(path)
+    # Only expose a complete file, numpy appends .npz to names without it
+    temporary = f"{arrays_file}.{os.getpid()}.tmp.npz"
+    numpy.savez_compressed(temporary, **arrays)
+    os.replace(temporary, arrays_file)
+    scenes = {}
+    for scene_id, scene in tarasp.SCENES.items():
+        for element in scene.elements:
+            for asset in element.get_assets():
+                if exists(asset):
+                    assets[asset] = fingerprint(asset)
+        scenes[scene_id] = {
+            key_element_ids: [element.element_id for element in scene.elements],
+            key_bounds: [None if box is None else [box[0].tolist(), box[1].tolist()] for box in scene.bounds],
+            key_groups: scene.group_index
+        }
+
+    snapshot = {
+        key_version: SNAPSHOT_VERSION,
+        key_configuration: configuration,
+        key_component_tree: tarasp.COMPONENT_TREE,
+        key_scenes: scenes,
+        key_assets: assets,
+        key_elements: elements,
+        key_arrays: fingerprint(arrays_file)
+    }
+    with gzip.open(path, 'wt') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    print(f"[Info]: Saved scene snapshot to {path}")
+
+
+def load_snapshot(tarasp, path: str) -> bool:
+    """Restores the prepared scenes of 'tarasp' if the snapshot matches its elements and no asset has changed."""
+    if not exists(path):
+        return False
+    with gzip.open(path, 'rt') as f:
+        snapshot = json.load(f)
+
+    if snapshot.get(key_version) != SNAPSHOT_VERSION:
+        print(f"[Info]: Snapshot {path} has an old format, preparing the scenes again")
+        return False
+    if snapshot[key_configuration] != configuration_key(tarasp):
+        print(f"[Info]: Scenes changed since snapshot {path}, preparing them again")
+        return False
+    for asset, expected in snapshot[key_assets].items():
+        if not exists(asset) or fingerprint(asset) != expected:
+            print(f"[Info]: Asset {asset} changed since snapshot {path}, preparing the scenes again")
+            return False
+    arrays_file = arrays_path(path)
+    if not exists(arrays_file) or fingerprint(arrays_file) != snapshot[key_arrays]:
+        print(f"[Info]: Arrays {arrays_file} of snapshot {path} changed, preparing the scenes again")
+        return False
+    states = {}
+    with numpy.load(arrays_file, allow_pickle=False) as arrays:
+        arrays = dict(arrays)
+    for element in tarasp.get_elements():
+        if str(element.element_id) not in snapshot[key_elements]:
+            print(f"[Info]: Element {element.element_id} is missing in snapshot {path}, preparing the scenes again")
+            return False
+        states[element] = decode_state(snapshot[key_elements][str(element.element_id)], arrays)
+
+    for element, state in states.items():
+        element.set_converted_state(state)
+    for scene_id, saved in snapshot[key_scenes].items():
+        scene = tarasp.get_scene(int(scene_id))
+        scene.elements.sort(key=lambda x: x.element_id, reverse=False)
+        scene.group_index = saved[key_groups]
+        scene.build_spatial_index([None if box is None else (numpy.array(box[0]), numpy.array(box[1]))
+                                   for box in saved[key_bounds]])
+    for scene_id, tree in snapshot[key_component_tree].items():
+        tarasp.COMPONENT_TREE[int(scene_id)] = tree
+    print(f"[Info]: Loaded scenes from snapshot {path}")
+    return True
@@ -0,0 +1,129 @@
+import math
+from typing import List, Tuple
+
+import numpy
+
+from src.Components.base import CameraState
+from src.SceneElements.bounds import BoundingBox
+from src.SceneElements.lod import quaternion_to_rotation
+
+
+class Frustum:
+    """View frustum of a perspective camera as six inward facing planes (normal, offset)."""
+
+    def __init__(self, camera: dict, aspect: float = 16 / 9) -> None:
+        super().__init__()
+        self.position = numpy.asarray(camera[CameraState.key_position], dtype=numpy.float64)
+        # three.js stores quaternions as (x, y, z, w)
+        x, y, z, w = camera[CameraState.key_quaternion]
+        rotation = quaternion_to_rotation(numpy.array([[w, x, y, z]], dtype=numpy.float64))[0]
+
+        # The camera looks along -z in its own coordinates
+        self.forward = rotation @ numpy.array([0., 0., -1.])
+        self.tan_half_fov = math.tan(math.radians(camera.get(CameraState.key_fov, 60)) / 2)
+        tan_vertical = self.tan_half_fov
+        tan_horizontal = tan_vertical * aspect
+        near = camera.get(CameraState.key_near, 0.1)
+        far = camera.get(CameraState.key_far, 100000)
+
+        normals = numpy.array([
+            [1., 0., -tan_horizontal],  # left
+            [-1., 0., -tan_horizontal],  # right
+            [0., 1., -tan_vertical],  # bottom
+            [0., -1., -tan_vertical],  # top
+            [0., 0., -1.],  # near
+            [0., 0., 1.],  # far
+        ])
+        offsets = numpy.array([0., 0., 0., 0., -near, far])
+        lengths = numpy.linalg.norm(normals, axis=1)
+        normals = normals / lengths[:, None]
+        offsets = offsets / lengths
+
+        self.normals = normals @ rotation.T
+        self.offsets = offsets - self.normals @ self.position
+
+    def intersects(self, low: numpy.ndarray, high: numpy.ndarray) -> numpy.ndarray:
+        """Conservative test of (N, 3) boxes against the frustum, True if a box might be visible."""
+        low = numpy.atleast_2d(low)
+        high = numpy.atleast_2d(high)
+        # For every plane, the corner of the box furthest along the plane normal
+        positive = self.normals > 0
+        corners = numpy.where(positive[None, :, :], high[:, None, :], low[:, None, :])
+        distances = numpy.einsum('npk,pk->np', corners, self.normals) + self.offsets
+        return numpy.all(distances >= 0, axis=1)
+
+    def screen_size(self, low: numpy.ndarray, high: numpy.ndarray) -> numpy.ndarray:
+        """Projected radius of the bounding spheres relative to half the screen height."""
+        center = (numpy.atleast_2d(low) + numpy.atleast_2d(high)) / 2
+        radius = numpy.linalg.norm(numpy.atleast_2d(high) - numpy.atleast_2d(low), axis=1) / 2
+        distance = numpy.linalg.norm(center - self.position, axis=1)
+        # Inside the bounding sphere the element covers the whole screen, clamp it to the size at its surface
+        distance = numpy.maximum(distance, radius)
+        with numpy.errstate(invalid='ignore'):
+            return numpy.nan_to_num(radius / (distance * self.tan_half_fov))
+
+
+class BoundingVolumeHierarchy:
+    LEAF_SIZE = 4
+
+    def __init__(self, ids: List[int], boxes: List[BoundingBox]) -> None:
+        super().__init__()
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)
+        if len(boxes) > 0:
+            self.low = numpy.stack([box[0] for box in boxes]).astype(numpy.float64)
+            self.high = numpy.stack([box[1] for box in boxes]).astype(numpy.float64)
+        else:
+            self.low = numpy.zeros((0, 3))
+            self.high = numpy.zeros((0, 3))
+
+        # Nodes are stored in flat lists: bounds, the children of inner nodes and the items of leaves
+        self.node_low = []
+        self.node_high = []
+        self.node_children: List[Tuple[int, int]] = []
+        self.node_items: List[numpy.ndarray] = []
+        if len(self.ids) > 0:
+            self._build(numpy.arange(len(self.ids)))
+
+    def _build(self, items: numpy.ndarray) -> int:
+        node = len(self.node_low)
+        self.node_low.append(self.low[items].min(axis=0))
+        self.node_high.append(self.high[items].max(axis=0))
+        self.node_children.append((-1, -1))
+        self.node_items.append(items)
+        if len(items) <= self.LEAF_SIZE:
+            return node
+
+        # Median split along the axis with the largest spread of the box centers
+        centers = (self.low[items] + self.high[items]) / 2
+        axis = int(numpy.argmax(centers.max(axis=0) - centers.min(axis=0)))
+        order = numpy.argsort(centers[:, axis], kind='stable')
+        half = len(items) // 2
+        left = self._build(items[order[:half]])
+        right = self._build(items[order[half:]])
+        self.node_children[node] = (left, right)
+        self.node_items[node] = None
+        return node
+
+    def query(self, frustum: Frustum) -> numpy.ndarray:
+        if len(self.node_low) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        visible = []
+        stack = [0]
+        while len(stack) > 0:
+            node = stack.pop()
+            if not frustum.intersects(self.node_low[node], self.node_high[node])[0]:
+                continue
+            items = self.node_items[node]
+            if items is None:
+                stack.extend(self.node_children[node])
+            else:
+                visible.append(items[frustum.intersects(self.low[items], self.high[items])])
+        return numpy.concatenate(visible) if len(visible) > 0 else numpy.zeros(0, dtype=numpy.int64)
+
+    def visible(self, frustum: Frustum) -> List[Tuple[int, float]]:
+        """Ids and screen sizes of all elements inside the frustum, the largest first."""
+        items = self.query(frustum)
+        sizes = frustum.screen_size(self.low[items], self.high[items])
+        order = numpy.argsort(-sizes, kind='stable')
+        return [(int(self.ids[items[i]]), float(sizes[i])) for i in order]
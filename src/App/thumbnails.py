@@ -0,0 +1,92 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import List, Iterable
+
+from PIL import Image
+
+THUMBNAIL_SIZES = [128, 256, 512, 1024]
+
+
+def create_thumbnail(source: str, target: str, size: int, quality: int = 85) -> str:
+    image = Image.open(source)
+    # Let the JPEG decoder skip the full resolution, this is much faster than decoding and resizing afterwards
+    image.draft('RGB', (size, size))
+    image = image.convert('RGB')
+    image.thumbnail((size, size))
+
+    parent = Path(target).parent
+    parent.mkdir(parents=True, exist_ok=True)
+    # Several requests, from other processes or threads, could create the same thumbnail. Each writes its own
+    # temporary file and only complete files are ever exposed.
+    handle, temporary = tempfile.mkstemp(dir=parent, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            image.save(file, format='JPEG', quality=quality)
+        os.replace(temporary, target)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return target
+
+
+class ThumbnailCache:
+    """Downscaled copies of images, stored on disk as <directory>/<size>/<source path>.jpg"""
+
+    def __init__(self, directory: str = './data/thumbnails', source_directory: str = './data',
+                 sizes: List[int] = None, quality: int = 85) -> None:
+        super().__init__()
+        self.directory = Path(directory)
+        self.source_directory = Path(source_directory).resolve()
+        self.sizes = sorted(sizes if sizes is not None else THUMBNAIL_SIZES)
+        self.quality = quality
+        self._pool = None
+
+    def select_size(self, size: int) -> int:
+        """Only a fixed set of sizes is generated, the smallest one that is at least as large as requested."""
+        for available in self.sizes:
+            if available >= size:
+                return available
+        return self.sizes[-1]
+
+    def resolve_source(self, file_name: str) -> Path:
+        source = Path(file_name).resolve()
+        if self.source_directory not in source.parents or not source.is_file():
+            return None
+        return source
+
+    def target(self, source: Path, size: int) -> Path:
+        return self.directory / str(size) / f"{source.relative_to(self.source_directory).as_posix()}.jpg"
+
+    def is_current(self, source: Path, target: Path) -> bool:
+        return target.exists() and target.stat().st_mtime >= source.stat().st_mtime
+
+    def get(self, file_name: str, size: int) -> Path:
+        """Path of the thumbnail of 'file_name', created on first use. None if the source is not a valid image."""
+        source = self.resolve_source(file_name)
+        if source is None:
+            return None
+        size = self.select_size(size)
+        target = self.target(source, size)
+        if not self.is_current(source, target):
+            create_thumbnail(str(source), str(target), size, self.quality)
+        return target
+
+    def warm(self, file_names: Iterable[str], sizes: List[int] = None, workers: int = None) -> List[Future]:
+        """Creates the missing thumbnails ahead of time in a pool of worker processes."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+        sizes = self.sizes if sizes is None else [self.select_size(size) for size in sizes]
+
+        futures = []
+        for file_name in file_names:
+            source = self.resolve_source(file_name)
+            if source is None:
+                continue
+            for size in sizes:
+                target = self.target(source, size)
+                if not self.is_current(source, target):
+                    futures.append(self._pool.submit(create_thumbnail, str(source), str(target), size, self.quality))
+        print(f"[Info]: Creating {len(futures)} thumbnails in the background")
+        return futures
@@ -0,0 +1,95 @@
+import asyncio
+import multiprocessing
+import socket
+import uuid
+import zlib
+from typing import List
+
+from src.App.message_bus import UnixSocketBus, start_broker
+
+
+def worker_index(address: str, workers: int) -> int:
+    """Clients are assigned by their IP address, so all requests of a Socket.IO session reach the same worker.
+
+    All clients behind one proxy, NAT or on the same machine share an address and end up at the same worker.
+    """
+    return zlib.crc32(address.encode()) % workers
+
+
+def run_worker(app, channel: socket.socket, inherited: List[socket.socket], bus_path: str, host: str,
+               port: int = None):
+    for other in inherited:
+        other.close()
+    # Every worker is a server of its own on the message bus
+    app.NODE_ID = uuid.uuid4().hex
+    app.BUS = UnixSocketBus(bus_path)
+    try:
+        asyncio.run(app.serve_worker(channel, host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(app, workers: int, host: str = '127.0.0.1', worker_port: int = None):
+    """Serves the prepared scenes of an AsyncTarasp from 'workers' forked processes.
+
+    This process accepts the connections and hands each one over to a worker, chosen by the client's address.
+    The workers serve them as if they had accepted them, so files are still sent with sendfile. Camera updates,
+    animations and scene updates reach the clients of the other workers through the message bus.
+
+    With a 'worker_port', the workers listen on the ports 'worker_port' to 'worker_port' + 'workers' - 1 on their
+    own instead. A reverse proxy on the port of 'app' then balances the clients over them, keeping every
+    Socket.IO session on one worker, e.g. with a cookie.
+    """
+    broker = None
+    if isinstance(app.BUS, UnixSocketBus):
+        bus_path = app.BUS.path
+    else:
+        bus_path = f'/tmp/tarasp-bus-{app.PORT}.sock'
+        broker = start_broker(bus_path)
+
+    # Forked, so the workers start with the scenes prepared in this process
+    context = multiprocessing.get_context('fork')
+    channels, processes = [], []
+    ports = [None] * workers if worker_port is None else [worker_port + i for i in range(workers)]
+    for port in ports:
+        channel, worker_channel = socket.socketpair()
+        process = context.Process(target=run_worker,
+                                  args=(app, worker_channel, channels + [channel], bus_path, host, port), daemon=True)
+        process.start()
+        worker_channel.close()
+        channels.append(channel)
+        processes.append(process)
+
+    listener = None
+    try:
+        if worker_port is not None:
+            print(f"[Server]: Starting {workers} workers at ports {ports[0]} to {ports[-1]}, "
+                  f"expecting a proxy at {app.BASE_URL}:{app.PORT}")
+            for process in processes:
+                process.join()
+            return
+
+        listener = socket.create_server((host, app.PORT), backlog=1024)
+        print(f"[Server]: Starting {workers} workers at {app.BASE_URL}:{app.PORT}")
+        while True:
+            connection, address = listener.accept()
+            index = worker_index(address[0], workers)
+            try:
+                socket.send_fds(channels[index], [b'c'], [connection.fileno()])
+            except OSError:
+                print(f"[Server]: Error, worker {index} stopped with exit code {processes[index].exitcode}")
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if listener is not None:
+            listener.close()
+        for channel in channels:
+            channel.close()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if broker is not None:
+            broker.terminate()
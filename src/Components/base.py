@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 from enum import Enum
 from typing import List
 
-from src.SceneElements.elements import BaseSceneElement, Incrementer
+from src.SceneElements.elements import BaseSceneElement
 
 
 class ComponentType(Enum):
@@ -92,11 +92,9 @@ class Group:
     key_groups = 'groups'
     key_visible = 'visible'
 
-    _increment: Incrementer = Incrementer()
-
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, group_id: int) -> None:
         super().__init__()
-        self.group_id = self._get_next_id()
+        self.group_id = group_id
         self.name = name
         self.ids = []
         self.groups = []
@@ -108,9 +106,6 @@ class Group:
     def add_group(self, group) -> None:
         self.groups.append(group)
 
-    def _get_next_id(self) -> int:
-        return self._increment()
-
     def to_json(self) -> dict:
         group_json = []
         for group in self.groups:
@@ -188,12 +183,13 @@ class CameraState:
     key_fov = 'fov'
     key_near = 'near'
     key_far = 'far'
+    key_zoom = 'zoom'
 
     def __init__(self,
                  position: List[float],
                  quaternion: List[float],
                  up=None,
-                 fov=60, near=0.1, far=100000) -> None:
+                 fov=60, near=0.1, far=100000, zoom=1) -> None:
         super().__init__()
         if up is None:
             self.up = [0, 1, 0]
@@ -204,6 +200,7 @@ class CameraState:
         self.fov = fov
         self.near = near
         self.far = far
+        self.zoom = zoom
 
     def to_json(self) -> dict:
         return {
@@ -213,6 +210,7 @@ class CameraState:
             self.key_fov: self.fov,
             self.key_near: self.near,
             self.key_far: self.far,
+            self.key_zoom: self.zoom,
         }
 
 
@@ -241,9 +239,13 @@ class Viewer(BaseComponent):
     def to_json(self, component_id: int) -> dict:
         self.data[self.key_camera] = self.camera_state.to_json()
 
+        # Elements are addressed by their position in the viewer, which is not the global id if the element is
+        # shared with other scenes.
         element_json = []
-        for elem in self.elements:
-            element_json.append(elem.to_json())
+        for local_id, elem in enumerate(self.elements):
+            elem_json = elem.to_json()
+            elem_json[elem.key_element_id] = local_id
+            element_json.append(elem_json)
         self.data[self.key_elements] = element_json
 
         return {
@@ -0,0 +1,84 @@
+import json
+from os.path import exists
+from typing import Tuple, Optional, List
+
+import numpy
+import plyfile
+
+BoundingBox = Tuple[numpy.ndarray, numpy.ndarray]
+# Bounds, centroid and number of points of a cloud
+PointStatistics = Tuple[Optional[BoundingBox], Optional[numpy.ndarray], Optional[int]]
+
+# Vertices per step of the single pass over a PLY file
+PLY_CHUNK_SIZE = 1 << 20
+
+
+def points_bounds(points: numpy.ndarray) -> Optional[BoundingBox]:
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return None
+    return points.min(axis=0), points.max(axis=0)
+
+
+def points_statistics(points: numpy.ndarray) -> PointStatistics:
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return None, None, 0
+    return points_bounds(points), points.mean(axis=0), len(points)
+
+
+def ply_statistics(path: str) -> PointStatistics:
+    """One pass over the memory mapped vertices in chunks, so the whole file is never held in memory."""
+    vertices = plyfile.PlyData.read(path, mmap='r')['vertex'].data
+    if len(vertices) == 0:
+        return None, None, 0
+    low = numpy.full(3, numpy.inf)
+    high = numpy.full(3, -numpy.inf)
+    total = numpy.zeros(3)
+    for start in range(0, len(vertices), PLY_CHUNK_SIZE):
+        chunk = vertices[start:start + PLY_CHUNK_SIZE]
+        for i, axis in enumerate(('x', 'y', 'z')):
+            values = chunk[axis]
+            low[i] = min(low[i], values.min())
+            high[i] = max(high[i], values.max())
+            total[i] += values.sum(dtype=numpy.float64)
+    return (low, high), total / len(vertices), len(vertices)
+
+
+def potree_bounds(directory: str) -> Optional[BoundingBox]:
+    """Reads the bounds written by the PotreeConverter into cloud.js, preferring the tight bounding box."""
+    cloud_js = directory + '/cloud.js'
+    if not exists(cloud_js):
+        return None
+    with open(cloud_js) as f:
+        cloud = json.load(f)
+    box = cloud.get('tightBoundingBox', cloud['boundingBox'])
+    return numpy.array([box['lx'], box['ly'], box['lz']], dtype=numpy.float64), \
+        numpy.array([box['ux'], box['uy'], box['uz']], dtype=numpy.float64)
+
+
+def merge_statistics(statistics: List[PointStatistics]) -> PointStatistics:
+    """Union of the bounds and the centroid weighted by the number of points, of the clouds that have one."""
+    bounds = union_bounds([bounds for bounds, _, _ in statistics])
+    weighted = [(centroid, count) for _, centroid, count in statistics if centroid is not None and count]
+    if len(weighted) == 0:
+        return bounds, None, None
+    count = sum(count for _, count in weighted)
+    return bounds, sum(centroid * count for centroid, count in weighted) / count, count
+
+
+def union_bounds(boxes: List[Optional[BoundingBox]]) -> Optional[BoundingBox]:
+    boxes = [box for box in boxes if box is not None]
+    if len(boxes) == 0:
+        return None
+    return numpy.min([box[0] for box in boxes], axis=0), numpy.max([box[1] for box in boxes], axis=0)
+
+
+def transform_bounds(bounds: BoundingBox, transformation: numpy.ndarray) -> BoundingBox:
+    """Axis aligned box around the eight transformed corners."""
+    low, high = bounds
+    corners = numpy.array([[x, y, z, 1.] for x in (low[0], high[0]) for y in (low[1], high[1])
+                           for z in (low[2], high[2])])
+    transformed = corners @ numpy.asarray(transformation, dtype=numpy.float64).reshape(4, 4).T
+    transformed = transformed[:, :3] / transformed[:, 3:]
+    return transformed.min(axis=0), transformed.max(axis=0)
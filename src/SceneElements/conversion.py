@@ -0,0 +1,203 @@
+import heapq
+import itertools
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# PotreeConverter 1.6 prints "INDEXING: 1,000,000 points processed; ...", 2.x prints percentages like "[23%, 5s]"
+PROCESSED_PATTERN = re.compile(r'([\d,]+) points processed')
+PERCENT_PATTERN = re.compile(r'\[(\d+(?:\.\d+)?)%')
+
+
+def terminate(process: subprocess.Popen):
+    # The command runs in a shell of its own session, stop the converter it started as well
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+class ConversionJob:
+    key_job_id = 'jobId'
+    key_name = 'name'
+    key_state = 'state'
+    key_priority = 'priority'
+    key_progress = 'progress'
+    key_eta = 'eta'
+    key_elapsed = 'elapsed'
+    key_error = 'error'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, job_id: int, name: str, command: str, total_points: int, priority: float) -> None:
+        super().__init__()
+        self.job_id = job_id
+        self.name = name
+        self.command = command
+        self.total_points = total_points
+        self.priority = priority
+        self.state = self.QUEUED
+        self.progress = 0.
+        self.error = None
+        self.started = None
+        self.finished = None
+        # Increased on every change, see ConversionQueue.changed_since
+        self.version = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.done = threading.Event()
+
+    def elapsed(self) -> Optional[float]:
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def eta(self) -> Optional[float]:
+        """Seconds until the job is done, extrapolated from its progress so far."""
+        if self.state != self.RUNNING or self.progress <= 0:
+            return None
+        return self.elapsed() * (1 - self.progress) / self.progress
+
+    def update_progress(self, line: str) -> bool:
+        """Reads the progress from a line of the converter output, returns True if it changed."""
+        percent = PERCENT_PATTERN.search(line)
+        processed = PROCESSED_PATTERN.search(line)
+        if percent is not None:
+            progress = float(percent.group(1)) / 100
+        elif processed is not None and self.total_points:
+            progress = int(processed.group(1).replace(',', '')) / self.total_points
+        else:
+            return False
+        self.progress = min(max(progress, self.progress), 1.)
+        return True
+
+    def to_json(self) -> dict:
+        return {
+            self.key_job_id: self.job_id,
+            self.key_name: self.name,
+            self.key_state: self.state,
+            self.key_priority: self.priority,
+            self.key_progress: self.progress,
+            self.key_eta: self.eta(),
+            self.key_elapsed: self.elapsed(),
+            self.key_error: self.error
+        }
+
+
+class ConversionQueue:
+    """Runs converter commands in a few worker threads, the job with the lowest priority value first.
+
+    By default the priority is the number of points, so small clouds are not stuck behind large ones.
+    """
+
+    def __init__(self, workers: int = 2) -> None:
+        super().__init__()
+        self.workers = workers
+        self.jobs: Dict[int, ConversionJob] = {}
+        self._queue: List[Tuple[float, int, ConversionJob]] = []
+        self._ids = itertools.count()
+        self._version = itertools.count(1)
+        self._lock = threading.Lock()
+        self._available = threading.Semaphore(0)
+        self._threads = []
+
+    def _touch(self, job: ConversionJob):
+        job.version = next(self._version)
+
+    def submit(self, command: str, name: str, total_points: int = None, priority: float = None) -> ConversionJob:
+        if priority is None:
+            priority = total_points or 0
+        with self._lock:
+            job = ConversionJob(next(self._ids), name, command, total_points, priority)
+            self._touch(job)
+            self.jobs[job.job_id] = job
+            heapq.heappush(self._queue, (priority, job.job_id, job))
+            # Threads are gone in a forked process
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                self._threads.append(threading.Thread(target=self._work, daemon=True))
+                self._threads[-1].start()
+        self._available.release()
+        return job
+
+    def run(self, command: str, name: str, total_points: int = None, priority: float = None) -> ConversionJob:
+        """Submits a job and waits until it is over."""
+        job = self.submit(command, name, total_points, priority)
+        job.done.wait()
+        if job.state == ConversionJob.CANCELLED:
+            raise Exception(f"Conversion of {name} was cancelled")
+        if job.state != ConversionJob.DONE:
+            raise Exception(f"Conversion of {name} failed: {job.error}")
+        return job
+
+    def get(self, job_id: int) -> Optional[ConversionJob]:
+        return self.jobs.get(job_id)
+
+    def changed_since(self, version: int) -> Tuple[List[ConversionJob], int]:
+        """Jobs that changed after 'version' and the version to ask for next time."""
+        with self._lock:
+            changed = [job for job in self.jobs.values() if job.version > version]
+        return changed, max([version] + [job.version for job in changed])
+
+    def cancel(self, job_id: int) -> bool:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (ConversionJob.QUEUED, ConversionJob.RUNNING):
+                return False
+            running = job.state == ConversionJob.RUNNING
+            job.state = ConversionJob.CANCELLED
+            self._touch(job)
+        if running and job.process is not None:
+            terminate(job.process)
+        if not running:
+            job.done.set()
+        return True
+
+    def _work(self):
+        while True:
+            self._available.acquire()
+            with self._lock:
+                _, _, job = heapq.heappop(self._queue)
+                if job.state == ConversionJob.CANCELLED:
+                    continue
+                job.state = ConversionJob.RUNNING
+                job.started = time.monotonic()
+                self._touch(job)
+            self._run(job)
+            job.done.set()
+
+    def _run(self, job: ConversionJob):
+        print(f"[Info]: Starting conversion {job.job_id} of {job.name}")
+        try:
+            job.process = subprocess.Popen(job.command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                           text=True, start_new_session=True)
+            if job.state == ConversionJob.CANCELLED:  # cancelled while starting
+                terminate(job.process)
+            for line in job.process.stdout:
+                print(line, end='')
+                if job.update_progress(line):
+                    self._touch(job)
+            code = job.process.wait()
+        except OSError as e:
+            code, job.error = -1, str(e)
+
+        with self._lock:
+            job.finished = time.monotonic()
+            if job.state == ConversionJob.RUNNING:
+                if code == 0:
+                    job.state, job.progress = ConversionJob.DONE, 1.
+                else:
+                    job.state = ConversionJob.FAILED
+                    job.error = job.error or f"Converter exited with code {code}"
+            self._touch(job)
+        print(f"[Info]: Conversion {job.job_id} of {job.name} {job.state} after {job.elapsed():.1f}s")
+
+
+CONVERSIONS = ConversionQueue()
@@ -1,6 +1,9 @@
+import copy
+import glob
 import hashlib
-import subprocess
+import os
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from os.path import exists
 from sys import platform
@@ -10,20 +13,46 @@ from pathlib import Path, PosixPath
 import numpy
 import open3d as o3d
 
+from src.SceneElements.bounds import BoundingBox, points_bounds, transform_bounds, points_statistics, \
+    ply_statistics, merge_statistics
+from src.SceneElements.preprocessing import downsample_ply, compact_ply
+from src.SceneElements.streaming import PointStreamBuffer
+from src.SceneElements.potree_octree import update_potree, write_manifest, ply_vertex_count, potree_statistics
+from src.SceneElements.conversion import CONVERSIONS
+from src.SceneElements.lod import LevelOfDetail, LineLevelOfDetail, CameraLevelOfDetail, Polylines, camera_centers
 from src.colmap_manager import write_pointcloud_o3d
 
 
-def ply_to_potree(ply_location: str, overwrite=False) -> str:
+BASE_CONVERTED_DIRECTORY = './data/converted/'
+
+
+def potree_directory(ply_location: str) -> str:
+    """Directory the point-cloud at 'ply_location' is converted into."""
+    name = str(int(hashlib.md5(ply_location.encode()).hexdigest(), 16))
+    return BASE_CONVERTED_DIRECTORY + name
+
+
+def run_converter(command: str, ply_location: str, priority: float = None):
+    """Runs the converter as a job of the conversion queue and waits for it, see conversion.CONVERSIONS."""
+    total_points = ply_vertex_count(ply_location) if ply_location.endswith('.ply') else None
+    CONVERSIONS.run(command, ply_location, total_points, priority)
+
+
+def ply_to_potree(ply_location: str, overwrite=False, incremental=False, priority: float = None) -> str:
+    """Converts a point-cloud into Potree format, see potree_directory for where.
+
+    With 'incremental', the points appended to the source since the last conversion are inserted into the
+    existing octree instead of converting the whole cloud again. Conversions with a lower 'priority' start first,
+    by default the smallest clouds.
+    """
     print("[Info]: Converting point-cloud to potree format.")
-    base_converted_directory = './data/converted/'
 
-    if not exists(base_converted_directory):
-        Path(base_converted_directory).mkdir(parents=True)
+    if not exists(BASE_CONVERTED_DIRECTORY):
+        Path(BASE_CONVERTED_DIRECTORY).mkdir(parents=True, exist_ok=True)
     # TODO: check the OS and then execute the command.
 
-    name = str(int(hashlib.md5(ply_location.encode()).hexdigest(), 16))
-    print(f"[Info]: Hash of path '{ply_location}' is '{name}'")
-    target = base_converted_directory + name
+    target = potree_directory(ply_location)
+    print(f"[Info]: Hash of path '{ply_location}' is '{target[len(BASE_CONVERTED_DIRECTORY):]}'")
 
     full_command = ''
 
@@ -40,12 +69,20 @@ def ply_to_potree(ply_location: str, overwrite=False) -> str:
         full_command = ''
 
     if overwrite:
-        subprocess.run(full_command + ' --overwrite', shell=True)
+        run_converter(full_command + ' --overwrite', ply_location, priority)
     elif not exists(target + '/cloud.js'):
-        subprocess.run(full_command, shell=True)
+        run_converter(full_command, ply_location, priority)
+    elif incremental and update_potree(ply_location, target):
+        return target
+    elif incremental:
+        # Without a manifest of the last conversion, or if converted points changed, convert everything again
+        run_converter(full_command + ' --overwrite', ply_location, priority)
     else:
         print('[Info]: PointCloud already found, no conversion needed')
 
+    if incremental:
+        write_manifest(ply_location, target)
+
     return target
 
 
@@ -66,33 +103,88 @@ class BaseSceneElement(ABC):
     key_source = 'source'
     key_attributes = 'attributes'
     key_material = 'material'
+    key_lod = 'lod'
+    key_lod_levels = 'levels'
+    key_lod_level = 'level'
 
     DEFAULT_DATA_PATH = './data/'
 
-    BASE_URL = 'http://127.0.0.1'
-    PORT = 5000
-
-    _increment: Incrementer = Incrementer()
+    # Attributes set by convert_to_source, a snapshot restores them instead of converting again
+    CONVERTED_STATE = ('source', 'attributes', 'material', 'lod', 'bounding_box', 'centroid', 'point_count')
 
     def __init__(self, data, name: Union[str, List[str]], transformation: numpy.ndarray = None) -> None:
         super().__init__()
         self.attributes = {}
         self.data = data
-        self.element_id = self._get_next_id()
+        # Both assigned by the Tarasp the element is added to, the URL its files are served at includes the port
+        self.element_id: int = None
+        self.base_url = 'http://127.0.0.1:5000'
         if isinstance(name, str):
             self.name = [name]
         else:
             self.name = name
         self.attributes[self.key_name] = '/'.join(self.name)
+        self.material = {}
+        self.lod = None
+        self.transformation = None
+        self.bounding_box: BoundingBox = None
+        # World space centroid and number of points, used to place the initial camera of a scene
+        self.centroid: numpy.ndarray = None
+        self.point_count: int = None
         if transformation is not None:
             self.set_transformation(transformation)
-        self.material = {}
 
     def set_transformation(self, transformation: numpy.ndarray):
+        self.transformation = transformation
         self.attributes[self.key_transformation] = numpy.concatenate(transformation).tolist()
 
-    def _get_next_id(self) -> int:
-        return self._increment()
+    def set_bounding_box(self, bounds: BoundingBox, centroid: numpy.ndarray = None, point_count: int = None):
+        """Stores the world space bounds of the element, 'bounds' is given in the element's own coordinates."""
+        if self.transformation is not None:
+            transformation = numpy.asarray(self.transformation, dtype=numpy.float64).reshape(4, 4)
+            if bounds is not None:
+                bounds = transform_bounds(bounds, transformation)
+            if centroid is not None:
+                centroid = transformation[:3, :3] @ centroid + transformation[:3, 3]
+        self.bounding_box = bounds
+        self.centroid = centroid
+        self.point_count = point_count
+
+    def set_lod(self, lod: LevelOfDetail, budget: int = None) -> int:
+        """Stores the precomputed levels and returns the level that is sent with the component tree."""
+        self.lod = lod
+        level = lod.select_level(budget)
+        self.attributes[self.key_lod] = {
+            self.key_lod_levels: lod.counts,
+            self.key_lod_level: level
+        }
+        return level
+
+    def get_lod_source(self, level: int = None, region=None):
+        """Returns the source of a precomputed level, optionally restricted to a region (min, max)."""
+        return self.source
+
+    def get_assets(self) -> List[str]:
+        """Files the element was converted from or into, a saved scene is only valid as long as they are unchanged."""
+        return []
+
+    def copy(self):
+        """A copy to add to another Tarasp, which numbers and converts it on its own.
+
+        Private attributes hold runtime state like locks and streamed points, they are shared with the copy.
+        """
+        element = copy.copy(self)
+        for key, value in vars(self).items():
+            if not key.startswith('_'):
+                setattr(element, key, copy.deepcopy(value))
+        return element
+
+    def get_converted_state(self) -> dict:
+        return {key: getattr(self, key) for key in self.CONVERTED_STATE}
+
+    def set_converted_state(self, state: dict):
+        for key, value in state.items():
+            setattr(self, key, value)
 
     @abstractmethod
     def set_source(self, source):
@@ -112,6 +204,7 @@ class SceneElementType(Enum):
     DEFAULT_PC = 'default_point_cloud'
     CAMERA_TRAJECTORY = 'camera_trajectory'
     LINE_SET = 'line_set'
+    STREAMING_PC = 'streaming_point_cloud'
 
 
 class PointShape(Enum):
@@ -125,6 +218,8 @@ class PotreePointCloud(BaseSceneElement):
     key_point_type = 'pointType'
     key_opacity = 'opacity'
 
+    CONVERTED_STATE = BaseSceneElement.CONVERTED_STATE + ('input_path', 'converted_directory')
+
     def __init__(self,
                  data,
                  color: str = None,
@@ -132,11 +227,19 @@ class PotreePointCloud(BaseSceneElement):
                  point_type: PointShape = None,
                  opacity: float = None,
                  name: Union[str, List[str]] = "Default",
-                 transformation: numpy.ndarray = None) -> None:
+                 transformation: numpy.ndarray = None,
+                 incremental: bool = False,
+                 priority: float = None) -> None:
         super().__init__(data, name, transformation)
         self.source = ''
         self.data = data
         self.type = SceneElementType.POTREE_PC
+        self.input_path = None
+        self.converted_directory = None
+        # The source only grows, points appended since the last run are added to the converted octree
+        self.incremental = incremental
+        # Order of the conversion in the conversion queue, lower first. By default smaller clouds go first.
+        self.priority = priority
         if color is not None:
             self.set_color(color)
         if point_size is not None:
@@ -161,6 +264,11 @@ class PotreePointCloud(BaseSceneElement):
     def set_opacity(self, opacity: float):
         self.material[self.key_opacity] = opacity
 
+    def get_assets(self) -> List[str]:
+        if self.converted_directory is None:
+            return []
+        return [self.input_path, self.converted_directory + '/cloud.js']
+
     def convert_to_source(self):
         # TODO What other type of data to support? Library?
         # 1. Bring 'data' into .ply form
@@ -177,8 +285,11 @@ class PotreePointCloud(BaseSceneElement):
         # url = './data/fragment.ply'
 
         # 3. Start new thread to convert it into Potree format if its new
-        out_dir = ply_to_potree(url)
-        path = f"{self.BASE_URL}:{str(self.PORT)}{out_dir[1:]}/"
+        out_dir = ply_to_potree(url, incremental=self.incremental, priority=self.priority)
+        path = f"{self.base_url}{out_dir[1:]}/"
+        self.input_path = url
+        self.converted_directory = out_dir
+        self.set_bounding_box(*potree_statistics(out_dir))
 
         # 4. Add data-path to source
         # path = 'http://127.0.0.1:5000/data/mesh_simplified_converted/'
@@ -197,14 +308,30 @@ class PotreePointCloud(BaseSceneElement):
 class DefaultPointCloud(BaseSceneElement):
     key_material = 'material'
     key_color = 'color'
+    key_compact = 'compact'
+
+    CONVERTED_STATE = BaseSceneElement.CONVERTED_STATE + ('compact_path',)
 
     def __init__(self, data,
                  name: Union[str, List[str]] = "Default",
-                 transformation: numpy.ndarray = None) -> None:
+                 transformation: numpy.ndarray = None,
+                 voxel_size: float = None,
+                 target_points: int = None,
+                 voxel_representative: str = 'average',
+                 compact: bool = False) -> None:
         super().__init__(data, name, transformation)
         self.source = ''
         self.data = data
         self.type = SceneElementType.DEFAULT_PC
+        # Optional voxel grid downsampling before the cloud is sent, either with a fixed voxel size or a size
+        # chosen to keep about 'target_points' points. The representative is either 'average' or 'nearest'.
+        self.voxel_size = voxel_size
+        self.target_points = target_points
+        self.voxel_representative = voxel_representative
+        # Also write the cloud in the quantized format of quantization.encode_compact, served under
+        # /compact/<scene_id>/<element_id>
+        self.compact = compact
+        self.compact_path = None
 
     def set_source(self, url: str):
         self.source = url
@@ -213,12 +340,18 @@ class DefaultPointCloud(BaseSceneElement):
         material = {self.key_color: color}
         self.attributes[self.key_material] = material
 
+    def create_compact(self):
+        if self.compact and self.source != '':
+            self.compact_path = compact_ply(self.source).as_posix()
+            self.attributes[self.key_compact] = True
+
     def convert_to_source(self):
         # 1. Bring 'data' into .ply form
         # 2. Save pc or if this point-cloud has been saved before read url
         if type(self.data) is str:
             if exists(self.data):
-                self.set_source(self.data)
+                self.set_source(self.preprocess(self.data))
+                self.set_bounding_box(*ply_statistics(self.source))
             else:
                 raise Exception(
                     "Trying to convert data to DefaultPointCloud. Got string but is not a path: " + self.data)
@@ -226,12 +359,27 @@ class DefaultPointCloud(BaseSceneElement):
             saved_path = Path(f"{self.DEFAULT_DATA_PATH}/point-clouds/{self.data.name}")
             write_pointcloud_o3d(saved_path, self.data)
             # TODO paths could depend on the OS. Need to test and verify
-            self.set_source(saved_path.as_posix())
+            self.set_source(self.preprocess(saved_path.as_posix()))
+            self.set_bounding_box(*points_statistics(numpy.asarray(self.data.points)))
 
         elif type(self.data) is numpy.asarray:
             # TODO support numpy.arrays
             print("not yet implemented")
         # 3. Add data-path to source
+        self.create_compact()
+
+    def get_assets(self) -> List[str]:
+        assets = [self.data] if type(self.data) is str else []
+        if self.source != '' and self.source not in assets:
+            assets.append(self.source)
+        if self.compact_path is not None:
+            assets.append(self.compact_path)
+        return assets
+
+    def preprocess(self, path: str) -> str:
+        if self.voxel_size is None and self.target_points is None:
+            return path
+        return downsample_ply(path, self.voxel_size, self.target_points, self.voxel_representative).as_posix()
 
     def to_json(self):
         return {
@@ -254,10 +402,15 @@ class LineSet(BaseSceneElement):
                  color: str = None,
                  line_width: float = None,
                  name: Union[str, List[str]] = "Default",
-                 transformation: numpy.ndarray = None) -> None:
+                 transformation: numpy.ndarray = None,
+                 primitive_budget: int = None,
+                 lod_levels: int = 4) -> None:
         super().__init__(data, name, transformation)
         self.source = []
         self.type = SceneElementType.LINE_SET
+        # Maximum number of segments sent with the component tree. Finer levels can be requested later.
+        self.primitive_budget = primitive_budget
+        self.lod_levels = lod_levels
         if color is not None:
             self.set_color(color)
         if line_width is not None:
@@ -281,7 +434,22 @@ class LineSet(BaseSceneElement):
         # TODO I'm assuming the data is correct.
         # 1. Bring 'data' into 'Array of int-tuple arrays' form
         # 2. Call add source
-        self.set_source(self.data)
+        if self.primitive_budget is None:
+            self.set_source(self.data)
+            self.set_bounding_box(points_bounds(Polylines.from_lines(self.data).points))
+            return
+
+        # 3. Precompute simplified levels and only send the one that fits the budget
+        level = self.set_lod(LineLevelOfDetail(self.data, self.lod_levels), self.primitive_budget)
+        self.set_source(self.get_lod_source(level))
+        self.set_bounding_box(points_bounds(self.lod.levels[-1].points))
+
+    def get_lod_source(self, level: int = None, region=None):
+        if self.lod is None:
+            return self.data
+        if level is None:
+            level = len(self.lod) - 1
+        return self.lod.select(level, region).to_list()
 
     def to_json(self):
         self.attributes[self.key_material] = self.material
@@ -304,6 +472,11 @@ class CameraTrajectory(BaseSceneElement):
     key_frustum_size = 'frustumSize'
     key_line_width = 'lineWidth'
 
+    THUMBNAIL_ROUTE = 'thumbnails'
+
+    # The URLs of the images are written into the cameras
+    CONVERTED_STATE = BaseSceneElement.CONVERTED_STATE + ('data', 'cameras', 'image_paths')
+
     def __init__(self,
                  corners: [],
                  cameras: [],
@@ -313,13 +486,25 @@ class CameraTrajectory(BaseSceneElement):
                  frustum_size: float = None,
                  line_width: float = None,
                  name: Union[str, List[str]] = "Default",
-                 transformation: numpy.ndarray = None) -> None:
+                 transformation: numpy.ndarray = None,
+                 thumbnail_size: int = 512,
+                 primitive_budget: int = None,
+                 lod_levels: int = 4,
+                 lod_method: str = 'cluster') -> None:
         super().__init__(corners, name, transformation)
         self.source = {}
         self.type = SceneElementType.CAMERA_TRAJECTORY
         self.corners = corners
         self.cameras = cameras
         self.link_images = link_images
+        # Linked images are served as downscaled thumbnails of this size, None links the original images
+        self.thumbnail_size = thumbnail_size
+        self.image_paths = []
+        # Maximum number of frustums sent with the component tree. Finer levels can be requested later.
+        self.primitive_budget = primitive_budget
+        self.lod_levels = lod_levels
+        # 'cluster' keeps one camera per grid cell, 'stride' every n-th camera of the trajectory
+        self.lod_method = lod_method
         if color is not None:
             self.set_color(color)
         if frustum_size is not None:
@@ -347,19 +532,25 @@ class CameraTrajectory(BaseSceneElement):
     def set_image(self, url: str):
         self.attributes[self.key_image_url] = url
 
+    def get_assets(self) -> List[str]:
+        return self.image_paths if self.link_images else []
+
     def convert_to_source(self):
         # TODO
         # 1. Bring 'corners', 'cameras' and 'link_images' into the correct form
 
         # replace the image_url to the definite one.
+        self.image_paths = []
         for c in self.cameras:
             if type(c[0]) is numpy.ndarray:
                 c[0] = c[0].tolist()
                 c[1] = c[1].tolist()
-            image_url = c[2]
-            if type(image_url) is str:
-                image_url = Path(image_url).as_posix()
-            c[2] = f"{self.BASE_URL}:{str(self.PORT)}/{image_url}"
+            image_path = Path(c[2]).as_posix()
+            self.image_paths.append(image_path)
+            if self.link_images and self.thumbnail_size is not None:
+                c[2] = f"{self.base_url}/{self.THUMBNAIL_ROUTE}/{self.thumbnail_size}/{image_path}"
+            else:
+                c[2] = f"{self.base_url}/{image_path}"
 
         self.data = {
             self.key_corners: self.corners,
@@ -368,7 +559,35 @@ class CameraTrajectory(BaseSceneElement):
         }
 
         # 2. Call set source
-        self.set_source(self.data)
+        if self.primitive_budget is None:
+            self.set_source(self.data)
+            self.set_camera_bounding_box(camera_centers(self.cameras))
+            return
+
+        # 3. Precompute decimated levels and only send the one that fits the budget
+        lod = CameraLevelOfDetail(self.cameras, self.lod_levels, self.lod_method)
+        level = self.set_lod(lod, self.primitive_budget)
+        self.set_source(self.get_lod_source(level))
+        self.set_camera_bounding_box(lod.centers)
+
+    def set_camera_bounding_box(self, centers: numpy.ndarray):
+        bounds = points_bounds(centers)
+        if bounds is not None:
+            # The frustums reach out of the camera centers by about their size
+            size = self.material.get(self.key_frustum_size, 1)
+            bounds = (bounds[0] - size, bounds[1] + size)
+        self.set_bounding_box(bounds)
+
+    def get_lod_source(self, level: int = None, region=None):
+        if self.lod is None:
+            return self.data
+        if level is None:
+            level = len(self.lod) - 1
+        return {
+            self.key_corners: self.corners,
+            self.key_link_images: self.link_images,
+            self.key_cameras: [self.cameras[i] for i in self.lod.select(level, region)]
+        }
 
     def to_json(self):
         self.attributes[self.key_material] = self.material
@@ -378,3 +597,147 @@ class CameraTrajectory(BaseSceneElement):
             self.key_source: self.source,
             self.key_attributes: self.attributes
         }
+
+
+class PointCloudSequence(PotreePointCloud):
+    """A time-varying point cloud, one file per frame, e.g. a recording of a dynamic scene.
+
+    Every frame is converted to Potree format. The element is sent like a PotreePointCloud showing the first frame,
+    the 'sequence' attribute lists the sources of all frames. Playback runs as an animation, see
+    Tarasp.add_sequence_animation, whose messages tell the clients which frames to load next.
+    """
+    key_sequence = 'sequence'
+    key_frames = 'frames'
+    key_frame = 'frame'
+    key_frame_rate = 'frameRate'
+    key_prefetch = 'prefetch'
+
+    def __init__(self,
+                 frames: Union[str, List[str]],
+                 frame_rate: float = 10,
+                 prefetch: int = 3,
+                 conversion_workers: int = None,
+                 color: str = None,
+                 point_size: float = None,
+                 point_type: PointShape = None,
+                 opacity: float = None,
+                 name: Union[str, List[str]] = "Default",
+                 transformation: numpy.ndarray = None) -> None:
+        # Either the ordered list of frames or a glob pattern, whose matches are sorted by name
+        if isinstance(frames, str):
+            frames = sorted(glob.glob(frames))
+        else:
+            frames = [Path(frame).as_posix() for frame in frames]
+        if len(frames) == 0:
+            raise Exception("Trying to create a PointCloudSequence without frames")
+        super().__init__(frames, color, point_size, point_type, opacity, name=name, transformation=transformation)
+        self.frames = frames
+        self.frame_rate = frame_rate
+        # Number of upcoming frames the clients are told to load during playback
+        self.prefetch = prefetch
+        self.conversion_workers = conversion_workers
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_source(self, frame: int) -> str:
+        return f"{self.base_url}{potree_directory(self.frames[frame])[1:]}/"
+
+    def get_assets(self) -> List[str]:
+        return self.frames + [potree_directory(frame) + '/cloud.js' for frame in self.frames]
+
+    def convert_to_source(self):
+        for frame in self.frames:
+            if not exists(frame):
+                raise Exception(f"Data not found {frame}")
+
+        # The converter runs in its own process, so the frames are converted in parallel
+        workers = self.conversion_workers or os.cpu_count()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            converted_directories = list(executor.map(ply_to_potree, self.frames))
+        self.set_bounding_box(*merge_statistics([potree_statistics(directory) for directory in converted_directories]))
+
+        self.attributes[self.key_sequence] = {
+            self.key_frames: [self.frame_source(frame) for frame in range(len(self.frames))],
+            self.key_frame_rate: self.frame_rate,
+            self.key_prefetch: self.prefetch
+        }
+        self.set_source(self.frame_source(0))
+
+    def frame_index(self, i: int, loop: bool = False) -> Union[int, None]:
+        """Frame shown at step 'i' of the playback, None once a playback without 'loop' is over."""
+        if loop:
+            return i % len(self.frames)
+        return i if i < len(self.frames) else None
+
+    def playback_frame(self, i: int, local_id: int, loop: bool = False) -> dict:
+        """Message of step 'i' of the playback: the frame to show and the sources of the next frames."""
+        frame = self.frame_index(i, loop)
+        upcoming = [self.frame_index(i + k, loop) for k in range(1, self.prefetch + 1)]
+        return {
+            self.key_element_id: local_id,
+            self.key_frame: frame,
+            self.key_source: self.frame_source(frame),
+            self.key_prefetch: [self.frame_source(k) for k in upcoming if k is not None]
+        }
+
+
+class StreamingPointCloud(BaseSceneElement):
+    """A point cloud that grows while the server runs, e.g. the map of a SLAM system.
+
+    Producers call 'append' from any thread. The server sends new points to the clients subscribed with
+    'subscribe_stream' as binary 'point_delta' messages, see binary_protocol, at most 'max_rate' messages per
+    second with at most 'max_points_per_message' points each. Nothing is ever converted.
+    """
+    key_stream = 'stream'
+    key_count = 'count'
+    key_voxel_size = 'voxelSize'
+    key_point_size = 'pointSize'
+
+    def __init__(self,
+                 voxel_size: float = None,
+                 max_rate: float = 10,
+                 max_points_per_message: int = 65536,
+                 point_size: float = None,
+                 name: Union[str, List[str]] = "Default",
+                 transformation: numpy.ndarray = None) -> None:
+        super().__init__(None, name, transformation)
+        self.source = ''
+        self.type = SceneElementType.STREAMING_PC
+        # Points closer than a voxel to an earlier point are dropped, None keeps every point
+        self.voxel_size = voxel_size
+        self.max_rate = max_rate
+        self.max_points_per_message = max_points_per_message
+        self._buffer = PointStreamBuffer(voxel_size)
+        if point_size is not None:
+            self.material[self.key_point_size] = point_size
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def append(self, points, colors=None) -> int:
+        """Adds points (N x 3) with optional colors, either uint8 or floats in [0, 1]. Returns how many were kept."""
+        return self._buffer.append(points, colors)
+
+    def read(self, start: int, max_points: int = None):
+        return self._buffer.read(start, max_points)
+
+    def set_source(self, source):
+        self.source = source
+
+    def convert_to_source(self):
+        # The bounds only cover the points streamed before the scene was built
+        self.set_bounding_box(self._buffer.bounds)
+
+    def to_json(self):
+        self.attributes[self.key_material] = self.material
+        self.attributes[self.key_stream] = {
+            self.key_count: len(self._buffer),
+            self.key_voxel_size: self.voxel_size
+        }
+        return {
+            self.key_scene_type: self.type.value,
+            self.key_element_id: self.element_id,
+            self.key_source: self.source,
+            self.key_attributes: self.attributes
+        }
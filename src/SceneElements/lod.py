@@ -0,0 +1,195 @@
+from typing import List, Union
+
+import numpy
+
+# Coarsest cell size of the level grids relative to the diagonal of the bounding box.
+# Every finer level halves the cell size, the finest level always holds the original data.
+CAMERA_BASE_DIVISIONS = 8
+LINE_BASE_DIVISIONS = 32
+
+
+def quaternion_to_rotation(qvec: numpy.ndarray) -> numpy.ndarray:
+    """Converts (N, 4) quaternions in COLMAP order (w, x, y, z) into (N, 3, 3) rotation matrices."""
+    q = qvec / numpy.linalg.norm(qvec, axis=1, keepdims=True)
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    return numpy.stack([
+        numpy.stack([1 - 2 * y * y - 2 * z * z, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y], axis=1),
+        numpy.stack([2 * x * y + 2 * w * z, 1 - 2 * x * x - 2 * z * z, 2 * y * z - 2 * w * x], axis=1),
+        numpy.stack([2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x * x - 2 * y * y], axis=1),
+    ], axis=1)
+
+
+def camera_centers(cameras: list) -> numpy.ndarray:
+    """The cameras of a CameraTrajectory are [tvec, qvec, image_url] in the COLMAP world-to-camera convention."""
+    if len(cameras) == 0:
+        return numpy.zeros((0, 3))
+    tvec = numpy.asarray([c[0] for c in cameras], dtype=numpy.float64)
+    qvec = numpy.asarray([c[1] for c in cameras], dtype=numpy.float64)
+    rotation = quaternion_to_rotation(qvec)
+    return -numpy.einsum('nji,nj->ni', rotation, tvec)
+
+
+def bounding_box_diagonal(points: numpy.ndarray) -> float:
+    if len(points) == 0:
+        return 0.
+    return float(numpy.linalg.norm(points.max(axis=0) - points.min(axis=0)))
+
+
+def parse_region(region_min: Union[str, List[float], None], region_max: Union[str, List[float], None]):
+    if region_min is None or region_max is None:
+        return None
+    if isinstance(region_min, str):
+        region_min = region_min.split(',')
+    if isinstance(region_max, str):
+        region_max = region_max.split(',')
+    return numpy.asarray(region_min, dtype=numpy.float64), numpy.asarray(region_max, dtype=numpy.float64)
+
+
+class LevelOfDetail:
+    """Precomputed levels of an element, level 0 is the coarsest and the last level the original data."""
+
+    def __init__(self, counts: List[int]) -> None:
+        super().__init__()
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def select_level(self, budget: int = None) -> int:
+        # The finest level that does not exceed the budget, but at least the coarsest one.
+        if budget is None:
+            return len(self.counts) - 1
+        level = 0
+        for i, count in enumerate(self.counts):
+            if count <= budget:
+                level = i
+        return level
+
+
+class CameraLevelOfDetail(LevelOfDetail):
+
+    def __init__(self, cameras: list, levels: int = 4, method: str = 'cluster') -> None:
+        self.centers = camera_centers(cameras)
+        self.indices = []
+
+        n = len(cameras)
+        diagonal = bounding_box_diagonal(self.centers)
+        for level in range(levels - 1):
+            if method == 'stride':
+                stride = 2 ** (levels - 1 - level)
+                self.indices.append(numpy.arange(0, n, stride))
+            elif method == 'cluster':
+                # Keep the first camera of the trajectory in every occupied cell
+                cell_size = diagonal / (CAMERA_BASE_DIVISIONS * 2 ** level)
+                if cell_size == 0:
+                    self.indices.append(numpy.arange(min(n, 1)))
+                    continue
+                cells = numpy.floor(self.centers / cell_size).astype(numpy.int64)
+                _, first = numpy.unique(cells, axis=0, return_index=True)
+                self.indices.append(numpy.sort(first))
+            else:
+                raise Exception(f"Unknown camera level of detail method: {method}")
+        self.indices.append(numpy.arange(n))
+
+        super().__init__([len(i) for i in self.indices])
+
+    def select(self, level: int, region=None) -> numpy.ndarray:
+        indices = self.indices[level]
+        if region is not None:
+            centers = self.centers[indices]
+            inside = numpy.all((centers >= region[0]) & (centers <= region[1]), axis=1)
+            indices = indices[inside]
+        return indices
+
+
+class Polylines:
+    """A list of polylines stored as one point array and the offsets of each line into it."""
+
+    def __init__(self, points: numpy.ndarray, offsets: numpy.ndarray) -> None:
+        super().__init__()
+        self.points = points
+        self.offsets = offsets
+
+    @staticmethod
+    def from_lines(lines: list):
+        arrays = [numpy.asarray(line, dtype=numpy.float64).reshape(-1, 3) for line in lines]
+        lengths = [len(a) for a in arrays]
+        offsets = numpy.zeros(len(arrays) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum(lengths)
+        points = numpy.concatenate(arrays) if len(arrays) > 0 else numpy.zeros((0, 3))
+        return Polylines(points, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def segment_count(self) -> int:
+        lengths = numpy.diff(self.offsets)
+        return int(numpy.maximum(lengths - 1, 0).sum())
+
+    def segments(self) -> numpy.ndarray:
+        """All segments as a (S, 2, 3) array."""
+        is_last = numpy.zeros(len(self.points), dtype=bool)
+        is_last[self.offsets[1:] - 1] = True
+        starts = numpy.nonzero(~is_last)[0]
+        return numpy.stack([self.points[starts], self.points[starts + 1]], axis=1)
+
+    def select(self, region=None):
+        if region is None or len(self) == 0:
+            return self
+        non_empty = numpy.diff(self.offsets) > 0
+        starts = self.offsets[:-1][non_empty]
+        line_min = numpy.minimum.reduceat(self.points, starts, axis=0)
+        line_max = numpy.maximum.reduceat(self.points, starts, axis=0)
+        inside = numpy.all((line_max >= region[0]) & (line_min <= region[1]), axis=1)
+        lines = numpy.nonzero(non_empty)[0][inside]
+        return Polylines.from_lines([self.points[self.offsets[i]:self.offsets[i + 1]] for i in lines])
+
+    def to_list(self) -> list:
+        return [self.points[self.offsets[i]:self.offsets[i + 1]].tolist() for i in range(len(self))]
+
+
+def simplify_segments(segments: numpy.ndarray, cell_size: float) -> Polylines:
+    """Snaps the end points to a grid and merges segments that become identical or degenerate."""
+    cells = numpy.floor(segments / cell_size).astype(numpy.int64)
+    # A segment and its reverse are the same line, order the end points before removing duplicates
+    forward = _is_ordered(cells[:, 0], cells[:, 1])
+    ordered = numpy.where(forward[:, None, None], cells, cells[:, ::-1])
+    ordered = ordered[numpy.any(ordered[:, 0] != ordered[:, 1], axis=1)]
+    unique = numpy.unique(ordered.reshape(-1, 6), axis=0).reshape(-1, 2, 3)
+    points = (unique.reshape(-1, 3) + 0.5) * cell_size
+    offsets = numpy.arange(0, len(points) + 1, 2, dtype=numpy.int64)
+    return Polylines(points, offsets)
+
+
+def _is_ordered(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    # Lexicographic a <= b for integer (N, 3) arrays
+    result = numpy.ones(len(a), dtype=bool)
+    decided = numpy.zeros(len(a), dtype=bool)
+    for axis in range(3):
+        less = (a[:, axis] < b[:, axis]) & ~decided
+        greater = (a[:, axis] > b[:, axis]) & ~decided
+        result[greater] = False
+        decided |= less | greater
+    return result
+
+
+class LineLevelOfDetail(LevelOfDetail):
+
+    def __init__(self, lines: list, levels: int = 4) -> None:
+        original = Polylines.from_lines(lines)
+        self.levels = []
+
+        segments = original.segments()
+        diagonal = bounding_box_diagonal(original.points)
+        for level in range(levels - 1):
+            cell_size = diagonal / (LINE_BASE_DIVISIONS * 2 ** level)
+            if cell_size == 0 or len(segments) == 0:
+                self.levels.append(original)
+            else:
+                self.levels.append(simplify_segments(segments, cell_size))
+        self.levels.append(original)
+
+        super().__init__([lines.segment_count() for lines in self.levels])
+
+    def select(self, level: int, region=None) -> Polylines:
+        return self.levels[level].select(region)
@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+from os.path import exists, join
+from typing import Dict, Optional, Set, Tuple
+
+import numpy
+import plyfile
+
+from src.SceneElements.bounds import PointStatistics, potree_bounds
+
+# Written next to the cloud.js of every cloud converted with 'incremental', remembers how much of the source
+# has been converted
+MANIFEST = 'incremental.json'
+
+key_source = 'source'
+key_points = 'points'
+key_tail = 'tail'
+
+# Number of converted vertices at the end of the source whose hash detects changes to converted points
+TAIL_VERTICES = 1024
+
+# Up to this many points in the first levels of an octree, potree_statistics reads them instead of estimating
+CENTROID_POINTS = 1 << 20
+
+# Bytes per point of the attributes written by the PotreeConverter 1.6 in the BINARY format
+ATTRIBUTE_SIZES = {
+    'POSITION_CARTESIAN': 12,
+    'COLOR_PACKED': 4,
+    'RGBA_PACKED': 4,
+    'INTENSITY': 2,
+    'CLASSIFICATION': 1,
+    'RETURN_NUMBER': 1,
+    'NUMBER_OF_RETURNS': 1,
+    'SOURCE_ID': 2,
+    'GPS_TIME': 8,
+    'NORMAL_SPHEREMAPPED': 2,
+    'NORMAL_OCT16': 2,
+    'NORMAL': 12,
+}
+
+
+def ply_vertex_count(path: str) -> int:
+    """Number of vertices declared in the header, without reading the data."""
+    with open(path, 'rb') as f:
+        for line in f:
+            words = line.split()
+            if words[:2] == [b'element', b'vertex']:
+                return int(words[2])
+            if words[:1] == [b'end_header']:
+                break
+    raise Exception(f"No vertex element in {path}")
+
+
+def read_ply_vertices(path: str, start: int = 0, stop: int = None) -> numpy.ndarray:
+    """The vertex records [start, stop), memory mapped for binary files so earlier vertices are not read."""
+    return plyfile.PlyData.read(path, mmap='r')['vertex'].data[start:stop]
+
+
+def _tail_hash(vertices: numpy.ndarray) -> str:
+    return hashlib.md5(numpy.ascontiguousarray(vertices[-TAIL_VERTICES:]).tobytes()).hexdigest()
+
+
+def write_manifest(ply_location: str, target: str):
+    count = ply_vertex_count(ply_location)
+    manifest = {
+        key_source: ply_location,
+        key_points: count,
+        key_tail: _tail_hash(read_ply_vertices(ply_location, max(count - TAIL_VERTICES, 0), count))
+    }
+    with open(join(target, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+
+def appended_vertices(ply_location: str, target: str) -> Tuple[Optional[int], Optional[numpy.ndarray]]:
+    """Vertices added to the source since the last conversion into 'target' and how many were converted before.
+
+    Returns (None, None) if the octree cannot be updated, because there is no manifest or the converted part of
+    the source changed.
+    """
+    manifest_path = join(target, MANIFEST)
+    if not exists(manifest_path):
+        return None, None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    converted = manifest[key_points]
+    count = ply_vertex_count(ply_location)
+    if count < converted:
+        return None, None
+    vertices = read_ply_vertices(ply_location, max(converted - TAIL_VERTICES, 0))
+    tail = converted - max(converted - TAIL_VERTICES, 0)
+    if _tail_hash(vertices[:tail]) != manifest[key_tail]:
+        return None, None
+    return converted, vertices[tail:]
+
+
+class PotreeOctree:
+    """The octree written by the PotreeConverter 1.6 in the BINARY format, see cloud.js.
+
+    Every node is a file of fixed size point records, its name is 'r' followed by the child index of every level,
+    with bit 2 of the index for x, bit 1 for y and bit 0 for z. Every 'hierarchyStepSize' levels, a .hrc file lists
+    the child masks and point counts of the following levels in breadth-first order.
+    """
+
+    def __init__(self, directory: str) -> None:
+        super().__init__()
+        self.directory = directory
+        with open(join(directory, 'cloud.js')) as f:
+            self.cloud = json.load(f)
+        attributes = self.cloud['pointAttributes']
+        if not isinstance(attributes, list) or any(a not in ATTRIBUTE_SIZES for a in attributes) or \
+                'POSITION_CARTESIAN' not in attributes:
+            raise Exception(f"Cannot update point attributes {attributes}, only the BINARY format is supported")
+        self.octree_dir = join(directory, self.cloud['octreeDir'])
+        self.step = self.cloud['hierarchyStepSize']
+        self.scale = self.cloud['scale']
+        self.spacing = self.cloud['spacing']
+        box = self.cloud['boundingBox']
+        self.min = numpy.array([box['lx'], box['ly'], box['lz']], dtype=numpy.float64)
+        self.size = numpy.array([box['ux'], box['uy'], box['uz']], dtype=numpy.float64) - self.min
+        self.dtype = numpy.dtype([self._attribute_dtype(a) for a in attributes])
+
+        # name -> number of points of every node
+        self.nodes: Dict[str, int] = {}
+        for root, _, files in os.walk(self.octree_dir):
+            for file in files:
+                if file.endswith('.bin'):
+                    self.nodes[file[:-4]] = os.path.getsize(join(root, file)) // self.dtype.itemsize
+        if 'r' not in self.nodes:
+            raise Exception(f"No octree found in {self.octree_dir}")
+
+    @staticmethod
+    def _attribute_dtype(attribute: str):
+        if attribute == 'POSITION_CARTESIAN':
+            return attribute, '<u4', (3,)
+        if attribute in ('COLOR_PACKED', 'RGBA_PACKED'):
+            return attribute, 'u1', (4,)
+        return attribute, f'V{ATTRIBUTE_SIZES[attribute]}'
+
+    def hierarchy_path(self, name: str) -> str:
+        indices = name[1:]
+        parts = [indices[i * self.step:(i + 1) * self.step] for i in range(len(indices) // self.step)]
+        return join(self.octree_dir, 'r', *parts)
+
+    def node_bounds(self, name: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        low, size = self.min.copy(), self.size.copy()
+        for index in name[1:]:
+            size /= 2
+            index = int(index)
+            low += size * [(index >> 2) & 1, (index >> 1) & 1, index & 1]
+        return low, size
+
+    def read_node(self, name: str) -> numpy.ndarray:
+        """World positions of the points of a node."""
+        if self.nodes.get(name, 0) == 0:
+            return numpy.empty((0, 3))
+        records = numpy.fromfile(join(self.hierarchy_path(name), name + '.bin'), dtype=self.dtype)
+        return records['POSITION_CARTESIAN'] * self.scale + self.node_bounds(name)[0]
+
+    def append_to_node(self, name: str, points: numpy.ndarray, colors: numpy.ndarray):
+        records = numpy.zeros(len(points), dtype=self.dtype)
+        low = self.node_bounds(name)[0]
+        records['POSITION_CARTESIAN'] = numpy.maximum((points - low) / self.scale, 0).astype(numpy.uint32)
+        for attribute in ('COLOR_PACKED', 'RGBA_PACKED'):
+            if attribute in self.dtype.names:
+                records[attribute][:, :3] = colors
+                records[attribute][:, 3] = 255
+        os.makedirs(self.hierarchy_path(name), exist_ok=True)
+        with open(join(self.hierarchy_path(name), name + '.bin'), 'ab') as f:
+            f.write(records.tobytes())
+        self.nodes[name] = self.nodes.get(name, 0) + len(points)
+
+    def _cell_keys(self, name: str, points: numpy.ndarray) -> numpy.ndarray:
+        # Cells of the minimum point distance of the node. Every level halves both the node and the spacing, so
+        # a node always has the same number of cells as the root.
+        level = len(name) - 1
+        spacing = self.spacing / 2 ** level
+        low, size = self.node_bounds(name)
+        dims = numpy.ceil(size / spacing).astype(numpy.int64) + 1
+        cells = numpy.clip(numpy.floor((points - low) / spacing).astype(numpy.int64), 0, dims - 1)
+        return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    def insert(self, points: numpy.ndarray, colors: numpy.ndarray) -> Set[str]:
+        """Adds points to the octree and returns the names of the nodes that changed.
+
+        Like the converter, a node keeps a point if no point of the node lies in the same cell of its spacing,
+        all other points move on to the child they fall into. Nodes are only created up to the depth the octree
+        already has, the deepest nodes keep every point that reaches them.
+        """
+        high = self.min + self.size
+        if numpy.any(points < self.min) or numpy.any(points > high):
+            raise Exception("New points lie outside the bounding box of the octree")
+        max_level = max(len(name) for name in self.nodes) - 1
+
+        changed = set()
+        pending = {'r': numpy.arange(len(points))}
+        while len(pending) > 0:
+            next_pending = {}
+            for name, indices in pending.items():
+                node_points = points[indices]
+                if len(name) - 1 >= max_level:
+                    accepted = numpy.ones(len(indices), dtype=bool)
+                else:
+                    keys = self._cell_keys(name, node_points)
+                    occupied = numpy.unique(self._cell_keys(name, self.read_node(name)))
+                    _, first = numpy.unique(keys, return_index=True)
+                    accepted = numpy.zeros(len(indices), dtype=bool)
+                    accepted[first] = True
+                    accepted &= ~numpy.isin(keys, occupied)
+
+                if accepted.any():
+                    self.append_to_node(name, node_points[accepted], colors[indices[accepted]])
+                    changed.add(name)
+                    # A new node changes the child mask of its parent
+                    if len(name) > 1:
+                        changed.add(name[:-1])
+
+                rest = indices[~accepted]
+                if len(rest) == 0:
+                    continue
+                low, size = self.node_bounds(name)
+                upper = points[rest] >= low + size / 2
+                child = upper[:, 0] * 4 + upper[:, 1] * 2 + upper[:, 2] * 1
+                for index in numpy.unique(child):
+                    next_pending[name + str(index)] = rest[child == index]
+            pending = next_pending
+        return changed
+
+    def write_hierarchy(self, changed: Set[str]):
+        """Rewrites the .hrc files that list any of the changed nodes."""
+        roots = set()
+        for name in changed:
+            level = len(name) - 1
+            roots.add(name[:1 + level // self.step * self.step])
+            # A node on a step level is also the last level of the file above
+            if level > 0 and level % self.step == 0:
+                roots.add(name[:1 + level - self.step])
+
+        for root in roots:
+            records = []
+            queue = [root]
+            while len(queue) > 0:
+                name = queue.pop(0)
+                children = [name + str(i) for i in range(8) if name + str(i) in self.nodes]
+                mask = sum(1 << int(child[-1]) for child in children)
+                records.append(numpy.array([(mask, self.nodes[name])], dtype=[('mask', 'u1'), ('points', '<u4')]))
+                if len(name) - len(root) < self.step:
+                    queue.extend(children)
+            with open(join(self.hierarchy_path(root), root + '.hrc'), 'wb') as f:
+                f.write(numpy.concatenate(records).tobytes())
+
+    def update_cloud(self, points: numpy.ndarray):
+        self.cloud['points'] = self.cloud.get('points', 0) + len(points)
+        if 'tightBoundingBox' in self.cloud:
+            box = self.cloud['tightBoundingBox']
+            low = numpy.minimum([box['lx'], box['ly'], box['lz']], points.min(axis=0))
+            high = numpy.maximum([box['ux'], box['uy'], box['uz']], points.max(axis=0))
+            box.update(zip(['lx', 'ly', 'lz', 'ux', 'uy', 'uz'], [float(v) for v in [*low, *high]]))
+        with open(join(self.directory, 'cloud.js'), 'w') as f:
+            json.dump(self.cloud, f, indent=2)
+
+
+def potree_statistics(directory: str) -> PointStatistics:
+    """Bounds and number of points from the cloud.js, the centroid estimated from the nodes of the first hierarchy
+    file. Small octrees are read, otherwise the node centers are weighted by their point counts. Without a
+    hierarchy file, the center of the bounds is used."""
+    bounds = potree_bounds(directory)
+    if bounds is None:
+        return None, None, None
+    with open(join(directory, 'cloud.js')) as f:
+        cloud = json.load(f)
+    centroid = (bounds[0] + bounds[1]) / 2
+    hierarchy = join(directory, cloud['octreeDir'], 'r', 'r.hrc')
+    if not exists(hierarchy):
+        return bounds, centroid, cloud.get('points')
+
+    box = cloud['boundingBox']
+    low = numpy.array([box['lx'], box['ly'], box['lz']], dtype=numpy.float64)
+    size = numpy.array([box['ux'], box['uy'], box['uz']], dtype=numpy.float64) - low
+    # Breadth-first, the children of a node follow in the order of its child mask
+    queue = [('r', low, size)]
+    nodes = []
+    for mask, count in numpy.fromfile(hierarchy, dtype=[('mask', 'u1'), ('count', '<u4')]):
+        name, corner, node_size = queue.pop(0)
+        nodes.append((name, corner + node_size / 2, count))
+        for index in range(8):
+            if mask & (1 << index):
+                offset = node_size / 2 * [(index >> 2) & 1, (index >> 1) & 1, index & 1]
+                queue.append((name + str(index), corner + offset, node_size / 2))
+
+    counts = [count for _, _, count in nodes]
+    if 0 < sum(counts) <= CENTROID_POINTS:
+        try:
+            octree = PotreeOctree(directory)
+            centroid = numpy.concatenate([octree.read_node(name) for name, _, _ in nodes]).mean(axis=0)
+        except Exception:  # not the BINARY format
+            centroid = numpy.average([center for _, center, _ in nodes], axis=0, weights=counts)
+    elif sum(counts) > 0:
+        centroid = numpy.average([center for _, center, _ in nodes], axis=0, weights=counts)
+    return bounds, centroid, cloud.get('points')
+
+
+def update_potree(ply_location: str, target: str) -> bool:
+    """Inserts the vertices appended to 'ply_location' into the octree in 'target', without converting it again.
+
+    Returns False if the octree cannot be updated and has to be converted again.
+    """
+    converted, vertices = appended_vertices(ply_location, target)
+    if converted is None:
+        return False
+    if len(vertices) == 0:
+        print('[Info]: PointCloud already found, no conversion needed')
+        return True
+
+    names = vertices.dtype.names
+    points = numpy.stack([vertices['x'], vertices['y'], vertices['z']], axis=1).astype(numpy.float64)
+    if all(c in names for c in ('red', 'green', 'blue')):
+        colors = numpy.stack([vertices['red'], vertices['green'], vertices['blue']], axis=1).astype(numpy.uint8)
+    else:
+        colors = numpy.full((len(points), 3), 255, dtype=numpy.uint8)
+
+    try:
+        octree = PotreeOctree(target)
+        changed = octree.insert(points, colors)
+    except Exception as e:
+        print(f"[Info]: Cannot update the octree of '{ply_location}' ({e}), converting it again")
+        return False
+    octree.write_hierarchy(changed)
+    octree.update_cloud(points)
+    write_manifest(ply_location, target)
+    print(f"[Info]: Added {len(points)} points to {len(changed)} of {len(octree.nodes)} octree nodes")
+    return True
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import numpy
+import plyfile
+
+from src.SceneElements.quantization import encode_compact, COMPACT_VERSION
+
+PointArrays = Tuple[numpy.ndarray, Optional[numpy.ndarray], Optional[numpy.ndarray]]
+
+
+def read_ply_arrays(path: str) -> PointArrays:
+    """Reads points, colors (uint8) and normals of the vertex element, colors and normals are None if missing."""
+    vertex = plyfile.PlyData.read(path)['vertex']
+    names = vertex.data.dtype.names
+    points = numpy.stack([vertex['x'], vertex['y'], vertex['z']], axis=1).astype(numpy.float64)
+    colors = None
+    if all(c in names for c in ('red', 'green', 'blue')):
+        colors = numpy.stack([vertex['red'], vertex['green'], vertex['blue']], axis=1).astype(numpy.uint8)
+    normals = None
+    if all(n in names for n in ('nx', 'ny', 'nz')):
+        normals = numpy.stack([vertex['nx'], vertex['ny'], vertex['nz']], axis=1).astype(numpy.float64)
+    return points, colors, normals
+
+
+def write_ply_arrays(path: Path, points: numpy.ndarray, colors: numpy.ndarray = None,
+                     normals: numpy.ndarray = None, xyz_dtype: str = 'float32') -> Path:
+    """Same layout as write_pointcloud_o3d, but straight from arrays."""
+    dtypes = [('x', xyz_dtype), ('y', xyz_dtype), ('z', xyz_dtype)]
+    if normals is not None:
+        dtypes.extend([('nx', xyz_dtype), ('ny', xyz_dtype), ('nz', xyz_dtype)])
+    if colors is not None:
+        dtypes.extend([('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+    data = numpy.empty(len(points), dtype=dtypes)
+    data['x'], data['y'], data['z'] = points.T
+    if normals is not None:
+        data['nx'], data['ny'], data['nz'] = normals.T
+    if colors is not None:
+        data['red'], data['green'], data['blue'] = colors.T
+    with open(str(path), mode='w+b') as f:
+        plyfile.PlyData([plyfile.PlyElement.describe(data, 'vertex')]).write(f)
+    return path
+
+
+def write_atomically(target: Path, write: Callable[[Path], object]) -> Path:
+    """Calls 'write' with a temporary path next to 'target' and moves the file into place once it is complete.
+
+    An interrupted run or a concurrent reader never sees a partial file, which the caches below would reuse.
+    """
+    handle, temporary = tempfile.mkstemp(dir=target.parent, prefix=f"{target.name}.", suffix='.tmp')
+    os.close(handle)
+    try:
+        write(Path(temporary))
+        os.replace(temporary, target)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return target
+
+
+def voxel_keys(points: numpy.ndarray, voxel_size: float) -> numpy.ndarray:
+    """One integer per point that is equal for all points in the same voxel."""
+    if len(points) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    cells = numpy.floor((points - points.min(axis=0)) / voxel_size).astype(numpy.int64)
+    dims = cells.max(axis=0) + 1
+    if numpy.prod(dims.astype(numpy.float64)) < 2 ** 62:
+        return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    # Too many cells to number them linearly, fall back to comparing the rows
+    return numpy.unique(cells, axis=0, return_inverse=True)[1].reshape(-1)
+
+
+def voxel_downsample(points: numpy.ndarray, voxel_size: float, colors: numpy.ndarray = None,
+                     normals: numpy.ndarray = None, representative: str = 'average') -> PointArrays:
+    """Keeps one point per occupied voxel.
+
+    With representative 'average' the point is the mean of all points, colors and normals of the voxel.
+    With 'nearest' the original point closest to that mean is kept with its own color and normal.
+    """
+    _, inverse, counts = numpy.unique(voxel_keys(points, voxel_size), return_inverse=True, return_counts=True)
+
+    def average(values: numpy.ndarray) -> numpy.ndarray:
+        return numpy.stack([numpy.bincount(inverse, weights=values[:, i]) for i in range(values.shape[1])],
+                           axis=1) / counts[:, None]
+
+    centers = average(points)
+    if representative == 'average':
+        out_colors = None if colors is None else numpy.round(average(colors.astype(numpy.float64))).astype(numpy.uint8)
+        out_normals = None
+        if normals is not None:
+            out_normals = average(normals)
+            lengths = numpy.linalg.norm(out_normals, axis=1, keepdims=True)
+            out_normals = numpy.divide(out_normals, lengths, out=numpy.zeros_like(out_normals), where=lengths > 0)
+        return centers, out_colors, out_normals
+    elif representative == 'nearest':
+        distances = numpy.sum((points - centers[inverse]) ** 2, axis=1)
+        order = numpy.lexsort((distances, inverse))
+        # After sorting by voxel and distance, the first point of every voxel is the closest one
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = inverse[order[1:]] != inverse[order[:-1]]
+        selected = order[first]
+        return points[selected], \
+            None if colors is None else colors[selected], \
+            None if normals is None else normals[selected]
+    else:
+        raise Exception(f"Unknown voxel representative: {representative}")
+
+
+def voxel_size_for_target(points: numpy.ndarray, target_points: int, tolerance: float = 0.05,
+                          iterations: int = 20) -> float:
+    """Searches the voxel size that leaves about 'target_points' occupied voxels."""
+    extent = points.max(axis=0) - points.min(axis=0)
+    low, high = 1e-9, float(numpy.max(extent)) + 1e-9
+    size = high
+    for _ in range(iterations):
+        # The number of occupied voxels changes roughly with a power of the size, search on a log scale
+        size = float(numpy.sqrt(low * high))
+        count = len(numpy.unique(voxel_keys(points, size)))
+        if abs(count - target_points) <= tolerance * target_points:
+            break
+        if count > target_points:
+            low = size
+        else:
+            high = size
+    return size
+
+
+def derived_path(source: str, parameters: dict, kind: str, suffix: str) -> Path:
+    """Cache location next to the source, keyed by the parameters and the state of the source file."""
+    stat = os.stat(source)
+    key = json.dumps({**parameters, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}, sort_keys=True)
+    digest = hashlib.md5(key.encode()).hexdigest()[:16]
+    path = Path(source)
+    return path.with_name(f"{path.stem}.{kind}-{digest}{suffix}")
+
+
+def downsampled_path(source: str, parameters: dict) -> Path:
+    return derived_path(source, parameters, 'voxel', '.ply')
+
+
+def downsample_ply(source: str, voxel_size: float = None, target_points: int = None,
+                   representative: str = 'average') -> Path:
+    if voxel_size is None and target_points is None:
+        raise Exception("Voxel downsampling needs either a voxel size or a target point count")
+
+    parameters = {'voxelSize': voxel_size, 'targetPoints': target_points, 'representative': representative}
+    target = downsampled_path(source, parameters)
+    if target.exists():
+        print(f"[Info]: Downsampled point-cloud already found at {target}")
+        return target
+
+    points, colors, normals = read_ply_arrays(source)
+    if voxel_size is None:
+        if len(points) <= target_points:
+            return Path(source)
+        voxel_size = voxel_size_for_target(points, target_points)
+    points, colors, normals = voxel_downsample(points, voxel_size, colors, normals, representative)
+    print(f"[Info]: Downsampled '{source}' with voxel size {voxel_size:.6g} to {len(points)} points")
+    return write_atomically(target, lambda path: write_ply_arrays(path, points, colors, normals))
+
+
+def compact_ply(source: str) -> Path:
+    """Writes the point-cloud in the quantized format of quantization.encode_compact, next to the source."""
+    target = derived_path(source, {'version': COMPACT_VERSION}, 'compact', '.tqpc')
+    if target.exists():
+        return target
+    points, colors, normals = read_ply_arrays(source)
+    data = encode_compact(points, colors, normals)
+    write_atomically(target, lambda path: path.write_bytes(data))
+    print(f"[Info]: Wrote compact point-cloud {target}, {len(data) / max(len(points), 1):.1f} bytes per point")
+    return target
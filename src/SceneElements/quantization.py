@@ -0,0 +1,85 @@
+import struct
+from typing import Optional, Tuple
+
+import numpy
+
+# Layout of a compact point cloud, all little-endian:
+#   header: magic, version, flags, point count, offset (3 x float64), scale (3 x float64)
+#   positions: count x 3 uint16, the point is offset + position * scale
+#   colors: count x 3 uint8, if FLAG_COLORS is set
+#   normals: count x 2 uint8 octahedral coordinates, if FLAG_NORMALS is set
+COMPACT_MAGIC = b'TQPC'
+COMPACT_VERSION = 1
+COMPACT_HEADER = struct.Struct('<4sBBxxI3d3d')
+
+FLAG_COLORS = 1
+FLAG_NORMALS = 2
+
+QUANTIZATION_STEPS = 65535
+
+
+def octahedral_encode(normals: numpy.ndarray) -> numpy.ndarray:
+    """Maps unit normals onto the octahedron and its faces onto a square, stored as two uint8 per normal."""
+    normals = numpy.asarray(normals, dtype=numpy.float64)
+    lengths = numpy.abs(normals).sum(axis=1, keepdims=True)
+    lengths[lengths == 0] = 1
+    projected = normals / lengths
+    x, y, z = projected[:, 0], projected[:, 1], projected[:, 2]
+    # The lower half is folded over the diagonals
+    sign_x = numpy.where(x >= 0, 1., -1.)
+    sign_y = numpy.where(y >= 0, 1., -1.)
+    lower = z < 0
+    u = numpy.where(lower, (1 - numpy.abs(y)) * sign_x, x)
+    v = numpy.where(lower, (1 - numpy.abs(x)) * sign_y, y)
+    return numpy.round(numpy.stack([u, v], axis=1) * 127.5 + 127.5).astype(numpy.uint8)
+
+
+def octahedral_decode(encoded: numpy.ndarray) -> numpy.ndarray:
+    uv = encoded.astype(numpy.float64) / 127.5 - 1
+    x, y = uv[:, 0], uv[:, 1]
+    z = 1 - numpy.abs(x) - numpy.abs(y)
+    t = numpy.clip(-z, 0, None)
+    x = x - numpy.where(x >= 0, t, -t)
+    y = y - numpy.where(y >= 0, t, -t)
+    normals = numpy.stack([x, y, z], axis=1)
+    return normals / numpy.linalg.norm(normals, axis=1, keepdims=True)
+
+
+def encode_compact(points: numpy.ndarray, colors: numpy.ndarray = None, normals: numpy.ndarray = None) -> bytes:
+    """Quantizes the positions to uint16 inside their bounding box, 6 to 11 bytes per point."""
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    if len(points) == 0:
+        offset = numpy.zeros(3)
+        scale = numpy.ones(3)
+    else:
+        offset = points.min(axis=0)
+        scale = (points.max(axis=0) - offset) / QUANTIZATION_STEPS
+        scale[scale == 0] = 1
+    positions = numpy.round((points - offset) / scale).astype('<u2')
+
+    flags = (FLAG_COLORS if colors is not None else 0) | (FLAG_NORMALS if normals is not None else 0)
+    parts = [COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, flags, len(points), *offset, *scale),
+             positions.tobytes()]
+    if colors is not None:
+        parts.append(numpy.ascontiguousarray(colors, dtype=numpy.uint8).tobytes())
+    if normals is not None:
+        parts.append(octahedral_encode(normals).tobytes())
+    return b''.join(parts)
+
+
+def decode_compact(data: bytes) -> Tuple[numpy.ndarray, Optional[numpy.ndarray], Optional[numpy.ndarray]]:
+    magic, version, flags, count, *values = COMPACT_HEADER.unpack_from(data)
+    if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+        raise Exception(f"Not a compact point cloud of version {COMPACT_VERSION}")
+    offset, scale = numpy.array(values[:3]), numpy.array(values[3:])
+    position = COMPACT_HEADER.size
+    positions = numpy.frombuffer(data, dtype='<u2', count=count * 3, offset=position).reshape(-1, 3)
+    position += positions.nbytes
+    colors = normals = None
+    if flags & FLAG_COLORS:
+        colors = numpy.frombuffer(data, dtype=numpy.uint8, count=count * 3, offset=position).reshape(-1, 3)
+        position += colors.nbytes
+    if flags & FLAG_NORMALS:
+        encoded = numpy.frombuffer(data, dtype=numpy.uint8, count=count * 2, offset=position).reshape(-1, 2)
+        normals = octahedral_decode(encoded)
+    return offset + positions * scale, colors, normals
@@ -0,0 +1,96 @@
+import bisect
+import threading
+from typing import List, Optional, Set, Tuple
+
+import numpy
+
+from src.SceneElements.bounds import BoundingBox, points_bounds, union_bounds
+
+# Voxel coordinates are packed into 21 bits per axis, which covers about two million voxels along every axis
+VOXEL_BITS = 21
+VOXEL_OFFSET = 1 << (VOXEL_BITS - 1)
+
+
+def absolute_voxel_keys(points: numpy.ndarray, voxel_size: float) -> numpy.ndarray:
+    """Like preprocessing.voxel_keys, but the keys do not depend on the other points, so chunks can be compared."""
+    cells = numpy.floor(points / voxel_size).astype(numpy.int64) + VOXEL_OFFSET
+    cells = numpy.clip(cells, 0, (1 << VOXEL_BITS) - 1)
+    return (cells[:, 0] << (2 * VOXEL_BITS)) | (cells[:, 1] << VOXEL_BITS) | cells[:, 2]
+
+
+class PointStreamBuffer:
+    """Append-only store of streamed points, kept as a list of chunks so appending never copies earlier points.
+
+    Points are addressed by the position they were appended at, readers keep their own position and ask for
+    everything after it. With a voxel size, a point is only kept if no earlier point lies in its voxel.
+    """
+
+    def __init__(self, voxel_size: float = None) -> None:
+        super().__init__()
+        self.voxel_size = voxel_size
+        self._lock = threading.Lock()
+        self._points: List[numpy.ndarray] = []
+        self._colors: List[numpy.ndarray] = []
+        # Index of the first point of every chunk, plus the total count at the end
+        self._offsets = [0]
+        # Keys of all occupied voxels. A set grows in place, so an append only costs as much as its own points
+        self._voxels: Set[int] = set()
+        self.bounds: Optional[BoundingBox] = None
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def _deduplicate(self, points: numpy.ndarray) -> numpy.ndarray:
+        """Indices of the points that occupy a voxel which is still empty, the first point of a voxel wins."""
+        keys = absolute_voxel_keys(points, self.voxel_size)
+        keys, first = numpy.unique(keys, return_index=True)
+        keys = keys.tolist()
+        empty = numpy.fromiter((key not in self._voxels for key in keys), dtype=bool, count=len(keys))
+        self._voxels.update(key for key, is_empty in zip(keys, empty) if is_empty)
+        return numpy.sort(first[empty])
+
+    def append(self, points, colors=None) -> int:
+        """Adds points (N x 3) and optional uint8 colors (N x 3), returns how many were kept. Thread-safe."""
+        points = numpy.asarray(points, dtype=numpy.float32).reshape(-1, 3)
+        if colors is None:
+            colors = numpy.full(points.shape, 255, dtype=numpy.uint8)
+        else:
+            colors = numpy.asarray(colors)
+            if colors.dtype.kind == 'f':  # colors in [0, 1] like open3d uses them
+                colors = colors * 255
+            colors = colors.astype(numpy.uint8).reshape(-1, 3)
+        if len(colors) != len(points):
+            raise Exception(f"Got {len(points)} points but {len(colors)} colors")
+
+        with self._lock:
+            if self.voxel_size is not None and len(points) > 0:
+                kept = self._deduplicate(points)
+                points, colors = points[kept], colors[kept]
+            if len(points) == 0:
+                return 0
+            self._points.append(points)
+            self._colors.append(colors)
+            self._offsets.append(self._offsets[-1] + len(points))
+            self.bounds = union_bounds([self.bounds, points_bounds(points)])
+        return len(points)
+
+    def read(self, start: int, max_points: int = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Points and colors appended after the first 'start' points, at most 'max_points' of them."""
+        with self._lock:
+            # The chunk holding point 'start' and everything after it
+            first = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+            chunks = list(zip(self._points[first:], self._colors[first:], self._offsets[first:]))
+            stop = self._offsets[-1]
+        if max_points is not None:
+            stop = min(stop, start + max_points)
+
+        points, colors = [], []
+        for chunk_points, chunk_colors, offset in chunks:
+            if offset >= stop:
+                break
+            begin = max(start - offset, 0)
+            points.append(chunk_points[begin:stop - offset])
+            colors.append(chunk_colors[begin:stop - offset])
+        if len(points) == 0:
+            return numpy.empty((0, 3), dtype=numpy.float32), numpy.empty((0, 3), dtype=numpy.uint8)
+        return numpy.concatenate(points), numpy.concatenate(colors)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from os.path import exists, getsize, isdir, join
+from pathlib import Path
+from typing import List
+
+from src.App.thumbnails import ThumbnailCache
+from src.SceneElements.conversion import CONVERSIONS
+from src.SceneElements.elements import PotreePointCloud, DefaultPointCloud, CameraTrajectory, \
+    BASE_CONVERTED_DIRECTORY
+from src.colmap_manager import colmap_scene
+
+POTREE = 'potree'
+DEFAULT = 'default'
+COLMAP = 'colmap'
+ELEMENT_TYPES = {POTREE: PotreePointCloud, DEFAULT: DefaultPointCloud}
+
+key_type = 'type'
+key_path = 'path'
+
+COLMAP_MODEL_FILES = ('cameras.bin', 'images.bin', 'points3D.bin')
+# Written by Tarasp itself, not searched for assets
+GENERATED_DIRECTORIES = (BASE_CONVERTED_DIRECTORY, './data/thumbnails', './data/colmap_cache')
+
+
+def is_colmap_model(directory: str) -> bool:
+    return all(exists(join(directory, file)) for file in COLMAP_MODEL_FILES)
+
+
+def find_assets(directory: str) -> List[dict]:
+    """Every PLY file below 'directory' as Potree cloud and every binary COLMAP model.
+
+    The paths keep the spelling of 'directory', as the converted directory is named after the hash of the path.
+    """
+    generated = {Path(d).resolve() for d in GENERATED_DIRECTORIES}
+    entries = []
+    for root, directories, files in os.walk(directory):
+        directories[:] = sorted(d for d in directories if Path(root, d).resolve() not in generated)
+        if is_colmap_model(root):
+            entries.append({key_type: COLMAP, key_path: root})
+        for file in sorted(files):
+            # Skip the voxel-downsampled copies of DefaultPointClouds
+            if file.endswith('.ply') and '.voxel-' not in file:
+                entries.append({key_type: POTREE, key_path: join(root, file)})
+    return entries
+
+
+def prepare_asset(entry: dict, thumbnails: ThumbnailCache = None) -> dict:
+    """Converts one asset like Tarasp.run would. All keys of the entry besides type and path are passed on to the
+    element, or to colmap_scene for COLMAP models."""
+    path = entry[key_path]
+    asset_type = entry.get(key_type, COLMAP if isdir(path) else POTREE)
+    options = {key: value for key, value in entry.items() if key not in (key_type, key_path)}
+    start = time.monotonic()
+
+    if asset_type == COLMAP:
+        point_cloud, trajectories = colmap_scene(path, **options)
+        elements = [point_cloud, *trajectories]
+    elif asset_type in ELEMENT_TYPES:
+        elements = [ELEMENT_TYPES[asset_type](data=path, **options)]
+    else:
+        raise Exception(f"Unknown asset type {asset_type}, expected one of {[COLMAP, *ELEMENT_TYPES]}")
+    for element in elements:
+        element.convert_to_source()
+
+    if thumbnails is not None:
+        for element in elements:
+            if isinstance(element, CameraTrajectory) and element.link_images and element.thumbnail_size is not None:
+                wait(thumbnails.warm(element.image_paths, sizes=[element.thumbnail_size]))
+
+    sources = [element.input_path for element in elements if isinstance(element, PotreePointCloud)] + \
+              [element.data for element in elements if isinstance(element, DefaultPointCloud)]
+    return {
+        key_path: path,
+        key_type: asset_type,
+        'seconds': time.monotonic() - start,
+        'points': sum(element.point_count or 0 for element in elements),
+        'bytes': sum(getsize(source) for source in sources if isinstance(source, str) and exists(source))
+    }
+
+
+def prepare_assets(entries: List[dict], workers: int = 2, thumbnails: bool = False) -> List[dict]:
+    """Converts all assets, up to 'workers' at the same time. Returns the statistics of every asset, failed ones
+    with their 'error'."""
+    CONVERSIONS.workers = workers
+    thumbnail_cache = ThumbnailCache() if thumbnails else None
+
+    def prepare(entry: dict) -> dict:
+        try:
+            result = prepare_asset(entry, thumbnail_cache)
+        except Exception as e:
+            print(f"[Info]: Error, preparing {entry[key_path]} failed: {e}")
+            return {key_path: entry[key_path], key_type: entry.get(key_type), 'error': str(e)}
+        print(f"[Info]: Prepared {result[key_path]} ({result[key_type]}) in {result['seconds']:.1f}s, "
+              f"{result['points']} points, {result['bytes'] / max(result['seconds'], 1e-6) / 1e6:.1f} MB/s")
+        return result
+
+    # Every asset in its own thread like Tarasp.convert_scene_elements, the conversion queue limits the converters
+    with ThreadPoolExecutor(max_workers=max(workers, len(entries), 1)) as executor:
+        return list(executor.map(prepare, entries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts point clouds and COLMAP models ahead of time into "
+                                                 "./data/converted, so a server started in the same directory "
+                                                 "finds them converted.")
+    parser.add_argument('paths', nargs='*', help="PLY files, COLMAP models or directories to search for both")
+    parser.add_argument('--manifest', help="JSON list of assets, e.g. [{\"path\": \"./data/scan.ply\"}, "
+                                           "{\"path\": \"./data/room.ply\", \"type\": \"default\", "
+                                           "\"voxel_size\": 0.05}, {\"path\": \"./data/sparse\", "
+                                           "\"type\": \"colmap\"}]")
+    parser.add_argument('--workers', type=int, default=2, help="Conversions running at the same time")
+    parser.add_argument('--thumbnails', action='store_true', help="Also create the thumbnails of camera images")
+    parser.add_argument('--output', help="Write the statistics of every asset to this JSON file")
+    args = parser.parse_args()
+
+    # Paths are used as written, the server has to spell them the same way to find their conversion
+    entries = []
+    if args.manifest is not None:
+        with open(args.manifest) as f:
+            entries.extend(json.load(f))
+    for path in args.paths:
+        if isdir(path) and not is_colmap_model(path):
+            entries.extend(find_assets(path))
+        else:
+            entries.append({key_path: path})
+    if len(entries) == 0:
+        parser.error("No assets given")
+
+    start = time.monotonic()
+    results = prepare_assets(entries, args.workers, args.thumbnails)
+    elapsed = time.monotonic() - start
+    failed = [result for result in results if 'error' in result]
+    points = sum(result.get('points', 0) for result in results)
+    size = sum(result.get('bytes', 0) for result in results)
+    print(f"[Info]: Prepared {len(results) - len(failed)} of {len(results)} assets in {elapsed:.1f}s, "
+          f"{points / elapsed:.0f} points/s, {size / elapsed / 1e6:.1f} MB/s")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
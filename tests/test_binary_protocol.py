@@ -0,0 +1,53 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+# Open3D also fails to import when a shared library it links against is missing
+pytest.importorskip('open3d', exc_type=ImportError)
+
+from src.App.binary_protocol import POSE_PACKET, decode_animation_frame, decode_camera_state, \
+    decode_point_delta, encode_animation_frame, encode_camera_state, encode_point_delta, key_last_update  # noqa: E402
+from src.Components.base import CameraState  # noqa: E402
+
+
+def test_camera_state_survives_the_pose_packet():
+    camera = CameraState([1.5, -2, 30], [0.1, 0.2, 0.3, 0.927], up=[0, 0, 1], fov=45, near=0.5, far=2000, zoom=2.5)
+    state = {**camera.to_json(), key_last_update: 1234.5}
+
+    packet = encode_camera_state(state, 3)
+    assert len(packet) == POSE_PACKET.size
+    scene_id, decoded = decode_camera_state(packet)
+
+    assert scene_id == 3
+    assert decoded[key_last_update] == 1234.5
+    for key, value in camera.to_json().items():
+        assert decoded[key] == pytest.approx(value, rel=1e-6), key
+
+
+def test_zoom_defaults_to_one():
+    state = CameraState([0, 0, 0], [0, 0, 0, 1]).to_json()
+    del state[CameraState.key_zoom]
+    assert decode_camera_state(encode_camera_state(state, 0))[1][CameraState.key_zoom] == 1
+
+
+def test_animation_frame_keeps_screenshot_settings():
+    camera = CameraState([4, 5, 6], [0, 0, 0, 1], zoom=0.5)
+    packet = encode_animation_frame({'cameraState': camera.to_json(), 'screenshot': True,
+                                     'screenshotDirectory': 'shots/run'}, 1)
+    scene_id, frame = decode_animation_frame(packet)
+
+    assert scene_id == 1
+    assert frame['screenshot'] is True
+    assert frame['screenshotDirectory'] == 'shots/run'
+    for key, value in camera.to_json().items():
+        assert frame['cameraState'][key] == pytest.approx(value), key
+
+
+def test_point_delta_round_trip():
+    points = numpy.arange(12, dtype=numpy.float32).reshape(4, 3)
+    colors = numpy.arange(12, dtype=numpy.uint8).reshape(4, 3)
+    delta = decode_point_delta(encode_point_delta(2, 7, 100, points, colors))
+
+    assert (delta['sceneId'], delta['elementId'], delta['start']) == (2, 7, 100)
+    assert (delta['points'] == points).all()
+    assert (delta['colors'] == colors).all()
+    assert decode_point_delta(encode_point_delta(0, 0, 0, points))['colors'] is None
@@ -0,0 +1,78 @@
+import struct
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+pytest.importorskip('plyfile')
+pytest.importorskip('pycolmap')
+# Open3D also fails to import when a shared library it links against is missing
+pytest.importorskip('open3d', exc_type=ImportError)
+
+from src.colmap_manager import POINT3D_DTYPE, filter_points3D, read_points3D_bin  # noqa: E402
+
+
+def write_points3D_bin(path, points):
+    """points: (point3D_id, xyz, rgb, error, track) with track a list of (image_id, point2D_idx)."""
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(points)))
+        for point3D_id, xyz, rgb, error, track in points:
+            f.write(struct.pack('<Q3d3Bd', point3D_id, *xyz, *rgb, error))
+            f.write(struct.pack('<Q', len(track)))
+            for image_id, point2D_idx in track:
+                f.write(struct.pack('<II', image_id, point2D_idx))
+
+
+def read_points3D_reference(path):
+    """Record by record, like the parser the vectorized reader replaced."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    points = []
+    offset = 8
+    for _ in range(struct.unpack_from('<Q', data, 0)[0]):
+        point3D_id, x, y, z, r, g, b, error, track_length = struct.unpack_from('<Q3d3BdQ', data, offset)
+        offset += 51 + 8 * track_length
+        points.append((point3D_id, (x, y, z), (r, g, b), error, track_length))
+    return points
+
+
+def test_known_records(tmp_path):
+    path = tmp_path / 'points3D.bin'
+    write_points3D_bin(path, [
+        (7, (1., 2., 3.), (255, 0, 10), 0.5, [(1, 4), (2, 9)]),
+        (9, (-1., 0., 1e6), (1, 2, 3), 12., []),
+        (12, (0.25, 0.5, 0.75), (9, 8, 7), 1.5, [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)]),
+    ])
+    points = read_points3D_bin(path)
+
+    assert points.dtype == POINT3D_DTYPE
+    assert points['point3D_id'].tolist() == [7, 9, 12]
+    assert points['xyz'].tolist() == [[1, 2, 3], [-1, 0, 1e6], [0.25, 0.5, 0.75]]
+    assert points['rgb'].tolist() == [[255, 0, 10], [1, 2, 3], [9, 8, 7]]
+    assert points['error'].tolist() == [0.5, 12, 1.5]
+    assert points['track_length'].tolist() == [2, 0, 5]
+    assert filter_points3D(points, min_track_length=2, max_reprojection_error=8)['point3D_id'].tolist() == [7, 12]
+
+
+def test_matches_record_by_record_parser(tmp_path):
+    rng = numpy.random.default_rng(0)
+    path = tmp_path / 'points3D.bin'
+    write_points3D_bin(path, [(i, rng.normal(size=3), rng.integers(0, 256, 3), rng.uniform(0, 4),
+                               [(j, i) for j in range(rng.integers(0, 8))]) for i in range(500)])
+    points = read_points3D_bin(path)
+    reference = read_points3D_reference(path)
+
+    assert len(points) == len(reference)
+    for point, (point3D_id, xyz, rgb, error, track_length) in zip(points, reference):
+        assert point['point3D_id'] == point3D_id
+        assert tuple(point['xyz']) == xyz
+        assert tuple(point['rgb']) == rgb
+        assert point['error'] == error
+        assert point['track_length'] == track_length
+
+
+def test_empty_model(tmp_path):
+    path = tmp_path / 'points3D.bin'
+    write_points3D_bin(path, [])
+    points = read_points3D_bin(path)
+    assert len(points) == 0
+    assert points.dtype == POINT3D_DTYPE
@@ -0,0 +1,88 @@
+import json
+import sys
+
+import pytest
+
+from src.SceneElements.conversion import ConversionJob, ConversionQueue
+
+# Commands of the jobs, run by the shell like the converter
+WAIT_FOR = '"{python}" -c "import os, time\nwhile not os.path.exists(\'{flag}\'): time.sleep(0.01)"'
+APPEND = '"{python}" -c "open(\'{path}\', \'a\').write(\'{name}\')"'
+
+
+def wait_for(flag) -> str:
+    return WAIT_FOR.format(python=sys.executable, flag=flag.as_posix())
+
+
+def append(path, name: str) -> str:
+    return APPEND.format(python=sys.executable, path=path.as_posix(), name=name)
+
+
+def test_lowest_priority_value_runs_first(tmp_path):
+    queue = ConversionQueue(workers=1)
+    flag, order = tmp_path / 'flag', tmp_path / 'order'
+    blocker = queue.submit(wait_for(flag), 'blocker')
+    jobs = [queue.submit(append(order, name), name, total_points=points)
+            for name, points in (('c', 300), ('a', 100), ('b', 200))]
+    jobs.append(queue.submit(append(order, 'd'), 'd', total_points=1, priority=1000))
+
+    flag.touch()
+    for job in [blocker] + jobs:
+        assert job.done.wait(30)
+    assert order.read_text() == 'abcd'
+    assert all(job.state == ConversionJob.DONE for job in jobs)
+    assert jobs[0].to_json()[ConversionJob.key_progress] == 1
+
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    queue = ConversionQueue(workers=1)
+    order = tmp_path / 'order'
+    running = queue.submit(wait_for(tmp_path / 'never'), 'running')
+    queued = queue.submit(append(order, 'queued'), 'queued')
+
+    assert queue.cancel(queued.job_id)
+    assert queued.done.is_set()
+    while running.state != ConversionJob.RUNNING:
+        running.done.wait(0.01)
+    assert queue.cancel(running.job_id)
+    assert running.done.wait(30)
+
+    assert running.state == queued.state == ConversionJob.CANCELLED
+    assert not order.exists()
+    assert not queue.cancel(queued.job_id)
+    assert not queue.cancel(12345)
+
+
+def test_failed_jobs_report_their_exit_code():
+    job = ConversionQueue(workers=1).submit(f'"{sys.executable}" -c "raise SystemExit(3)"', 'failing')
+    assert job.done.wait(30)
+    assert job.state == ConversionJob.FAILED
+    assert '3' in job.error
+
+
+def test_progress_of_both_converter_versions():
+    job = ConversionJob(0, 'cloud', '', total_points=2000000, priority=0)
+    assert job.update_progress('INDEXING: 1,000,000 points processed; 1,000,000 points written; 2.1 seconds passed')
+    assert job.progress == 0.5
+    assert job.update_progress('[75%, 5s], [INDEXING: 20%, duration: 1s]')
+    assert job.progress == 0.75
+    assert not job.update_progress('READING: cloud.ply')
+
+
+def test_cancel_request_allows_other_origins():
+    pytest.importorskip('numpy')
+    # Open3D also fails to import when a shared library it links against is missing
+    pytest.importorskip('open3d', exc_type=ImportError)
+    pytest.importorskip('flask_socketio')
+    from src.App.app import Tarasp
+
+    tarasp = Tarasp()
+    tarasp.CONVERSIONS = ConversionQueue(workers=0)
+    job = tarasp.CONVERSIONS.submit('exit 0', 'queued')
+    client = tarasp.app.test_client()
+
+    response = client.post(f'/conversions/{job.job_id}/cancel')
+    assert response.status_code == 200
+    assert json.loads(response.data)[ConversionJob.key_state] == ConversionJob.CANCELLED
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert client.post(f'/conversions/{job.job_id}/cancel').status_code == 404
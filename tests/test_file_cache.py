@@ -0,0 +1,65 @@
+import os
+import threading
+
+from src.App.file_cache import NodeCache, PathCache
+
+
+def test_path_cache_refuses_paths_outside_the_directory(tmp_path):
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'node.bin').write_bytes(b'1234')
+    (tmp_path / 'secret').write_bytes(b'0')
+    files = PathCache(str(tmp_path / 'data'))
+
+    resolved = files.resolve('node.bin')
+    assert resolved.size == 4
+    assert files.resolve('../secret') is None
+    assert files.resolve('missing.bin') is None
+
+
+def test_path_cache_keeps_the_stat_until_invalidated(tmp_path):
+    path = tmp_path / 'node.bin'
+    path.write_bytes(b'1234')
+    files = PathCache(str(tmp_path), ttl=60)
+    etag = files.resolve('node.bin').etag
+
+    path.write_bytes(b'123456')
+    os.utime(path, ns=(1, 1))
+    assert files.resolve('node.bin').etag == etag
+    files.invalidate('node.bin')
+    assert files.resolve('node.bin').etag != etag
+
+
+def test_node_cache_checks_the_etag_and_drops_the_least_recently_used(tmp_path):
+    files = PathCache(str(tmp_path))
+    for name in ('a', 'b', 'c'):
+        (tmp_path / name).write_bytes(name.encode() * 40)
+    cache = NodeCache(max_bytes=100)
+
+    cache.load('a', files.resolve('a'))
+    cache.load('b', files.resolve('b'))
+    assert cache.get('a', files.resolve('a').etag) == b'a' * 40
+    assert cache.get('a', 'other') is None
+    cache.load('c', files.resolve('c'))
+
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert cache.size == 80
+
+
+def test_node_cache_is_filled_from_several_threads(tmp_path):
+    files = PathCache(str(tmp_path))
+    for i in range(50):
+        (tmp_path / str(i)).write_bytes(bytes(100))
+    cache = NodeCache(max_bytes=1000)
+
+    def load(start):
+        for i in range(start, 50, 4):
+            cache.load(str(i), files.resolve(str(i)))
+            assert sum(str(j) in cache for j in range(50)) <= 10
+
+    threads = [threading.Thread(target=load, args=(start,)) for start in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.size == 1000
@@ -0,0 +1,52 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from src.SceneElements.lod import CameraLevelOfDetail, LineLevelOfDetail, Polylines, camera_centers  # noqa: E402
+
+IDENTITY = [1., 0., 0., 0.]
+
+
+def test_camera_centers_invert_the_pose():
+    # Camera centres are -R^T t, here a rotation of 90 degrees around z and a translation along x
+    quaternion = [numpy.cos(numpy.pi / 4), 0., 0., numpy.sin(numpy.pi / 4)]
+    centers = camera_centers([[[1., 0., 0.], quaternion, 'a.jpg'], [[0., 0., -2.], IDENTITY, 'b.jpg']])
+    assert numpy.allclose(centers, [[0., 1., 0.], [0., 0., 2.]])
+
+
+def test_camera_levels_grow_to_all_cameras():
+    cameras = [[[-float(i), 0., 0.], IDENTITY, f"{i}.jpg"] for i in range(100)]
+    for method in ('cluster', 'stride'):
+        lod = CameraLevelOfDetail(cameras, levels=4, method=method)
+        assert len(lod) == 4
+        assert lod.counts == sorted(lod.counts)
+        assert lod.counts[-1] == 100
+        assert lod.counts[0] < 100
+        assert lod.select(3).tolist() == list(range(100))
+
+
+def test_camera_level_selection_and_region():
+    cameras = [[[-float(i), 0., 0.], IDENTITY, f"{i}.jpg"] for i in range(10)]
+    lod = CameraLevelOfDetail(cameras, levels=2, method='stride')
+    assert lod.select_level(None) == 1
+    assert lod.select_level(1) == 0
+    assert lod.select_level(lod.counts[0]) == 0
+    region = (numpy.array([2.5, -1, -1]), numpy.array([6.5, 1, 1]))
+    assert lod.select(1, region).tolist() == [3, 4, 5, 6]
+
+
+def test_line_levels_merge_segments():
+    # Many short segments along a line collapse into a few grid segments on the coarse levels
+    line = [(x, 0., 0.) for x in numpy.linspace(0, 1, 1000)]
+    lod = LineLevelOfDetail([line, [(0., 1., 0.), (1., 1., 0.)]], levels=3)
+    assert lod.counts[-1] == 1000
+    assert lod.counts[0] < lod.counts[-1]
+    assert lod.select(2).to_list()[1] == [[0., 1., 0.], [1., 1., 0.]]
+
+
+def test_polylines_region():
+    lines = Polylines.from_lines([[(0, 0, 0), (1, 0, 0)], [(5, 5, 5), (6, 6, 6)], []])
+    assert len(lines) == 3
+    assert lines.segment_count() == 2
+    region = (numpy.array([4., 4., 4.]), numpy.array([10., 10., 10.]))
+    assert lines.select(region).to_list() == [[[5., 5., 5.], [6., 6., 6.]]]
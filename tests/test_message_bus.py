@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from src.App.message_bus import CAMERA_SYNC, SCENE_UPDATE, FRAME_HEADER, PendingFrames, UnixSocketBus, frame_key, \
+    run_broker
+
+
+def test_pending_camera_states_replace_each_other():
+    pending = PendingFrames(max_frames=3)
+    pending.add(b'a', frame_key(CAMERA_SYNC, {'sceneId': 0}))
+    pending.add(b'b', frame_key(SCENE_UPDATE, {'sceneId': 0}))
+    pending.add(b'c', frame_key(CAMERA_SYNC, {'sceneId': 1}))
+    pending.add(b'd', frame_key(CAMERA_SYNC, {'sceneId': 0}))
+    assert pending.take() == b'bcd'
+    assert pending.dropped == 1
+    assert len(pending) == 0
+
+
+def test_oldest_frames_are_dropped_beyond_the_limit():
+    pending = PendingFrames(max_frames=2)
+    for frame in (b'a', b'b', b'c'):
+        pending.add(frame)
+    assert pending.take() == b'bc'
+    assert pending.dropped == 1
+
+
+def wait_for(condition, timeout=5.):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def broker(tmp_path):
+    path = str(tmp_path / 'bus.sock')
+    threading.Thread(target=run_broker, args=(path,), daemon=True).start()
+    return path
+
+
+def test_a_process_that_stops_reading_does_not_hold_up_the_others(broker):
+    sender, receiver = UnixSocketBus(broker), UnixSocketBus(broker)
+    received = []
+    receiver.subscribe(CAMERA_SYNC, lambda message, origin: received.append(message['state']['lastUpdate']))
+    sender.start()
+    receiver.start()
+    # Connected like a bus, but never reads a frame
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(broker)
+    time.sleep(0.1)
+
+    state = {'position': [0.] * 3, 'padding': 'x' * 10000}
+    start = time.monotonic()
+    for i in range(2000):
+        sender.publish(CAMERA_SYNC, {'sceneId': 0, 'state': {**state, 'lastUpdate': i}}, 'sender')
+    assert time.monotonic() - start < 2
+
+    wait_for(lambda: len(received) > 0 and received[-1] == 1999)
+    assert received == sorted(received)
+    header = stalled.recv(FRAME_HEADER.size)
+    assert len(header) == FRAME_HEADER.size
+    for bus in (sender, receiver):
+        bus.close()
+    stalled.close()
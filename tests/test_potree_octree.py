@@ -0,0 +1,94 @@
+import json
+import os
+from itertools import product
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+pytest.importorskip('plyfile')
+
+from src.SceneElements.potree_octree import PotreeOctree, potree_statistics, update_potree, \
+    write_manifest  # noqa: E402
+from src.SceneElements.preprocessing import write_ply_arrays  # noqa: E402
+
+DEPTH = 2
+
+
+def empty_octree(directory):
+    """The layout of the PotreeConverter 1.6 with empty nodes down to DEPTH, points are then added by insert."""
+    os.makedirs(directory / 'data' / 'r')
+    box = {'lx': 0., 'ly': 0., 'lz': 0., 'ux': 8., 'uy': 8., 'uz': 8.}
+    cloud = {'version': '1.7', 'octreeDir': 'data', 'points': 0, 'boundingBox': box, 'tightBoundingBox': dict(box),
+             'pointAttributes': ['POSITION_CARTESIAN', 'COLOR_PACKED'], 'spacing': 2., 'scale': 0.001,
+             'hierarchyStepSize': 5}
+    (directory / 'cloud.js').write_text(json.dumps(cloud))
+    for level in range(DEPTH + 1):
+        for indices in product('01234567', repeat=level):
+            (directory / 'data' / 'r' / f"r{''.join(indices)}.bin").touch()
+    return str(directory)
+
+
+def convert(directory, points, colors):
+    octree = PotreeOctree(empty_octree(directory))
+    octree.write_hierarchy(octree.insert(points, colors))
+    octree.update_cloud(points)
+    return octree
+
+
+def node_files(directory):
+    root = directory / 'data' / 'r'
+    return {path.name: path.read_bytes() for path in root.iterdir() if path.stat().st_size > 0}
+
+
+@pytest.fixture
+def clouds():
+    rng = numpy.random.default_rng(0)
+    points = rng.uniform(0.01, 7.99, (3000, 3))
+    colors = rng.integers(0, 256, (3000, 3)).astype(numpy.uint8)
+    return points, colors
+
+
+def test_points_are_kept_once(tmp_path, clouds):
+    points, colors = clouds
+    octree = convert(tmp_path, points, colors)
+
+    assert sum(octree.nodes.values()) == len(points)
+    stored = numpy.concatenate([octree.read_node(name) for name in octree.nodes])
+    assert numpy.allclose(numpy.sort(stored, axis=0), numpy.sort(points, axis=0), atol=2e-3)
+    # Above the deepest level, no two points of a node share a cell of its spacing
+    for name in octree.nodes:
+        if len(name) - 1 < DEPTH:
+            keys = octree._cell_keys(name, octree.read_node(name))
+            assert len(numpy.unique(keys)) == len(keys)
+
+
+def test_incremental_update_matches_a_full_conversion(tmp_path, clouds):
+    points, colors = clouds
+    source = tmp_path / 'cloud.ply'
+    first = 2000
+
+    write_ply_arrays(source, points[:first], colors[:first], xyz_dtype='float64')
+    incremental = tmp_path / 'incremental'
+    convert(incremental, points[:first], colors[:first])
+    write_manifest(str(source), str(incremental))
+
+    write_ply_arrays(source, points, colors, xyz_dtype='float64')
+    assert update_potree(str(source), str(incremental))
+    convert(tmp_path / 'full', points, colors)
+
+    assert node_files(incremental) == node_files(tmp_path / 'full')
+    assert potree_statistics(str(incremental))[2] == len(points)
+    # Nothing was appended since the update
+    assert update_potree(str(source), str(incremental))
+
+
+def test_changed_sources_are_converted_again(tmp_path, clouds):
+    points, colors = clouds
+    source = tmp_path / 'cloud.ply'
+    write_ply_arrays(source, points, colors, xyz_dtype='float64')
+    target = tmp_path / 'octree'
+    convert(target, points, colors)
+    write_manifest(str(source), str(target))
+
+    write_ply_arrays(source, points[::-1], colors[::-1], xyz_dtype='float64')
+    assert not update_potree(str(source), str(target))
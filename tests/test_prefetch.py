@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+# Open3D also fails to import when a shared library it links against is missing
+pytest.importorskip('open3d', exc_type=ImportError)
+
+from src.App import prefetch  # noqa: E402
+from src.App.file_cache import NodeCache, PathCache  # noqa: E402
+from src.App.prefetch import NodePrefetcher, extrapolate_rotation, predict_cameras  # noqa: E402
+
+IDENTITY = [0., 0., 0., 1.]
+
+
+def state(position, last_update, quaternion=IDENTITY):
+    return {'position': position, 'quaternion': quaternion, 'lastUpdate': last_update}
+
+
+def test_predicted_cameras_continue_the_motion():
+    assert predict_cameras([state([0., 0., 0.], 0), state([0., 0., 0.], 100)]) == []
+
+    cameras = predict_cameras([state([0., 0., 0.], 0), state([1., 0., 0.], 100)], horizons=(0.5,))
+    assert numpy.allclose(cameras[0]['position'], [6., 0., 0.])
+    assert cameras[0]['lastUpdate'] == 600
+
+
+def test_rotation_is_extrapolated():
+    quarter = [0., numpy.sin(numpy.pi / 8), 0., numpy.cos(numpy.pi / 8)]
+    half = [0., numpy.sin(numpy.pi / 4), 0., numpy.cos(numpy.pi / 4)]
+    assert numpy.allclose(extrapolate_rotation(IDENTITY, quarter, 1.), half)
+
+
+def test_one_prediction_per_scene_and_interval(tmp_path, monkeypatch):
+    predictions = []
+    monkeypatch.setattr(prefetch, 'predict_cameras', lambda states: predictions.append(len(states)) or [])
+    prefetcher = NodePrefetcher(PathCache(str(tmp_path)), NodeCache(), interval=60)
+    scenes = [SimpleNamespace(scene_id=scene_id, elements=[]) for scene_id in range(2)]
+
+    for i in range(5):
+        prefetcher.observe(scenes[0], state([i, 0., 0.], i * 10))
+    prefetcher.observe(scenes[1], state([0., 0., 0.], 0))
+
+    assert predictions == [1, 1]
+    assert len(prefetcher.states[0]) == 5
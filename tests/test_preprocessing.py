@@ -0,0 +1,48 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+pytest.importorskip('plyfile')
+
+from src.SceneElements.preprocessing import downsample_ply, read_ply_arrays, voxel_downsample, voxel_keys, \
+    write_ply_arrays  # noqa: E402
+
+
+def test_voxel_keys_group_points_of_a_voxel():
+    points = numpy.array([[0.1, 0.1, 0.1], [0.9, 0.2, 0.5], [1.5, 0.1, 0.1], [0.2, 0.2, 3.4]])
+    keys = voxel_keys(points, 1.)
+    assert keys[0] == keys[1]
+    assert len(set(keys.tolist())) == 3
+
+
+def test_empty_clouds():
+    assert len(voxel_keys(numpy.zeros((0, 3)), 1.)) == 0
+    points, colors, normals = voxel_downsample(numpy.zeros((0, 3)), 1.)
+    assert points.shape == (0, 3)
+    assert colors is None and normals is None
+
+
+def test_representatives():
+    points = numpy.array([[0., 0., 0.], [0.5, 0., 0.], [0.6, 0., 0.], [5., 5., 5.]])
+    colors = numpy.array([[0, 0, 0], [30, 30, 30], [60, 60, 60], [255, 0, 0]], dtype=numpy.uint8)
+
+    centers, average_colors, _ = voxel_downsample(points, 1., colors)
+    order = numpy.argsort(centers[:, 0])
+    assert numpy.allclose(centers[order], [[0.366667, 0, 0], [5, 5, 5]], atol=1e-5)
+    assert average_colors[order].tolist() == [[30, 30, 30], [255, 0, 0]]
+
+    nearest, nearest_colors, _ = voxel_downsample(points, 1., colors, representative='nearest')
+    order = numpy.argsort(nearest[:, 0])
+    assert nearest[order].tolist() == [[0.5, 0, 0], [5, 5, 5]]
+    assert nearest_colors[order].tolist() == [[30, 30, 30], [255, 0, 0]]
+
+
+def test_downsampled_cloud_is_cached_without_leftovers(tmp_path):
+    source = tmp_path / 'cloud.ply'
+    points = numpy.random.default_rng(0).uniform(0, 10, (2000, 3))
+    write_ply_arrays(source, points)
+
+    target = downsample_ply(str(source), voxel_size=1.)
+    assert target != source
+    assert len(read_ply_arrays(str(target))[0]) <= 1000
+    assert downsample_ply(str(source), voxel_size=1.) == target
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == '.tmp'] == []
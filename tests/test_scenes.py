@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+# Open3D also fails to import when a shared library it links against is missing
+pytest.importorskip('open3d', exc_type=ImportError)
+pytest.importorskip('flask_socketio')
+
+from src.App.app import Tarasp, page_scene_id  # noqa: E402
+
+
+def camera_sync(client, scene_id, last_update):
+    client.emit('camera_sync', json.dumps({'sceneId': scene_id, 'state': {'position': [last_update, 0, 0],
+                                                                          'lastUpdate': last_update}}))
+
+
+def camera_updates(client):
+    return [message['args'][0] for message in client.get_received() if message['name'] == 'camera_sync']
+
+
+def test_page_scene_id():
+    assert page_scene_id({'QUERY_STRING': 'EIO=4&transport=polling&sceneId=3'}) == 3
+    assert page_scene_id({'HTTP_REFERER': 'http://127.0.0.1:5000/scene/2'}) == 2
+    assert page_scene_id({'HTTP_REFERER': 'http://127.0.0.1:5000/', 'QUERY_STRING': 'EIO=4'}) is None
+
+
+def test_clients_of_a_scene_page_sync_in_their_scene():
+    tarasp = Tarasp()
+    # The bundled front-end sends sceneId 0 whatever page it was opened from
+    sender = tarasp.socketio.test_client(tarasp.app, query_string='sceneId=1')
+    viewer = tarasp.socketio.test_client(tarasp.app)
+    viewer.emit('join_scene', json.dumps({'sceneId': 1}))
+    other = tarasp.socketio.test_client(tarasp.app)
+    other.emit('join_scene', json.dumps({'sceneId': 0}))
+
+    camera_sync(sender, 0, 0)
+    camera_sync(sender, 0, 100)
+
+    assert [state['lastUpdate'] for state in camera_updates(viewer)] == [100]
+    assert camera_updates(other) == []
+    assert 0 not in tarasp.CURRENT_CAMERA_STATE
@@ -0,0 +1,95 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+# Open3D also fails to import when a shared library it links against is missing
+pytest.importorskip('open3d', exc_type=ImportError)
+pytest.importorskip('flask_socketio')
+
+from src.App.app import Tarasp  # noqa: E402
+from src.App.snapshot import configuration_key, decode_state, encode_state  # noqa: E402
+from src.SceneElements.lod import LineLevelOfDetail  # noqa: E402
+from src.SceneElements.elements import DefaultPointCloud, LineSet  # noqa: E402
+from src.SceneElements.preprocessing import write_ply_arrays  # noqa: E402
+
+
+def build() -> Tarasp:
+    tarasp = Tarasp()
+    lines = [[(i, 0, 0), (i, 1, 0), (i + 1, 1, 0)] for i in range(50)]
+    tarasp.add_element(LineSet(lines, primitive_budget=20, name='lines'))
+    tarasp.add_element(DefaultPointCloud('data/cloud.ply', compact=True, name='cloud'))
+    return tarasp
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    points = numpy.random.default_rng(0).uniform(-10, 10, (1000, 3))
+    write_ply_arrays(tmp_path / 'data' / 'cloud.ply', points)
+    return tmp_path
+
+
+def test_restored_elements_serve_levels_of_detail_and_compact_exports(workspace):
+    prepared = build()
+    prepared.prepare('snapshot.json.gz')
+    client = prepared.app.test_client()
+    expected_lod = client.get('/lod/0/0?level=0').json
+    expected_compact = client.get('/compact/0/1').data
+
+    restored = build()
+    restored.prepare('snapshot.json.gz')
+    assert restored.COMPONENT_TREE == prepared.COMPONENT_TREE
+
+    client = restored.app.test_client()
+    lod = client.get('/lod/0/0?level=0')
+    assert lod.status_code == 200
+    assert lod.json == expected_lod
+    compact = client.get('/compact/0/1')
+    assert compact.status_code == 200
+    assert compact.data == expected_compact
+
+
+def test_changed_assets_are_prepared_again(workspace):
+    build().prepare('snapshot.json.gz')
+    points = numpy.random.default_rng(1).uniform(-10, 10, (500, 3))
+    write_ply_arrays(workspace / 'data' / 'cloud.ply', points)
+
+    restored = build()
+    restored.prepare('snapshot.json.gz')
+    assert restored.get_elements()[1].point_count == 500
+
+
+def test_snapshot_stores_json_and_arrays_only(workspace):
+    build().prepare('snapshot.json.gz')
+    with gzip.open(workspace / 'snapshot.json.gz', 'rt') as f:
+        snapshot = json.load(f)
+    assert set(snapshot['elements']) == {'0', '1'}
+    with numpy.load(workspace / 'snapshot.json.npz', allow_pickle=False) as arrays:
+        assert len(arrays.files) > 0
+
+
+def test_converted_state_round_trip():
+    lines = [[(0, 0, 0), (1, 0, 0), (1, 1, 0)], [(5, 5, 5), (6, 5, 5)]]
+    state = {'lod': LineLevelOfDetail(lines, 3), 'bounding_box': (numpy.zeros(3), numpy.ones(3)), 'count': 3}
+    arrays = {}
+    encoded = json.loads(json.dumps(encode_state(state, arrays)))
+    decoded = decode_state(encoded, arrays)
+
+    assert decoded['count'] == 3
+    assert isinstance(decoded['bounding_box'], tuple)
+    assert decoded['lod'].counts == state['lod'].counts
+    assert decoded['lod'].select(2).to_list() == state['lod'].select(2).to_list()
+
+
+def test_in_memory_data_is_part_of_the_configuration():
+    keys = []
+    for seed in range(2):
+        tarasp = Tarasp()
+        cloud = SimpleNamespace(points=numpy.random.default_rng(seed).uniform(size=(100, 3)))
+        tarasp.add_element(DefaultPointCloud(cloud, name='cloud'))
+        keys.append(configuration_key(tarasp))
+    assert keys[0] != keys[1]
@@ -0,0 +1,62 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+# Open3D also fails to import when a shared library it links against is missing
+pytest.importorskip('open3d', exc_type=ImportError)
+
+from src.App.spatial_index import BoundingVolumeHierarchy, Frustum  # noqa: E402
+
+# Rotated by 90 degrees around y, the camera looks along -x
+TURNED = [0., numpy.sin(numpy.pi / 4), 0., numpy.cos(numpy.pi / 4)]
+
+
+def camera(position, quaternion=(0., 0., 0., 1.), **settings):
+    return {'position': position, 'quaternion': list(quaternion), **settings}
+
+
+def test_frustum_intersects():
+    # Looking along -z from the origin with a vertical field of view of 60 degrees
+    frustum = Frustum(camera([0., 0., 0.]), aspect=1)
+    low = numpy.array([
+        [-1., -1., -10.],  # straight ahead
+        [-1., -1., 5.],  # behind
+        [50., -1., -10.],  # far to the side
+        [-1., -1., -200000.],  # beyond the far plane
+        [-15., -15., -30.],  # reaching into a corner
+        [-1., -1., -0.05],  # between the camera and the near plane
+    ])
+    high = low + 2
+    high[5] = [1., 1., -0.01]
+    assert frustum.intersects(low, high).tolist() == [True, False, False, False, True, False]
+    # A box around the camera
+    assert frustum.intersects(numpy.array([-0.5] * 3), numpy.array([0.5] * 3)).tolist() == [True]
+
+
+def test_frustum_follows_the_camera_settings():
+    turned = Frustum(camera([0., 0., 0.], TURNED), aspect=1)
+    boxes = numpy.array([[-11., -1., -1.], [9., -1., -1.]])
+    assert turned.intersects(boxes, boxes + 2).tolist() == [True, False]
+
+    narrow = Frustum(camera([0., 0., 0.], fov=10, far=50), aspect=1)
+    boxes = numpy.array([[5., -1., -20.], [-1., -1., -60.]])
+    assert narrow.intersects(boxes, boxes + 2).tolist() == [False, False]
+
+
+def test_hierarchy_finds_the_same_elements_as_testing_every_box():
+    rng = numpy.random.default_rng(0)
+    low = rng.uniform(-100, 100, (500, 3))
+    high = low + rng.uniform(0.1, 5, (500, 3))
+    ids = list(range(1000, 1500))
+    hierarchy = BoundingVolumeHierarchy(ids, list(zip(low, high)))
+
+    for i in range(20):
+        frustum = Frustum(camera(rng.uniform(-50, 50, 3).tolist(), TURNED if i % 2 else (0., 0., 0., 1.)))
+        expected = {ids[j] for j in numpy.flatnonzero(frustum.intersects(low, high))}
+        visible = hierarchy.visible(frustum)
+        assert {element_id for element_id, _ in visible} == expected
+        sizes = [size for _, size in visible]
+        assert sizes == sorted(sizes, reverse=True)
+
+
+def test_empty_hierarchy():
+    assert BoundingVolumeHierarchy([], []).visible(Frustum(camera([0., 0., 0.]))) == []
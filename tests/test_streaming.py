@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from src.SceneElements.streaming import PointStreamBuffer, absolute_voxel_keys  # noqa: E402
+
+
+def test_reads_continue_where_the_reader_stopped():
+    buffer = PointStreamBuffer()
+    points = numpy.arange(30, dtype=numpy.float32).reshape(10, 3)
+    buffer.append(points[:4])
+    buffer.append(points[4:], numpy.full((6, 3), 0.5))
+
+    read, colors = buffer.read(2, max_points=5)
+    assert read.tolist() == points[2:7].tolist()
+    assert colors[:, 0].tolist() == [255, 255, 127, 127, 127]
+    assert buffer.read(10)[0].shape == (0, 3)
+    assert len(buffer) == 10
+    assert buffer.bounds[0].tolist() == [0, 1, 2] and buffer.bounds[1].tolist() == [27, 28, 29]
+
+
+def test_a_voxel_keeps_its_first_point():
+    buffer = PointStreamBuffer(voxel_size=1.)
+    assert buffer.append([[0.1, 0.1, 0.1], [0.5, 0.5, 0.5], [1.5, 0.5, 0.5]]) == 2
+    assert buffer.append([[0.9, 0.9, 0.9], [-0.5, 0.5, 0.5], [1.2, 0.2, 0.2]]) == 1
+    assert numpy.allclose(buffer.read(0)[0], [[0.1, 0.1, 0.1], [1.5, 0.5, 0.5], [-0.5, 0.5, 0.5]])
+
+
+def test_voxel_keys_do_not_depend_on_other_points():
+    points = numpy.array([[0.5, 0.5, 0.5], [-0.5, 0.5, 0.5], [0.5, -0.5, 0.5], [0.5, 0.5, -0.5]])
+    keys = absolute_voxel_keys(points, 1.)
+    assert len(set(keys.tolist())) == 4
+    assert absolute_voxel_keys(points[1:], 1.).tolist() == keys[1:].tolist()
+
+
+def test_appends_from_several_threads():
+    buffer = PointStreamBuffer(voxel_size=1.)
+    grid = numpy.stack(numpy.meshgrid(*[numpy.arange(10)] * 3), axis=-1).reshape(-1, 3) + 0.5
+
+    def append(offset):
+        for chunk in numpy.array_split(numpy.roll(grid, offset, axis=0), 20):
+            buffer.append(chunk)
+
+    threads = [threading.Thread(target=append, args=(offset,)) for offset in (0, 250, 500, 750)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(buffer) == 1000
+    assert len(numpy.unique(buffer.read(0)[0], axis=0)) == 1000
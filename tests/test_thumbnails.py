@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from src.App.thumbnails import ThumbnailCache  # noqa: E402
+
+
+@pytest.fixture
+def cache(tmp_path):
+    source = tmp_path / 'data' / 'images'
+    source.mkdir(parents=True)
+    Image.new('RGB', (800, 600), (200, 40, 40)).save(source / 'frame.jpg')
+    return ThumbnailCache(str(tmp_path / 'thumbnails'), str(tmp_path / 'data'), sizes=[128, 256])
+
+
+def test_threads_creating_the_same_thumbnail_do_not_collide(cache, tmp_path):
+    file_name = str(tmp_path / 'data' / 'images' / 'frame.jpg')
+    with ThreadPoolExecutor(8) as pool:
+        targets = list(pool.map(lambda _: cache.get(file_name, 200), range(32)))
+
+    assert len(set(targets)) == 1
+    with Image.open(targets[0]) as thumbnail:
+        assert max(thumbnail.size) == 256
+    assert list(targets[0].parent.glob('*.tmp')) == []
+
+
+def test_files_outside_the_source_directory_are_refused(cache, tmp_path):
+    Image.new('RGB', (10, 10)).save(tmp_path / 'outside.jpg')
+    assert cache.get(str(tmp_path / 'outside.jpg'), 128) is None
+    assert cache.get(str(tmp_path / 'data' / 'images' / 'missing.jpg'), 128) is None
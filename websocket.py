@@ -1,12 +1,78 @@
 import asyncio
 import json
+from typing import Dict, Set
 
-import websockets
 from websockets import serve
+from websockets.exceptions import ConnectionClosed
 
-CURRENT_CAMERA_STATE = []
+DEFAULT_SCENE_ID = 0
 
-CONNECTIONS = []
+# scene_id -> last accepted camera state
+CURRENT_CAMERA_STATE = {}
+
+
+class Peer:
+    """A connected client with its own send queue.
+
+    Camera states are snapshots, only the newest one matters. If a slow client has not received the last state
+    when a new one arrives, the old one is replaced instead of queued, so it never falls further behind.
+    """
+
+    def __init__(self, websocket) -> None:
+        super().__init__()
+        self.websocket = websocket
+        self.scene_id = None
+        self.dropped = 0
+        self._pending = None
+        self._ready = asyncio.Event()
+
+    def send(self, message: str):
+        if self._pending is not None:
+            self.dropped += 1
+        self._pending = message
+        self._ready.set()
+
+    async def write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                message, self._pending = self._pending, None
+                await self.websocket.send(message)
+        except ConnectionClosed:
+            pass
+
+
+class ConnectionRegistry:
+    """Connected peers grouped by the scene they are looking at."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.scenes: Dict[int, Set[Peer]] = {}
+
+    def join(self, peer: Peer, scene_id: int):
+        if peer.scene_id == scene_id:
+            return
+        self.leave(peer)
+        peer.scene_id = scene_id
+        self.scenes.setdefault(scene_id, set()).add(peer)
+
+    def leave(self, peer: Peer):
+        peers = self.scenes.get(peer.scene_id)
+        if peers is not None:
+            peers.discard(peer)
+            if len(peers) == 0:
+                del self.scenes[peer.scene_id]
+        peer.scene_id = None
+
+    def broadcast(self, scene_id: int, message: str, sender: Peer = None):
+        # Sending only fills the queues of the peers, nothing is awaited while iterating
+        for peer in self.scenes.get(scene_id, ()):
+            if peer is not sender:
+                peer.send(message)
+
+
+CONNECTIONS = ConnectionRegistry()
 
 
 def load_camera_state():
@@ -29,25 +95,29 @@ def load_camera_state():
         "lastUpdate": 0
 
     }
-    CURRENT_CAMERA_STATE.append(state)
+    CURRENT_CAMERA_STATE[DEFAULT_SCENE_ID] = state
 
 
 async def handler(websocket):
-    CONNECTIONS.append(websocket)
-
-    while True:
-        message = await websocket.recv()
-        state = json.loads(message)
-        last_update = CURRENT_CAMERA_STATE[0]['lastUpdate']
-        if last_update + 30 < state['lastUpdate']:
-            CURRENT_CAMERA_STATE[0] = state
-            # print(CURRENT_CAMERA_STATE[0])
-
-            if len(CONNECTIONS) > 1:
-                CONNECTIONS.remove(websocket)
-
-            websockets.broadcast(CONNECTIONS, message)
-            CONNECTIONS.append(websocket)
+    peer = Peer(websocket)
+    CONNECTIONS.join(peer, DEFAULT_SCENE_ID)
+    writer = asyncio.create_task(peer.write())
+
+    try:
+        async for message in websocket:
+            state = json.loads(message)
+            scene_id = state.get('sceneId', DEFAULT_SCENE_ID)
+            CONNECTIONS.join(peer, scene_id)
+
+            current = CURRENT_CAMERA_STATE.get(scene_id)
+            if current is None or current['lastUpdate'] + 30 < state['lastUpdate']:
+                CURRENT_CAMERA_STATE[scene_id] = state
+                CONNECTIONS.broadcast(scene_id, message, sender=peer)
+    except ConnectionClosed:
+        pass
+    finally:
+        CONNECTIONS.leave(peer)
+        writer.cancel()
 
 
 async def main():